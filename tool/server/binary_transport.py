@@ -0,0 +1,92 @@
+"""Binary transport for numpy arrays served by the API server.
+
+A bundle is laid out as:
+    magic (4 bytes, b'TTVB') | header length (uint32, little-endian) | header (utf-8 json) | padding | array buffers
+
+The header describes every array as {name, dtype, shape, offset, nbytes}, where offset is relative to the
+start of the buffer section. Buffers are little-endian and 8-byte aligned so that the client can wrap them
+with typed arrays without copying.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'TTVB'
+ALIGNMENT = 8
+MIMETYPE = 'application/octet-stream'
+
+# dtype names understood by the web client
+SUPPORTED_DTYPES = {
+    'float32': np.dtype('<f4'),
+    'float16': np.dtype('<f2'),
+    'int32': np.dtype('<i4'),
+    'uint32': np.dtype('<u4'),
+    'int16': np.dtype('<i2'),
+    'uint16': np.dtype('<u2'),
+    'int8': np.dtype('i1'),
+    'uint8': np.dtype('u1'),
+}
+
+def _aligned(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _dtype_name(dtype):
+    for name, supported in SUPPORTED_DTYPES.items():
+        if np.dtype(dtype).newbyteorder('<') == supported:
+            return name
+    raise ValueError(f"Unsupported dtype for binary transport: {dtype}")
+
+def pack_arrays(arrays, meta=None):
+    """
+    Pack named numpy arrays into one binary bundle.
+
+    Args:
+        arrays (dict): name -> numpy.ndarray, packed in insertion order
+        meta (dict): optional json-serializable metadata stored in the header
+
+    Returns:
+        bytes: the encoded bundle
+    """
+    entries = []
+    buffers = []
+    offset = 0
+    for name, array in arrays.items():
+        dtype_name = _dtype_name(array.dtype)
+        data = np.ascontiguousarray(array, dtype=SUPPORTED_DTYPES[dtype_name]).tobytes()
+        entries.append({
+            'name': name,
+            'dtype': dtype_name,
+            'shape': list(array.shape),
+            'offset': offset,
+            'nbytes': len(data),
+        })
+        buffers.append(data)
+        buffers.append(b'\0' * (_aligned(len(data)) - len(data)))
+        offset += _aligned(len(data))
+
+    header = json.dumps({'arrays': entries, 'meta': meta or {}}).encode('utf-8')
+    header += b' ' * (_aligned(len(MAGIC) + 4 + len(header)) - len(MAGIC) - 4 - len(header))
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] + buffers)
+
+def unpack_arrays(payload):
+    """
+    Decode a bundle produced by pack_arrays.
+
+    Returns:
+        (dict, dict): name -> numpy.ndarray (read-only views of payload), meta
+    """
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary array bundle")
+    header_len, = struct.unpack_from('<I', payload, len(MAGIC))
+    header_start = len(MAGIC) + 4
+    header = json.loads(payload[header_start:header_start + header_len].decode('utf-8'))
+    data_start = header_start + header_len
+
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = SUPPORTED_DTYPES[entry['dtype']]
+        start = data_start + entry['offset']
+        array = np.frombuffer(payload, dtype=dtype, count=entry['nbytes'] // dtype.itemsize, offset=start)
+        arrays[entry['name']] = array.reshape(entry['shape'])
+    return arrays, header['meta']
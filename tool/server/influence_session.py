@@ -0,0 +1,32 @@
+"""Warm influence function sessions.
+
+Building an influence session (subject model, training data loader and the training gradients computed by the
+influence function) dominates the cost of /getInfluenceSamples. Sessions are kept per (content_path, epoch,
+kind) and reused until the checkpoint they were built from changes. At most max_sessions are resident, the
+least recently used one is dropped first.
+
+The pool size defaults to 2 and can be changed with the TTV_INFLUENCE_SESSIONS environment variable.
+"""
+import os
+import threading
+
+from artifact_cache import KeyedLRU
+
+DEFAULT_MAX_SESSIONS = 2
+
+
+class InfluenceSession:
+    def __init__(self, **resources):
+        self.__dict__.update(resources)
+        # influence queries on one model are not thread safe (they write parameter gradients)
+        self.lock = threading.Lock()
+
+
+def _release_memory():
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+# get(key, paths, factory): key is e.g. (kind, content_path, epoch), paths the checkpoint and data files
+influence_sessions = KeyedLRU(int(os.environ.get('TTV_INFLUENCE_SESSIONS', DEFAULT_MAX_SESSIONS)), on_evict=_release_memory)
@@ -0,0 +1,290 @@
+"""Per-route request instrumentation.
+
+Every request is timed from before_request to after_request. The record of a request also holds the response
+size, the time spent loading artifacts on cache misses (by artifact kind, see artifact_cache.py), the time
+spent serializing json and packing binary bundles, and the number of artifact cache hits and misses.
+
+Aggregates are exposed in two forms:
+    - prometheus_text(): cumulative counters and histograms in the Prometheus text format
+    - rolling_summary(): histograms and percentiles over the last WINDOW requests of every route
+
+Metrics are kept per process. With preforked workers (see shared_state.py) every worker publishes a snapshot
+of its metrics to the shared board at most every PUBLISH_INTERVAL seconds, and both forms merge the snapshots
+of all workers, so /metrics describes the whole server whichever worker answers.
+"""
+import copy
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+WINDOW = 1024
+PREFIX = 'ttv'
+PUBLISH_INTERVAL = 1.0
+
+def _current():
+    # per request record, None outside of requests (e.g. background threads)
+    if has_request_context():
+        return g.get('_instrumentation')
+    return None
+
+def record_phase(phase, seconds):
+    """Add seconds to a named phase of the current request."""
+    record = _current()
+    if record is not None:
+        record['phases'][phase] += seconds
+
+
+class timed_phase:
+    """Context manager timing a block as a phase of the current request."""
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_phase(self.phase, time.perf_counter() - self.start)
+        return False
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask json provider that accounts serialization time to the json_serialize phase."""
+    def dumps(self, obj, **kwargs):
+        with timed_phase('json_serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[int(np.searchsorted(self.buckets, value, side='left'))] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+class RouteStats:
+    def __init__(self, window=WINDOW):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.status = defaultdict(int)
+        self.phases = defaultdict(float)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.recent = deque(maxlen=window)  # (duration, response bytes)
+
+    def merge(self, other):
+        self.duration.merge(other.duration)
+        self.response_bytes.merge(other.response_bytes)
+        for status, count in other.status.items():
+            self.status[status] += count
+        for phase, seconds in other.phases.items():
+            self.phases[phase] += seconds
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.recent.extend(other.recent)
+
+
+def merge_snapshots(snapshots):
+    """Per route stats and artifact cache stats summed over the snapshots of several processes."""
+    routes = defaultdict(lambda: RouteStats(window=None))  # the recent requests of every worker
+    cache = None
+    for snapshot in snapshots:
+        for route, stats in snapshot['routes'].items():
+            routes[route].merge(stats)
+        if snapshot['cache'] is not None:
+            cache = dict(snapshot['cache']) if cache is None else {name: cache[name] + value for name, value in snapshot['cache'].items()}
+    return dict(routes), cache
+
+
+class Instrumentation:
+    def __init__(self):
+        self._routes = defaultdict(RouteStats)
+        self._lock = threading.Lock()
+        self._cache = None
+        self._version = 0           # number of recorded requests, to skip unchanged publications
+        self._shared = None         # board of all workers, see share()
+        self._publisher_pid = None
+
+    def init_app(self, app, cache=None):
+        """Install the request hooks and the timed json provider, observe cache if given."""
+        app.json = TimedJSONProvider(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if cache is not None:
+            self._cache = cache
+            cache.add_observer(self._observe_cache)
+
+    def share(self, board):
+        """Publish the metrics of this process to board (shared_state.MetricsBoard) and report all of them."""
+        self._shared = board
+
+    def _ensure_publisher(self):
+        # started in the worker on its first request, threads do not survive fork
+        if self._shared is not None and self._publisher_pid != os.getpid():
+            self._publisher_pid = os.getpid()
+            threading.Thread(target=self._publish_loop, name='metrics-publisher', daemon=True).start()
+
+    def _publish_loop(self):
+        published = None
+        while True:
+            time.sleep(PUBLISH_INTERVAL)
+            if self._version != published:
+                published = self._version
+                try:
+                    self._shared.publish(os.getpid(), self.snapshot())
+                except Exception as e:
+                    print(f"Publishing metrics failed: {e}")
+
+    def _before_request(self):
+        self._ensure_publisher()
+        g._instrumentation = {'start': time.perf_counter(), 'phases': defaultdict(float), 'hits': 0, 'misses': 0}
+
+    def _observe_cache(self, key, hit, seconds):
+        record = _current()
+        if record is None:
+            return
+        if hit:
+            record['hits'] += 1
+        else:
+            record['misses'] += 1
+            kind = key[0] if isinstance(key, tuple) else 'artifact'
+            record['phases'][f'load_{kind}'] += seconds
+
+    def _after_request(self, response):
+        record = g.pop('_instrumentation', None)
+        if record is None:
+            return response
+        duration = time.perf_counter() - record['start']
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        size = response.content_length
+        if size is None and not response.is_streamed and not response.direct_passthrough:
+            size = len(response.get_data())
+        size = size or 0
+
+        with self._lock:
+            stats = self._routes[route]
+            stats.duration.observe(duration)
+            stats.response_bytes.observe(size)
+            stats.status[response.status_code] += 1
+            for phase, seconds in record['phases'].items():
+                stats.phases[phase] += seconds
+            stats.cache_hits += record['hits']
+            stats.cache_misses += record['misses']
+            stats.recent.append((duration, size))
+            self._version += 1
+        response.headers['Server-Timing'] = f'app;dur={duration * 1000:.1f}'
+        return response
+
+    def snapshot(self):
+        """Copy of the metrics of this process."""
+        with self._lock:
+            routes = copy.deepcopy(dict(self._routes))
+        return {'routes': routes, 'cache': self._cache.stats() if self._cache is not None else None}
+
+    def _merged(self):
+        snapshot = self.snapshot()
+        if self._shared is None:
+            return merge_snapshots([snapshot])
+        try:
+            # the answering worker is always up to date, the others are at most PUBLISH_INTERVAL behind
+            self._shared.publish(os.getpid(), snapshot)
+            return merge_snapshots(self._shared.snapshots())
+        except Exception as e:
+            print(f"Reading shared metrics failed, reporting this worker only: {e}")
+            return merge_snapshots([snapshot])
+
+    def prometheus_text(self):
+        lines = []
+        def metric(name, kind, help_text):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+        def histogram(name, attribute):
+            for route, stats in routes:
+                hist = getattr(stats, attribute)
+                cumulative = 0
+                for bound, count in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_{name}_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_{name}_sum{{route="{route}"}} {hist.sum}')
+                lines.append(f'{PREFIX}_{name}_count{{route="{route}"}} {hist.count}')
+
+        merged_routes, cache_stats = self._merged()
+        routes = sorted(merged_routes.items())
+        metric('request_duration_seconds', 'histogram', 'Request wall time per route.')
+        histogram('request_duration_seconds', 'duration')
+        metric('response_bytes', 'histogram', 'Response body size per route.')
+        histogram('response_bytes', 'response_bytes')
+        metric('requests_total', 'counter', 'Requests per route and status code.')
+        for route, stats in routes:
+            for status, count in sorted(stats.status.items()):
+                lines.append(f'{PREFIX}_requests_total{{route="{route}",status="{status}"}} {count}')
+        metric('request_phase_seconds_total', 'counter', 'Time spent in artifact loading and serialization phases.')
+        for route, stats in routes:
+            for phase, seconds in sorted(stats.phases.items()):
+                lines.append(f'{PREFIX}_request_phase_seconds_total{{route="{route}",phase="{phase}"}} {seconds}')
+        metric('route_cache_lookups_total', 'counter', 'Artifact cache lookups made by requests of a route.')
+        for route, stats in routes:
+            lines.append(f'{PREFIX}_route_cache_lookups_total{{route="{route}",result="hit"}} {stats.cache_hits}')
+            lines.append(f'{PREFIX}_route_cache_lookups_total{{route="{route}",result="miss"}} {stats.cache_misses}')
+
+        if cache_stats is not None:
+            for name, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                               ('entries', 'gauge'), ('current_bytes', 'gauge'), ('max_bytes', 'gauge')):
+                suffix = '_total' if kind == 'counter' else ''
+                metric(f'artifact_cache_{name}{suffix}', kind, f'Artifact cache {name.replace("_", " ")}.')
+                lines.append(f'{PREFIX}_artifact_cache_{name}{suffix} {cache_stats[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def rolling_summary(self):
+        """Per route histogram and percentiles of the last WINDOW requests (of every worker)."""
+        summary = {}
+        merged_routes, cache_stats = self._merged()
+        for route, stats in merged_routes.items():
+            if not stats.recent:
+                continue
+            recent = np.asarray(stats.recent, dtype=np.float64)
+            durations, sizes = recent[:, 0], recent[:, 1]
+            lookups = stats.cache_hits + stats.cache_misses
+            summary[route] = {
+                'window': len(recent),
+                'duration_seconds': {
+                    'p50': float(np.percentile(durations, 50)),
+                    'p90': float(np.percentile(durations, 90)),
+                    'p99': float(np.percentile(durations, 99)),
+                    'max': float(durations.max()),
+                    'buckets': list(DURATION_BUCKETS) + ['+Inf'],
+                    'counts': np.bincount(np.searchsorted(DURATION_BUCKETS, durations, side='left'),
+                                          minlength=len(DURATION_BUCKETS) + 1).tolist(),
+                },
+                'response_bytes': {
+                    'mean': float(sizes.mean()),
+                    'max': int(sizes.max()),
+                },
+                'phases_seconds_total': dict(stats.phases),
+                'cache_hit_rate': stats.cache_hits / lookups if lookups else None,
+            }
+        if cache_stats is not None:
+            summary['_artifact_cache'] = cache_stats
+        return summary
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,171 @@
+"""Background jobs for long running visualization runs.
+
+Each job runs visualize_run in its own worker process, so a DVI/TimeVis run does not block the flask
+worker that received /startVisualizing. At most max_concurrent jobs run at the same time, the others wait
+in a FIFO queue. Every worker reports progress through its own pipe, a dispatcher thread in the server
+process collects it, starts pending jobs and reaps finished ones. Since no channel is shared between jobs,
+terminating a cancelled worker cannot corrupt the messages of the others.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+TERMINAL_STATUS = (FINISHED, FAILED, CANCELLED)
+
+DEFAULT_MAX_CONCURRENT = 1
+POLL_INTERVAL = 0.2
+
+def _run_job(run_args, connection):
+    # executed in the worker process, connection is the sending end of the pipe of this job
+    from run_visualization import visualize_run
+
+    def progress(stage, current=None, total=None):
+        connection.send(('progress', (stage, current, total)))
+
+    try:
+        visualize_run(*run_args, progress=progress)
+        connection.send(('finished', None))
+    except Exception:
+        connection.send(('failed', traceback.format_exc()))
+        raise
+    finally:
+        connection.close()
+
+
+class VisualizationJobManager:
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        # spawn instead of fork: workers may initialize CUDA, and the server process runs threads
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = OrderedDict()   # job_id -> job record
+        self._processes = {}         # job_id -> (running process, receiving end of its pipe)
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._dispatcher = None
+
+    def submit(self, content_path, vis_method, vis_id, data_type, task_type, vis_config):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': PENDING,
+                'content_path': content_path,
+                'vis_method': vis_method,
+                'vis_id': vis_id,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'stage': None,
+                'progress': {},
+                'error': None,
+                '_args': (content_path, vis_method, vis_id, data_type, task_type, vis_config),
+            }
+            self._pending.append(job_id)
+            self._ensure_dispatcher()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job is not None else None
+
+    def list(self):
+        with self._lock:
+            return [self._public(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """Cancel a pending or running job, return False if the job is unknown or already done."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] in TERMINAL_STATUS:
+                return False
+            if job['status'] == PENDING:
+                self._pending.remove(job_id)
+            else:
+                process, connection = self._processes.pop(job_id)
+                process.terminate()
+                process.join()
+                connection.close()
+            job['status'] = CANCELLED
+            job['finished_at'] = time.time()
+            return True
+
+    def _public(self, job):
+        return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='vis-job-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._lock:
+                for job_id, (process, connection) in list(self._processes.items()):
+                    alive = process.is_alive()
+                    # messages sent right before a worker exited are drained before its final status is set
+                    self._drain_messages(self._jobs[job_id], connection)
+                    if not alive:
+                        process.join()
+                        connection.close()
+                        del self._processes[job_id]
+                        self._finalize(self._jobs[job_id], process.exitcode)
+                self._start_pending()
+            time.sleep(POLL_INTERVAL)
+
+    def _drain_messages(self, job, connection):
+        try:
+            while connection.poll():
+                kind, payload = connection.recv()
+                if kind == 'progress':
+                    stage, current, total = payload
+                    job['stage'] = stage
+                    job['progress'][stage] = {'current': current, 'total': total}
+                elif kind == 'failed':
+                    job['error'] = payload
+        except (EOFError, OSError):
+            # the worker closed its end (or exited), its exit code decides the status
+            pass
+
+    def _finalize(self, job, exitcode):
+        if job['status'] in TERMINAL_STATUS:
+            return
+        job['status'] = FINISHED if exitcode == 0 else FAILED
+        if job['status'] == FAILED and job['error'] is None:
+            job['error'] = f"worker exited with code {exitcode}"
+        job['finished_at'] = time.time()
+
+    def _start_pending(self):
+        while self._pending and len(self._processes) < self.max_concurrent:
+            job_id = self._pending.popleft()
+            job = self._jobs[job_id]
+            receiver, sender = self._context.Pipe(duplex=False)
+            process = self._context.Process(target=_run_job, args=(job['_args'], sender), name=f'vis-job-{job_id}')
+            try:
+                process.start()
+            except Exception:
+                # only this job fails, the dispatcher keeps serving the queue
+                receiver.close()
+                job['status'] = FAILED
+                job['error'] = traceback.format_exc()
+                job['finished_at'] = time.time()
+                continue
+            finally:
+                # the worker holds its own copy, closing ours lets recv() see EOF when it exits
+                sender.close()
+            self._processes[job_id] = (process, receiver)
+            job['status'] = RUNNING
+            job['started_at'] = time.time()
+
+
+job_manager = VisualizationJobManager(int(os.environ.get('TTV_MAX_VIS_JOBS', DEFAULT_MAX_CONCURRENT)))
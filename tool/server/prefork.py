@@ -0,0 +1,75 @@
+"""Preforked multi-process serving.
+
+The parent process binds the listening socket and preloads the arrays of the configured content paths into
+the artifact cache, then forks the workers. Preloaded arrays are read-only, so their pages stay shared
+between the workers (copy-on-write) instead of every worker loading its own copy. Each worker runs a
+threaded werkzeug server on the shared socket, the kernel distributes the connections.
+
+Notes:
+    - arrays loaded after the fork (other content paths, new epochs) are cached per worker
+    - visualization jobs and request metrics are kept in a manager process shared by the workers, see
+      shared_state.py
+    - only available on platforms with os.fork
+"""
+import os
+import signal
+import sys
+
+from werkzeug.serving import make_server
+
+def _serve_worker(server):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles ctrl-c
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+def _start_worker(server):
+    pid = os.fork()
+    if pid == 0:
+        _serve_worker(server)
+    return pid
+
+def serve_prefork(app, host, port, workers, preload=None):
+    """
+    Serve app with several forked worker processes.
+
+    Args:
+        app (flask.Flask): the application
+        host (str), port (int): address to bind
+        workers (int): number of worker processes
+        preload (callable): optional, called in the parent before forking, e.g. to fill the artifact cache
+    """
+    server = make_server(host, port, app, threaded=True)
+    if preload is not None:
+        preload()
+
+    children = {_start_worker(server) for _ in range(workers)}
+    print(f"Serving on http://{host}:{port} with {workers} workers", flush=True)
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            # a worker crashed, replace it
+            print(f"Worker {pid} exited with status {status}, restarting", flush=True)
+            children.add(_start_worker(server))
+    server.server_close()
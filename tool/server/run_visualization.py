@@ -52,7 +52,7 @@ def initialize_config(content_path, vis_method, vis_id, data_type, task_type, vi
     
     return config
 
-def init_visualize_component(config):
+def init_visualize_component(config, progress=None):
     import torch
     from visualize.strategy.projector import DVIProjector, TimeVisProjector, UmapProjector, DynaVisProjector
     from visualize.strategy.dvi_strategy import DeepVisualInsight
@@ -69,13 +69,13 @@ def init_visualize_component(config):
     if config['vis_method'] == "DVI":
         data_provider = DataProvider(config, device)  
         projector = DVIProjector(config)
-        visualizer = ResultGenerator(config, data_provider, projector)
-        strategy = DeepVisualInsight(config, data_provider)
+        visualizer = ResultGenerator(config, data_provider, projector, progress=progress)
+        strategy = DeepVisualInsight(config, data_provider, progress)
     elif config['vis_method'] == "TimeVis":
         data_provider = DataProvider(config, device)  
         projector = TimeVisProjector(config)
-        visualizer = ResultGenerator(config, data_provider, projector)
-        strategy = TimeVis(config, data_provider)
+        visualizer = ResultGenerator(config, data_provider, projector, progress=progress)
+        strategy = TimeVis(config, data_provider, progress)
     elif config['vis_method'] == "DynaVis":
         if 'selected_idxs' in config['vis_config']:
             selected_idxs = config['vis_config']['selected_idxs']
@@ -84,29 +84,37 @@ def init_visualize_component(config):
         data_provider = DataProvider(config, device, selected_idxs)
         data_provider = DataProvider(config, device)  
         projector = DynaVisProjector(config)
-        visualizer = ResultGenerator(config, data_provider, projector)
+        visualizer = ResultGenerator(config, data_provider, projector, progress=progress)
         strategy = DynaVis(config, data_provider, selected_idxs)
     elif config['vis_method'] == "UMAP":
         data_provider = DataProvider(config, device)  
         projector = UmapProjector(config)
-        visualizer = UmapResultGenerator(config, data_provider, projector)
+        visualizer = UmapResultGenerator(config, data_provider, projector, progress)
         strategy = None
     else:
         raise NotImplementedError
     
     return visualizer, strategy
 
-def visualize_run(content_path, vis_method, vis_id, data_type, task_type, vis_config):
+def visualize_run(content_path, vis_method, vis_id, data_type, task_type, vis_config, progress=None):
+    """
+    progress (callable, optional): progress(stage, current, total) is called when a stage advances,
+        stages are "edge_construction", "training", "projection" and "background"
+    """
     # step 1: initialize config
     config = initialize_config(content_path, vis_method, vis_id, data_type, task_type, vis_config)
 
     if vis_method == "DynaVis":
         from visualize.dynavis.runner import DynaVisRunner
         runner = DynaVisRunner(content_path, vis_id, data_type, task_type, vis_config)
+        if progress is not None:
+            progress("training", 0, 1)
         runner.run()
+        if progress is not None:
+            progress("training", 1, 1)
     else:
         # step 2: initialize data provider, visualizer, and strategy
-        visualizer, strategy = init_visualize_component(config)
+        visualizer, strategy = init_visualize_component(config, progress)
         
         # step 3: generate visualization results
         if vis_method == "DVI" or vis_method == "TimeVis":
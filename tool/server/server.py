@@ -1,7 +1,8 @@
+import json
 import os
 import sys
 # from llm_agent import call_llm_agent
-from run_visualization import visualize_run
+from job_manager import job_manager
 
 from flask import request, Flask, jsonify, make_response, send_file,send_from_directory
 from flask_cors import CORS, cross_origin
@@ -12,20 +13,64 @@ sys.path.append('../..')
 sys.path.append('../visualize')
 
 from server_utils import *
+from binary_transport import pack_arrays, MIMETYPE as BINARY_MIMETYPE
+from thumbnail_atlas import compose_thumbnails, MAX_THUMBNAILS
+from instrumentation import instrumentation, timed_phase
+from artifact_cache import artifact_cache
 
 # flask for API server
 app = Flask(__name__)
-cors = CORS(app, supports_credentials=True)
+cors = CORS(app, supports_credentials=True, expose_headers=['X-Thumbnail-Layout'])
 app.config['CORS_HEADERS'] = 'Content-Type'
+instrumentation.init_app(app, artifact_cache)
+
+DEFAULT_VIEWPORT_BUDGET = 50000
+MAX_VIEWPORT_BUDGET = 500000
 
 # Check for "--dev" argument
 is_dev_mode = "--dev" in sys.argv
 
+def make_binary_response(arrays, meta=None):
+    with timed_phase('binary_pack'):
+        payload = pack_arrays(arrays, meta)
+    response = make_response(payload, 200)
+    response.mimetype = BINARY_MIMETYPE
+    return response
+
+def make_file_response(file_path):
+    if file_path is None or not os.path.isfile(file_path):
+        return make_response(jsonify({'error_message': 'File not found'}), 404)
+    # strong ETag and Last-Modified from the file, conditional requests are answered with 304;
+    # no-cache makes the browser revalidate since a new visualization run rewrites the files
+    response = send_file(os.path.abspath(file_path), conditional=True, etag=True, max_age=None)
+    response.cache_control.no_cache = True
+    return response
+
 @app.route("/", methods=["GET", "POST"])
 def GUI():
     return send_from_directory('../frontend', 'index.html')
 
 
+"""
+Api: request metrics of the server, summed over all workers when preforked
+
+Request (query string):
+    format (str, optional): "prometheus" (default) for the Prometheus text format, "json" for per route
+        histograms and percentiles over the most recent requests
+Response:
+    text/plain metrics, or json
+"""
+@app.route('/metrics', methods=["GET"])
+@cross_origin()
+def get_metrics():
+    if request.args.get('format') == 'json':
+        return make_response(jsonify(instrumentation.rolling_summary()), 200)
+    response = make_response(instrumentation.prometheus_text(), 200)
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
 """
 Api: get training process info
 
@@ -63,7 +108,7 @@ def get_training_process_info():
     if config == None or 'classes' not in config:
         # infer from labels.npy
         label_file = os.path.join(content_path, 'dataset', 'labels.npy')
-        labels = np.load(label_file, allow_pickle=True)
+        labels = load_npy(label_file, allow_pickle=True)
         class_num = len(np.unique(labels))
         color_list  = get_coloring_list(class_num)
         label_text_list = [str(i) for i in range(class_num)]
@@ -86,10 +131,10 @@ Request:
     content_path (str)
     vis_id (str)
     epoch (str): epoch number
+    format (str, optional): "json" (default) or "binary"
 Response:
-    config (dict)
-    project (list)
-    label_list (list): label list of samples in projection
+    json: projection (list)
+    binary: bundle with one float32 array "projection" of shape [N, 2], see binary_transport.py
 """
 @app.route('/updateProjection', methods = ["POST"])
 @cross_origin()
@@ -99,6 +144,10 @@ def update_projection():
     vis_id = req['vis_id']
     epoch = int(req['epoch'])
 
+    if req.get('format', 'json') == 'binary':
+        projection = load_projection_array(content_path, vis_id, epoch, dtype=np.float32)
+        return make_binary_response({'projection': projection}, {'epoch': epoch})
+
     projection = load_projection(content_path, vis_id, epoch)
 
     result = jsonify({
@@ -108,7 +157,103 @@ def update_projection():
 
 
 """
-Api: start training visualization model and get visualization result
+Api: get the points of one epoch inside a viewport, at most budget of them, see spatial_index.py
+
+Request:
+    content_path (str)
+    vis_id (str)
+    epoch (int)
+    viewport (list of float): [x_min, y_min, x_max, y_max] in projection coordinates
+    budget (int, optional): maximum number of points, default DEFAULT_VIEWPORT_BUDGET
+Response:
+    binary bundle, see binary_transport.py, with index int32 [K] (display order), projection float32 [K, 2],
+    label int32 [K] and count uint32 [K] (number of points a representative stands for, 1 for exact points)
+    meta: level (null when the points are exact, otherwise the quadtree level of the representatives),
+    visible (approximate number of points in the viewport)
+"""
+@app.route('/getViewportPoints', methods = ["POST"])
+@cross_origin()
+def get_viewport_points():
+    req = request.get_json()
+    content_path = req['content_path']
+    vis_id = req['vis_id']
+    epoch = int(req['epoch'])
+    try:
+        viewport = np.asarray(req['viewport'], dtype=np.float64)
+        budget = int(req.get('budget', DEFAULT_VIEWPORT_BUDGET))
+    except (TypeError, ValueError):
+        viewport, budget = None, -1
+    if viewport is None or viewport.shape != (4,) or not np.all(np.isfinite(viewport)) \
+            or viewport[0] > viewport[2] or viewport[1] > viewport[3] or budget < 0:
+        return make_response(jsonify({'error_message': 'viewport must be [x_min, y_min, x_max, y_max] with finite values, '
+                                                       'x_min <= x_max and y_min <= y_max, and budget non-negative'}), 400)
+    budget = min(budget, MAX_VIEWPORT_BUDGET)
+
+    try:
+        spatial_index = load_spatial_index(content_path, vis_id, epoch)
+    except FileNotFoundError as e:
+        return make_response(jsonify({'error_message': f'projection not found: {e}'}), 400)
+
+    with timed_phase('viewport_query'):
+        result = spatial_index.query(viewport, budget)
+    index = result['index']
+    return make_binary_response({
+        'index': index.astype(np.int32),
+        'projection': spatial_index.positions[index],
+        'label': spatial_index.labels[index].astype(np.int32),
+        'count': result['count'].astype(np.uint32),
+    }, {'level': result['level'], 'visible': result['visible']})
+
+"""
+Api: get projections of several epochs in one response, used to prefetch a whole training trajectory
+
+Request:
+    content_path (str)
+    vis_id (str)
+    epochs (list of int, optional): epochs to include
+    start_epoch (int, optional), end_epoch (int, optional): inclusive epoch range, used when epochs is not given
+    dtype (str, optional): "float32" (default) or "float16"
+    encoding (str, optional): "deflate" or "zstd" to get the delta/int16 encoded stream of projection_codec.py
+Response:
+    binary bundle with "projection" [T, N, 2] and "epochs" int32 [T], see binary_transport.py
+    or the encoded projection stream if encoding is given
+"""
+@app.route('/getProjectionBundle', methods = ["POST"])
+@cross_origin()
+def get_projection_bundle():
+    req = request.get_json()
+    content_path = req['content_path']
+    vis_id = req['vis_id']
+    dtype = req.get('dtype', 'float32')
+    if dtype not in ('float32', 'float16'):
+        return make_response(jsonify({'error_message': f'unsupported dtype: {dtype}'}), 400)
+
+    epochs = req.get('epochs')
+    if epochs is None:
+        start_epoch = req.get('start_epoch')
+        end_epoch = req.get('end_epoch')
+        epochs = [epoch for epoch in available_projection_epochs(content_path, vis_id)
+                  if (start_epoch is None or epoch >= int(start_epoch)) and (end_epoch is None or epoch <= int(end_epoch))]
+
+    try:
+        if req.get('encoding'):
+            response = make_response(load_encoded_projection_stack(content_path, vis_id, epochs, req['encoding']), 200)
+            response.mimetype = BINARY_MIMETYPE
+            return response
+        projection = load_projection_stack(content_path, vis_id, epochs, dtype=dtype)
+    except FileNotFoundError as e:
+        return make_response(jsonify({'error_message': f'projection not found: {e}'}), 400)
+    except ValueError as e:
+        return make_response(jsonify({'error_message': str(e)}), 400)
+
+    return make_binary_response({
+        'projection': projection,
+        'epochs': np.asarray(epochs, dtype=np.int32),
+    })
+
+
+"""
+Api: start training visualization model and generating visualization result in a background job
 
 Request:
     content_path (str)
@@ -116,7 +261,7 @@ Request:
     task_type (str): "classification", "regression"
     vis_config (dict): visualization config
 Response:
-    None
+    job_id (str): use /getVisualizingJob to follow the progress
 """
 @app.route('/startVisualizing', methods = ["POST"])
 def start_visualizing():
@@ -128,9 +273,38 @@ def start_visualizing():
     task_type = req['task_type']
     vis_config = req['vis_config']
     
-    visualize_run(content_path, vis_method, vis_id, data_type, task_type, vis_config)
+    job_id = job_manager.submit(content_path, vis_method, vis_id, data_type, task_type, vis_config)
     
-    return make_response({}, 200)
+    return make_response(jsonify({'job_id': job_id}), 200)
+
+"""
+Api: get status and per-stage progress of a visualization job
+
+Request:
+    job_id (str)
+Response:
+    job (dict): status ("pending", "running", "finished", "failed", "cancelled"), stage, progress, error, ...
+"""
+@app.route('/getVisualizingJob', methods = ["GET"])
+@cross_origin()
+def get_visualizing_job():
+    job = job_manager.get(request.args.get('job_id'))
+    if job is None:
+        return make_response(jsonify({'error_message': 'job not found'}), 404)
+    return make_response(jsonify({'job': job}), 200)
+
+@app.route('/listVisualizingJobs', methods = ["GET"])
+@cross_origin()
+def list_visualizing_jobs():
+    return make_response(jsonify({'jobs': job_manager.list()}), 200)
+
+@app.route('/cancelVisualizingJob', methods = ["POST"])
+@cross_origin()
+def cancel_visualizing_job():
+    req = request.get_json()
+    if not job_manager.cancel(req['job_id']):
+        return make_response(jsonify({'error_message': 'job not found or already finished'}), 400)
+    return make_response(jsonify({'job': job_manager.get(req['job_id'])}), 200)
 
 """
 Api: get text data of all samples
@@ -155,6 +329,40 @@ def get_all_text():
     })
     return make_response(result, 200)
 
+"""
+Api: get text data of a range of samples
+
+Request:
+    content_path (str)
+    start (int, optional): index of the first sample, default 0
+    count (int, optional): number of samples, default 1000, at most 10000
+Response:
+    text_list (list of str)
+    start (int)
+    total (int): number of texts in the corpus
+"""
+@app.route('/getTextRange', methods = ["POST"])
+@cross_origin()
+def get_text_range_api():
+    req = request.get_json()
+    content_path = req['content_path']
+    start = int(req.get('start', 0))
+    count = min(int(req.get('count', 1000)), 10000)
+    if start < 0 or count < 0:
+        return make_response(jsonify({'error_message': 'start and count must be non-negative'}), 400)
+
+    try:
+        text_list, total = get_text_range(content_path, start, count)
+    except FileNotFoundError:
+        return make_response(jsonify({'error_message': 'text file not found'}), 400)
+
+    result = jsonify({
+        'text_list': text_list,
+        'start': start,
+        'total': total
+    })
+    return make_response(result, 200)
+
 @app.route('/getAlignment', methods = ["POST"])
 def get_alignment():
     req = request.get_json()
@@ -198,16 +406,64 @@ def get_attributes():
     return make_response(result, 200)
 
 
+"""
+Api: get several attributes of several epochs in one binary response
+
+Request:
+    content_path (str)
+    attributes (list of str): "label", "prediction", "representation", "intra_similarity", "inter_similarity"
+    epochs (list of int, optional): epochs to include
+    start_epoch (int, optional), end_epoch (int, optional): inclusive epoch range, used when epochs is not given
+    float_dtype (str, optional): "float16" (default) or "float32", dtype of the float attributes
+Response:
+    binary bundle, see binary_transport.py, with "epochs" int32 [T] and one array per attribute:
+    label [N] and prediction [T, N] as class indices (uint16, or int32 with more than 65535 classes),
+    float attributes as [T, N, ...], all in display order
+"""
+@app.route('/getAttributeColumns', methods = ["POST"])
+@cross_origin()
+def get_attribute_columns():
+    req = request.get_json()
+    content_path = req['content_path']
+    attributes = req['attributes']
+    float_dtype = req.get('float_dtype', 'float16')
+    if float_dtype not in ('float32', 'float16'):
+        return make_response(jsonify({'error_message': f'unsupported dtype: {float_dtype}'}), 400)
+    unknown = [attribute for attribute in attributes if attribute not in ATTRIBUTE_FILES]
+    if unknown:
+        return make_response(jsonify({'error_message': f'unknown attributes: {unknown}'}), 400)
+
+    epochs = req.get('epochs')
+    if epochs is None:
+        start_epoch = req.get('start_epoch')
+        end_epoch = req.get('end_epoch')
+        epochs = [epoch for epoch in available_content_epochs(content_path)
+                  if (start_epoch is None or epoch >= int(start_epoch)) and (end_epoch is None or epoch <= int(end_epoch))]
+    epochs = [int(epoch) for epoch in epochs]
+
+    try:
+        columns = load_attribute_columns(content_path, epochs, attributes, float_dtype=np.dtype(float_dtype))
+    except FileNotFoundError as e:
+        return make_response(jsonify({'error_message': f'attribute not found: {e}'}), 400)
+
+    columns['epochs'] = np.asarray(epochs, dtype=np.int32)
+    return make_binary_response(columns)
+
+
 """
 Api: get simple filter result
 
 Request:
     content_path (str)
     epoch (str)
-    filter_type (str): "label", "prediction", "train", "test"
-    filter_data (str): label name
+    filters (list): each filter is either
+        {filter_type (str): "label", "prediction", "train", "test", "correct", "incorrect",
+         filter_data (str): label name, for "label" and "prediction"}
+        or a nested group {filters (list), combine (str)}
+    combine (str, optional): "and" (default) or "or", how the filters are combined
+    format (str, optional): "json" (default) or "binary", binary returns an int32 array bundle
 Response:
-    indices (list of int): indeices of samples that satisfy the filter
+    indices (list of int): sorted indices of samples that satisfy the filters
 """
 @app.route('/getSimpleFilterResult', methods = ["POST"])
 @cross_origin()
@@ -216,15 +472,20 @@ def get_simple_filter_result():
     content_path = req['content_path']
     epoch = int(req['epoch'])
     filters = req['filters']
+    combine = req.get('combine', 'and')
+    response_format = req.get('format', 'json')
 
     config = read_file_as_json(os.path.join(content_path, 'config.json'))
-    indices, error_message = get_filter_result(config, content_path, epoch, filters)
+    indices, error_message = get_filter_result(config, content_path, epoch, filters, combine)
 
     if indices is None:
         return make_response(jsonify({'error_message': error_message}), 400)
 
+    if response_format == 'binary':
+        return make_binary_response({'indices': indices})
+
     result = jsonify({
-        'indices': indices
+        'indices': indices.tolist()
     })
     return make_response(result, 200)
 
@@ -290,6 +551,100 @@ def get_image_data():
         return make_response(result, 200)
 
 
+"""
+Api: get background image of one epoch as a png file, supports conditional GET (ETag / Last-Modified)
+
+Request (query string):
+    content_path (str)
+    vis_id (str)
+    epoch (int)
+Response:
+    image/png, 304 if the cached copy is still valid
+"""
+@app.route('/files/background', methods = ["GET"])
+@cross_origin()
+def get_background_file():
+    content_path = request.args.get('content_path')
+    vis_id = request.args.get('vis_id')
+    epoch = request.args.get('epoch', type=int)
+    if content_path is None or vis_id is None or epoch is None:
+        return make_response(jsonify({'error_message': 'content_path, vis_id and epoch are required'}), 400)
+    return make_file_response(resolve_artifact_path(content_path, epoch, 'background.png', vis_id))
+
+"""
+Api: get image of one sample as a png file, supports conditional GET (ETag / Last-Modified)
+
+Request (query string):
+    content_path (str)
+    index (int): sample index
+Response:
+    image/png, 304 if the cached copy is still valid
+"""
+@app.route('/files/image', methods = ["GET"])
+@cross_origin()
+def get_image_file():
+    content_path = request.args.get('content_path')
+    index = request.args.get('index', type=int)
+    if content_path is None or index is None:
+        return make_response(jsonify({'error_message': 'content_path and index are required'}), 400)
+    return make_file_response(resolve_image_path(content_path, index))
+
+"""
+Api: get one per-epoch artifact file, supports conditional GET (ETag / Last-Modified)
+
+Request (query string):
+    content_path (str)
+    epoch (int)
+    name (str): file name, one of EPOCH_ARTIFACTS, or VIS_EPOCH_ARTIFACTS when vis_id is given
+    vis_id (str, optional): serve from visualize/<vis_id>/epochs instead of epochs
+Response:
+    the file, 304 if the cached copy is still valid
+"""
+@app.route('/files/epochArtifact', methods = ["GET"])
+@cross_origin()
+def get_epoch_artifact_file():
+    content_path = request.args.get('content_path')
+    epoch = request.args.get('epoch', type=int)
+    name = request.args.get('name')
+    vis_id = request.args.get('vis_id')
+    if content_path is None or epoch is None or name is None:
+        return make_response(jsonify({'error_message': 'content_path, epoch and name are required'}), 400)
+    file_path = resolve_artifact_path(content_path, epoch, name, vis_id)
+    if file_path is None:
+        return make_response(jsonify({'error_message': f'Artifact {name} is not available'}), 400)
+    return make_file_response(file_path)
+
+"""
+Api: get thumbnails of several samples as one png mosaic
+
+Request:
+    content_path (str)
+    indices (list of int): sample indices, at most MAX_THUMBNAILS
+Response:
+    image/png mosaic, the X-Thumbnail-Layout header holds the layout as json:
+        thumb_size (int): size of one grid cell
+        columns (int): number of grid columns
+        rects (list): [x, y, width, height] of every requested sample in the mosaic, null if it has no image
+"""
+@app.route('/getThumbnails', methods = ["POST"])
+@cross_origin()
+def get_thumbnails():
+    req = request.get_json()
+    content_path = req['content_path']
+    indices = [int(index) for index in req.get('indices', [])]
+    if len(indices) > MAX_THUMBNAILS:
+        return make_response(jsonify({'error_message': f'At most {MAX_THUMBNAILS} thumbnails per request'}), 400)
+
+    try:
+        png, layout = compose_thumbnails(content_path, indices)
+    except Exception as e:
+        return make_response(jsonify({'error_message': f'Error in loading thumbnails: {e}'}), 400)
+
+    response = make_response(png, 200)
+    response.mimetype = 'image/png'
+    response.headers['X-Thumbnail-Layout'] = json.dumps(layout)
+    return response
+
 """
 Api: get text data of one sample
 
@@ -323,13 +678,14 @@ def get_text_data():
 
 
 """
-Api: get high dimensional neighbors of one sample
+Api: get high dimensional neighbors of all samples or one sample
 
 Request:
     content_path (str)
     epoch (str)
+    index (int, optional): only return the neighbors of this sample
 Response:
-    neighbors (array[][])
+    neighbors (array[][]), or array[] if index is given
 """
 @app.route('/getOriginalNeighbors', methods = ["POST"])
 @cross_origin()
@@ -337,9 +693,10 @@ def get_original_neighbors():
     req = request.get_json()
     content_path = req['content_path']
     epoch = int(req['epoch'])
+    index = int(req['index']) if req.get('index') is not None else None
     
     try:
-        neighbors = calculate_high_dimensional_neighbors(content_path, epoch)
+        neighbors = calculate_high_dimensional_neighbors(content_path, epoch, index=index)
         result = jsonify({
             'neighbors': neighbors,
         })
@@ -349,14 +706,15 @@ def get_original_neighbors():
         return make_response(jsonify({'error_message': 'Error in calculating neighbors'}), 400)
 
 """
-Api: get projection neighbors of one sample
+Api: get projection neighbors of all samples or one sample
 
 Request:
     content_path (str)
     vis_id (str)
     epoch (str)
+    index (int, optional): only return the neighbors of this sample
 Response:
-    neighbors (array[][])
+    neighbors (array[][]), or array[] if index is given
 """
 @app.route('/getProjectionNeighbors', methods = ["POST"])
 @cross_origin()
@@ -365,9 +723,10 @@ def get_projection_neighbors():
     content_path = req['content_path']
     vis_id = req['vis_id']
     epoch = int(req['epoch'])
+    index = int(req['index']) if req.get('index') is not None else None
     
     try:
-        neighbors = calculate_projection_neighbors(content_path, vis_id, epoch)
+        neighbors = calculate_projection_neighbors(content_path, vis_id, epoch, index=index)
         result = jsonify({
             'neighbors': neighbors,
         })
@@ -377,6 +736,22 @@ def get_projection_neighbors():
         return make_response(jsonify({'error_message': 'Error in calculating neighbors'}), 400)
 
     
+"""
+Api: get neighbor trustworthiness and continuity of the projection
+
+Request:
+    content_path (str)
+    vis_id (str)
+    epoch (str)
+    k (int or list of int, optional): neighborhood sizes, default 10
+    sample_size (int, optional): evaluate a random subset and report 95% confidence intervals
+    exact (bool, optional): compute exact ranks beyond the stored neighbor depth
+Response:
+    neighbor_trustworthiness (float), neighbor_continuity (float): for the smallest k
+    per_k (dict): metrics for every k
+    bound (str or null): 'upper' when ranks beyond rank_depth were clamped (exact false), the metrics are then
+        upper bounds of the exact values; null for exact metrics
+"""
 @app.route('/getVisualizeMetrics', methods = ["POST"])
 @cross_origin()
 def get_visualize_metrics():
@@ -384,9 +759,13 @@ def get_visualize_metrics():
     content_path = req['content_path']
     vis_id = req['vis_id']
     epoch = int(req['epoch'])
+    ks = req.get('k', 10)
+    ks = ks if isinstance(ks, list) else [ks]
+    sample_size = int(req['sample_size']) if req.get('sample_size') else None
+    exact = bool(req.get('exact', False))
     
     try:
-        metrics = calculate_visualize_metrics(content_path, vis_id, epoch)
+        metrics = calculate_visualize_metrics(content_path, vis_id, epoch, ks, sample_size=sample_size, exact=exact)
         result = jsonify(metrics)
         return make_response(result, 200)
     except Exception as e:
@@ -422,6 +801,22 @@ def get_influence_samples():
         return make_response(jsonify({'error_message': 'Error in calculating influence samples'}), 400)
 
 
+"""
+Api: calculate training events of one epoch, results are cached under epochs/epoch_<epoch>/events
+
+Request:
+    content_path (str)
+    epoch (int)
+    event_types (list of str): "PredictionFlip", "ConfidenceChange", "SignificantMovement", "InconsistentMovement"
+    params (dict, optional): detector parameters, see DEFAULT_PARAMS in training_event.py
+    use_cache (bool, optional): default true, false recomputes the events
+    sort (str, optional): "default" (by type, most significant first), "magnitude" (largest change first over
+        all types) or "index" (sample index)
+    offset (int, optional), limit (int, optional): page of the sorted events, default all events
+Response:
+    training_events (list of dict): events of the page
+    totals (dict): {total, by_type}, number of events before paging
+"""
 @app.route('/calculateTrainingEvents', methods=["POST"])
 @cross_origin()
 def calculate_training_events():
@@ -429,11 +824,21 @@ def calculate_training_events():
     content_path = req['content_path']
     epoch = int(req['epoch'])
     event_types = req['event_types']
+    params = req.get('params')
+    use_cache = bool(req.get('use_cache', True))
+    sort = req.get('sort', 'default')
+    offset = int(req.get('offset', 0))
+    limit = req.get('limit')
+    limit = None if limit is None else int(limit)
+    if offset < 0 or (limit is not None and limit < 0):
+        return make_response(jsonify({'error_message': 'offset and limit must not be negative'}), 400)
 
     try:
-        training_events = compute_training_events(content_path, epoch, event_types)
+        training_events, totals = compute_training_events(content_path, epoch, event_types, params, use_cache,
+                                                          sort, offset, limit)
         result = jsonify({
             "training_events": training_events,
+            "totals": totals,
         })
         return make_response(result, 200)
     except Exception as e:
@@ -462,7 +867,30 @@ if __name__ == "__main__":
     while check_port_inuse(port, host):
         port = port + 1
 
-    if not is_dev_mode:
+    # production mode: python server.py --workers 4 --preload /path/to/content_path
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--preload', action='append', default=[], help='content_path to load before forking workers')
+    args, _ = parser.parse_known_args()
+
+    if not is_dev_mode and args.workers > 1 and hasattr(os, 'fork'):
+        from prefork import serve_prefork
+        from shared_state import start_shared_state
+
+        # jobs and metrics live in one manager process, whichever worker answers a request
+        shared_state = start_shared_state()
+        job_manager = shared_state.job_manager
+        instrumentation.share(shared_state.metrics)
+
+        def preload():
+            for content_path in args.preload:
+                print(f"Preloaded {content_path}: {preload_content(content_path)}")
+        try:
+            serve_prefork(app, host, port, args.workers, preload)
+        finally:
+            shared_state.shutdown()
+    elif not is_dev_mode:
         app.run(host=host, port=port)
     else:
         from livereload import Server
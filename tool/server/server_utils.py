@@ -1,8 +1,6 @@
 import io
 import math
 import random
-from sklearn.neighbors import NearestNeighbors
-from tqdm import tqdm
 import os
 import json
 import re
@@ -11,19 +9,17 @@ import sys
 import base64
 from PIL import Image
 
-import matplotlib.pyplot as plt
-import torch
-import torchvision
-import torchvision.transforms as transforms
-from torch.utils.data import Dataset, DataLoader
-from transformers import RobertaTokenizer
-
 sys.path.append('..')
 sys.path.append('../visualize')
-from visualize.data_provider import DataProvider
-from visualize.training_event import TrainingEventDetector
-from influence_function.IF import EmpiricalIF, PairWiseEmpiricalIF
-from influence_function.CustomEncoderModel import CustomEncoderModel
+from artifact_cache import artifact_cache, load_npy, load_json, npy_exists, npy_source_paths, write_atomic
+from sample_index import sample_indices
+from text_store import load_text_store
+from influence_session import InfluenceSession, influence_sessions
+from projection_codec import encode_projection_stack, decode_projection_stack, read_header_from_file, FILE_NAME as PROJECTION_FILE_NAME
+from spatial_index import SpatialIndex
+
+# heavy dependencies (torch, torchvision, transformers, matplotlib, sklearn, influence functions) are imported
+# inside the functions that need them, so that the server starts without loading them
 
 # Func: infer available epochs files, return a list of available epochs
 def infer_epoch_structure(content_path):
@@ -43,23 +39,147 @@ def infer_epoch_structure(content_path):
 
 # Func: get coloring list
 def get_coloring_list(class_num):
+    import matplotlib.pyplot as plt
     # color = get_standard_classes_color(class_num) * 255
     color_map = plt.get_cmap('tab10')
     color = color_map(range(class_num))
     color_255 = (color[:, :3] * 255).astype(np.uint8)
     return color_255.tolist()
 
+# Func: load all projections of a visualization from its encoded projection file (see projection_codec.py)
+def load_encoded_projections(content_path, vis_id):
+    encoded_path = os.path.join(content_path, "visualize", vis_id, PROJECTION_FILE_NAME)
+
+    def loader():
+        with open(encoded_path, 'rb') as f:
+            stack, header = decode_projection_stack(f.read())
+        stack.setflags(write=False)
+        return stack, header['epochs']
+
+    return artifact_cache.get(('encoded_projections', encoded_path), [encoded_path], loader, nbytes=lambda value: value[0].nbytes)
+
+# Func: read the projection of one epoch in storage order, falls back to the encoded projection file
+def read_raw_projection(content_path, vis_id, epoch, cached=True):
+    projection_path = os.path.join(content_path, "visualize", vis_id, "epochs", f"epoch_{epoch}", "projection.npy")
+    if os.path.exists(projection_path):
+        return load_npy(projection_path) if cached else np.load(projection_path)
+    if npy_exists(projection_path):
+        return load_npy(projection_path)
+    stack, epochs = load_encoded_projections(content_path, vis_id)
+    if epoch not in epochs:
+        raise FileNotFoundError(projection_path)
+    return stack[epochs.index(epoch)]
+
+# Func: load the arrays of content_path into the artifact cache, used before forking server workers
+def preload_content(content_path):
+    ordered_sample_indices(content_path)
+    load_npy(os.path.join(content_path, 'dataset', 'labels.npy'))
+
+    epochs_dir = os.path.join(content_path, 'epochs')
+    if os.path.isdir(epochs_dir):
+        for folder_name in sorted(os.listdir(epochs_dir)):
+            for file_name in ('embeddings.npy', 'predictions.npy', 'representation_neighbors.npy'):
+                file_path = os.path.join(epochs_dir, folder_name, file_name)
+                if npy_exists(file_path):
+                    load_npy(file_path)
+
+    visualize_dir = os.path.join(content_path, 'visualize')
+    if os.path.isdir(visualize_dir):
+        for vis_id in sorted(os.listdir(visualize_dir)):
+            if os.path.exists(os.path.join(visualize_dir, vis_id, PROJECTION_FILE_NAME)):
+                load_encoded_projections(content_path, vis_id)
+            for epoch in available_projection_epochs(content_path, vis_id):
+                read_raw_projection(content_path, vis_id, epoch)
+                neighbor_path = os.path.join(get_neighbor_index_dir(content_path, epoch, 'projection', vis_id), 'projection_neighbors.npy')
+                if os.path.exists(neighbor_path):
+                    load_npy(neighbor_path)
+    return artifact_cache.stats()
+
+# Func: load projection of certain epoch as numpy array, reordered by sample index
+def load_projection_array(content_path, vis_id, epoch, dtype=None):
+    projection = read_raw_projection(content_path, vis_id, epoch)
+
+    projection = projection[ordered_sample_indices(content_path)]
+
+    if dtype is not None:
+        projection = projection.astype(dtype, copy=False)
+    return projection
+
 # Func: load projection of certain epoch
 def load_projection(content_path, vis_id, epoch):
+    return load_projection_array(content_path, vis_id, epoch).tolist()
+
+# Func: spatial index of the projection of one epoch (display order), built on first use, see spatial_index.py
+def load_spatial_index(content_path, vis_id, epoch):
     projection_path = os.path.join(content_path, "visualize", vis_id, "epochs", f"epoch_{epoch}", "projection.npy")
-    projection = np.load(projection_path)
-    projection_list = projection.tolist()
+    encoded_path = os.path.join(content_path, "visualize", vis_id, PROJECTION_FILE_NAME)
+    index_file_path = os.path.join(content_path, 'dataset', 'index.json')
+    label_path = os.path.join(content_path, 'dataset', 'labels.npy')
+
+    def loader():
+        projection = load_projection_array(content_path, vis_id, epoch)
+        if os.path.exists(label_path):
+            labels = np.maximum(load_class_column(label_path)[ordered_sample_indices(content_path)], 0)
+        else:
+            labels = np.zeros(len(projection), dtype=np.int32)
+        return SpatialIndex(projection, labels)
+
+    key = ('spatial_index', content_path, vis_id, int(epoch))
+    return artifact_cache.get(key, npy_source_paths(projection_path) + [encoded_path, index_file_path, label_path], loader,
+                              nbytes=lambda index: index.nbytes)
+
+# Func: epochs that have a saved projection for the visualization
+def available_projection_epochs(content_path, vis_id):
+    epochs_dir = os.path.join(content_path, 'visualize', vis_id, 'epochs')
+    encoded_path = os.path.join(content_path, 'visualize', vis_id, PROJECTION_FILE_NAME)
+    available_epochs = []
+    if os.path.exists(encoded_path):
+        available_epochs = list(read_header_from_file(encoded_path)['epochs'])
+    elif os.path.isdir(epochs_dir):
+        for folder_name in os.listdir(epochs_dir):
+            if folder_name.startswith("epoch_") and npy_exists(os.path.join(epochs_dir, folder_name, 'projection.npy')):
+                try:
+                    available_epochs.append(int(folder_name.split("_")[1]))
+                except ValueError:
+                    continue
+    available_epochs.sort()
+    return available_epochs
 
-    index_dict = load_or_create_index(content_path)
-    all_indices = index_dict['train'] + index_dict['test']
-    projection_list = [projection_list[i] for i in all_indices]
+# Func: load projections of several epochs as one [T, N, 2] array, built once and kept in the artifact cache
+def load_projection_stack(content_path, vis_id, epochs, dtype=np.float32):
+    epochs = [int(epoch) for epoch in epochs]
+    projection_paths = [os.path.join(content_path, "visualize", vis_id, "epochs", f"epoch_{epoch}", "projection.npy") for epoch in epochs]
+    encoded_path = os.path.join(content_path, "visualize", vis_id, PROJECTION_FILE_NAME)
+    index_file_path = os.path.join(content_path, 'dataset', 'index.json')
 
-    return projection_list
+    def loader():
+        order = ordered_sample_indices(content_path)
+        stack = np.empty((len(epochs), len(order), 2), dtype=dtype)
+        for t, epoch in enumerate(epochs):
+            # bypass the per-epoch cache, the stack already holds the data
+            stack[t] = read_raw_projection(content_path, vis_id, epoch, cached=False)[order]
+        stack.setflags(write=False)
+        return stack
+
+    key = ('projection_stack', content_path, vis_id, tuple(epochs), np.dtype(dtype).str)
+    source_paths = [path for projection_path in projection_paths for path in npy_source_paths(projection_path)]
+    return artifact_cache.get(key, source_paths + [encoded_path, index_file_path], loader)
+
+# Func: delta/int16 encoded projections of several epochs in display order, see projection_codec.py
+def load_encoded_projection_stack(content_path, vis_id, epochs, compression='deflate'):
+    epochs = [int(epoch) for epoch in epochs]
+    projection_paths = [os.path.join(content_path, "visualize", vis_id, "epochs", f"epoch_{epoch}", "projection.npy") for epoch in epochs]
+    encoded_path = os.path.join(content_path, "visualize", vis_id, PROJECTION_FILE_NAME)
+    index_file_path = os.path.join(content_path, 'dataset', 'index.json')
+
+    def loader():
+        # the float stack is only built on a miss
+        stack = load_projection_stack(content_path, vis_id, epochs)
+        return encode_projection_stack(stack, epochs=epochs, compression=compression)
+
+    key = ('encoded_projection_stack', content_path, vis_id, tuple(epochs), compression)
+    source_paths = [path for projection_path in projection_paths for path in npy_source_paths(projection_path)]
+    return artifact_cache.get(key, source_paths + [encoded_path, index_file_path], loader, nbytes=len)
 
 # Func: load one sample from content_path
 def load_one_sample(config, content_path, index):
@@ -99,11 +219,8 @@ def get_all_texts(content_path, from_file=True):
     text_list = []
     
     if from_file:
-        file_path = os.path.join(content_path, 'dataset', 'text.txt')
-        with open(file_path, 'r') as f:
-            content = f.read()
-        lines = content.splitlines()
-        text_list = lines    
+        store = load_text_store(os.path.join(content_path, 'dataset', 'text.txt'))
+        text_list = store.range(0, len(store))
     else:
         parent_directory = os.path.join(content_path, 'dataset', 'text')
 
@@ -124,8 +241,7 @@ def get_alignment_data(content_path):
     if not os.path.exists(alignment_path):
         return []
 
-    with open(alignment_path, "r", encoding="utf-8") as f:
-        json_data = json.load(f)
+    json_data = load_json(alignment_path)
     pairs = json_data.get("ground_truth_pairs", [])   # [[i,j], [k,l], ...]
 
     all_ids = set()
@@ -166,9 +282,10 @@ def read_label_file(file_path):
     _, file_extension = os.path.splitext(file_path)
 
     if file_extension == '.npy':
-        data = np.load(file_path)
+        data = load_npy(file_path)
         label_list = data.tolist()
     elif file_extension == '.pth':
+        import torch
         data = torch.load(file_path)
         if isinstance(data, torch.Tensor):
             label_list = data.tolist()
@@ -180,57 +297,80 @@ def read_label_file(file_path):
     return label_list
 
 
-# Func: get simple filtered indices
-def get_filter_result(config, content_path, epoch, filters):
-    index_file_path = os.path.join(content_path, 'index.json')
-    if not os.path.exists(index_file_path):
-        return None, 'index.json not found'
-
-    indice_obj = read_file_as_json(index_file_path)
-
-    all_indices = indice_obj['train'] + indice_obj['test']
-    result = all_indices
-
-    for filter in filters:
-        filter_type = filter['filter_type']
-        label_text_list = config['dataset']['classes']
-
-        if filter_type == 'label':
-            filter_data = filter['filter_data']
-
-            attributes = config['dataset']['attributes']
-            file_path_pattern = attributes['label']['source']['pattern']
-            file_path = os.path.join(content_path, file_path_pattern)
-            if not os.path.exists(file_path):
-                return None, 'label file not found'
+# Func: class index of every sample in a label or prediction file, prediction scores are reduced by argmax
+def load_class_column(file_path):
+    def loader():
+        data = np.load(file_path, allow_pickle=True) if os.path.exists(file_path) else load_npy(file_path)
+        if data.ndim > 1:
+            data = data.argmax(axis=-1)
+        column = data.astype(np.int32)
+        column.setflags(write=False)
+        return column
+    return artifact_cache.get(('class_column', file_path), npy_source_paths(file_path), loader)
 
-            label_list = read_label_file(file_path)
+# Func: boolean mask (over samples in display order) of one filter or of a nested filter group
+def get_filter_mask(config, content_path, epoch, filter, num_train, order):
+    if 'filters' in filter:
+        return get_filter_group_mask(config, content_path, epoch, filter['filters'], filter.get('combine', 'and'), num_train, order)
 
-            filtered_indices = [index for index, label in zip(all_indices, label_list) if label_text_list[label] == filter_data]
-            result = list(set(result) & set(filtered_indices))
-
-        elif filter_type == 'prediction':
-            filter_data = filter['filter_data']
+    filter_type = filter['filter_type']
+    attributes = config['dataset']['attributes']
 
-            attributes = config['dataset']['attributes']
-            file_path_pattern = attributes['prediction']['source']['pattern']
-            file_path_pattern = file_path_pattern.replace('${epoch}', str(epoch))
-            file_path = os.path.join(content_path, file_path_pattern)
-            if not os.path.exists(file_path):
-                return None, 'prediction file not found'
+    def class_column(attribute):
+        file_path = os.path.join(content_path, attributes[attribute]['source']['pattern'].replace('${epoch}', str(epoch)))
+        if not npy_exists(file_path):
+            return None
+        return load_class_column(file_path)[order]
 
-            prediction_list = read_label_file(file_path)
+    if filter_type in ('label', 'prediction'):
+        column = class_column(filter_type)
+        if column is None:
+            return None, f'{filter_type} file not found'
+        label_text_list = config['dataset']['classes']
+        if filter['filter_data'] not in label_text_list:
+            return np.zeros(len(order), dtype=bool), ''
+        return column == label_text_list.index(filter['filter_data']), ''
+
+    if filter_type in ('correct', 'incorrect'):
+        labels, predictions = class_column('label'), class_column('prediction')
+        if labels is None or predictions is None:
+            return None, 'label or prediction file not found'
+        return (labels == predictions) if filter_type == 'correct' else (labels != predictions), ''
+
+    if filter_type in ('train', 'test'):
+        mask = np.zeros(len(order), dtype=bool)
+        if filter_type == 'train':
+            mask[:num_train] = True
+        else:
+            mask[num_train:] = True
+        return mask, ''
 
-            filtered_indices = [index for index, label in zip(all_indices, prediction_list) if label_text_list[label] == filter_data]
-            result = list(set(result) & set(filtered_indices))
+    return None, f'Unknown filter type: {filter_type}'
 
-        elif filter_type == 'train':
-            result = list(set(result) & set(indice_obj['train']))
+# Func: combine the masks of several filters with "and" / "or"
+def get_filter_group_mask(config, content_path, epoch, filters, combine, num_train, order):
+    if combine not in ('and', 'or'):
+        return None, f'Unknown filter combination: {combine}'
+    result = np.full(len(order), combine == 'and', dtype=bool)
+    for filter in filters:
+        mask, error_message = get_filter_mask(config, content_path, epoch, filter, num_train, order)
+        if mask is None:
+            return None, error_message
+        if combine == 'and':
+            result &= mask
+        else:
+            result |= mask
+    return result, ''
 
-        elif filter_type == 'test':
-            result = list(set(result) & set(indice_obj['test']))
+# Func: get filtered indices, sorted int32 array of the sample indices that satisfy the filters
+def get_filter_result(config, content_path, epoch, filters, combine='and'):
+    order = ordered_sample_indices(content_path)
+    num_train = len(sample_indices(content_path, 'train'))
 
-    return result,''
+    mask, error_message = get_filter_group_mask(config, content_path, epoch, filters, combine, num_train, order)
+    if mask is None:
+        return None, error_message
+    return np.sort(order[mask]), ''
 
 def load_background(content_path, vis_id, epoch):
     file_path = os.path.join(content_path, 'visualize',vis_id,'epochs',f'epoch_{epoch}', 'background.png')
@@ -244,88 +384,166 @@ def convert_to_base64(image_path):
     return base64_image
 
 def load_one_image(content_path, index):
-    file_path = os.path.join(content_path, 'dataset', 'image', f'{index}.png')
+    file_path = resolve_image_path(content_path, index)
     return convert_to_base64(file_path)
 
-def load_one_text(content_path, index):
-    file_path = os.path.join(content_path, 'dataset', 'text.txt')
-    with open(file_path, 'r') as f:
-        content = f.read()
-    lines = content.splitlines()
-    if index < len(lines):
-        return lines[index]
-    else:
-        return ""
+# files that may be served directly, per epoch and per visualization epoch
+EPOCH_ARTIFACTS = ('embeddings.npy', 'predictions.npy', 'intra_similarity.npy', 'inter_similarity.npy',
+                   'representation_neighbors.npy')
+VIS_EPOCH_ARTIFACTS = ('projection.npy', 'background.png', 'projection_neighbors.npy')
+
+# Func: resolve the path of a servable per-epoch artifact, None for unknown names or unsafe ids
+def resolve_artifact_path(content_path, epoch, name, vis_id=None):
+    epoch = int(epoch)
+    if vis_id is None:
+        if name not in EPOCH_ARTIFACTS:
+            return None
+        return os.path.join(content_path, 'epochs', f'epoch_{epoch}', name)
+    if name not in VIS_EPOCH_ARTIFACTS or not vis_id or vis_id != os.path.basename(vis_id) or vis_id in ('.', '..'):
+        return None
+    return os.path.join(content_path, 'visualize', vis_id, 'epochs', f'epoch_{epoch}', name)
 
-def calculate_high_dimensional_neighbors(content_path, epoch, max_neighbors=10):
-    featrue_list = load_single_attribute(content_path, epoch, 'representation')
+# Func: resolve the path of the image of one sample
+def resolve_image_path(content_path, index):
+    return os.path.join(content_path, 'dataset', 'image', f'{int(index)}.png')
 
-    features = np.array(featrue_list)
-    num_samples = len(features)
-    nbrs = NearestNeighbors(n_neighbors=max_neighbors + 1, algorithm='auto').fit(features)
-    distances, indices = nbrs.kneighbors(features)
-    
-    neighbors = [[] for _ in range(num_samples)]
-    for i in range(num_samples):
-        for j in range(1, max_neighbors + 1):
-            neighbor_idx = indices[i][j]
-            neighbors[i].append(int(neighbor_idx))
-    
-    return neighbors
+def load_one_text(content_path, index):
+    return load_text_store(os.path.join(content_path, 'dataset', 'text.txt')).get(int(index))
+
+# Func: get texts of samples [start, start + count) and the total number of texts
+def get_text_range(content_path, start, count):
+    store = load_text_store(os.path.join(content_path, 'dataset', 'text.txt'))
+    return store.range(start, start + count), len(store)
+
+# Func: get the directory where the neighbor index of one epoch and space is persisted
+def get_neighbor_index_dir(content_path, epoch, space, vis_id=None):
+    if space == 'representation':
+        # high dimensional neighbors do not depend on the visualization, keep them next to embeddings.npy
+        return os.path.join(content_path, 'epochs', f'epoch_{epoch}')
+    return os.path.join(content_path, 'visualize', vis_id, 'epochs', f'epoch_{epoch}')
+
+# Func: build [N, K] int32 nearest neighbor indices (excluding the sample itself)
+def build_neighbor_index(data, max_neighbors):
+    data = np.asarray(data).reshape(len(data), -1)
+    from sklearn.neighbors import NearestNeighbors
+    n_neighbors = min(max_neighbors + 1, len(data))
+    nbrs = NearestNeighbors(n_neighbors=n_neighbors, algorithm='auto').fit(data)
+    _, indices = nbrs.kneighbors(data)
+    return indices[:, 1:].astype(np.int32)
+
+# Func: load persisted neighbor index of one epoch, (re)build it when missing, stale or too small
+def load_neighbor_index(content_path, epoch, space, vis_id=None, max_neighbors=10):
+    index_file_path = os.path.join(content_path, 'dataset', 'index.json')
+    if space == 'representation':
+        source_path = os.path.join(content_path, 'epochs', f'epoch_{epoch}', 'embeddings.npy')
+        load_source = lambda: load_npy(source_path)[ordered_sample_indices(content_path)]
+    elif space == 'projection':
+        source_path = os.path.join(content_path, 'visualize', vis_id, 'epochs', f'epoch_{epoch}', 'projection.npy')
+        load_source = lambda: load_projection_array(content_path, vis_id, epoch)
+    else:
+        raise NotImplementedError(f"Unknown neighbor space: {space}")
 
-def calculate_projection_neighbors(content_path, vis_id, epoch, max_neighbors=10):
-    projection_list = load_projection(content_path, vis_id, epoch)
-    projection = np.array(projection_list)
-    num_samples = len(projection)
-    
-    nbrs = NearestNeighbors(n_neighbors=max_neighbors + 1, algorithm='auto').fit(projection)
-    distances, indices = nbrs.kneighbors(projection)
-    
-    neighbors = [[] for _ in range(num_samples)]
-    for i in range(num_samples):
-        for j in range(1, max_neighbors + 1):
-            neighbor_idx = indices[i][j]
-            neighbors[i].append(int(neighbor_idx))
-    
+    neighbor_path = os.path.join(get_neighbor_index_dir(content_path, epoch, space, vis_id), f'{space}_neighbors.npy')
+    source_mtime = max(os.path.getmtime(p) for p in npy_source_paths(source_path) + [index_file_path] if os.path.exists(p))
+    if os.path.exists(neighbor_path) and os.path.getmtime(neighbor_path) >= source_mtime:
+        try:
+            neighbors = load_npy(neighbor_path)
+            if neighbors.ndim == 2 and (neighbors.shape[1] >= max_neighbors or neighbors.shape[1] == len(neighbors) - 1):
+                return neighbors[:, :max_neighbors]
+        except Exception:
+            pass  # unreadable or damaged index, rebuild it
+
+    neighbors = build_neighbor_index(load_source(), max_neighbors)
+    write_atomic(neighbor_path, lambda f: np.save(f, neighbors))
     return neighbors
 
+def calculate_high_dimensional_neighbors(content_path, epoch, max_neighbors=10, index=None):
+    neighbors = load_neighbor_index(content_path, epoch, 'representation', max_neighbors=max_neighbors)
+    if index is not None:
+        return neighbors[index].tolist()
+    return neighbors.tolist()
+
+def calculate_projection_neighbors(content_path, vis_id, epoch, max_neighbors=10, index=None):
+    neighbors = load_neighbor_index(content_path, epoch, 'projection', vis_id, max_neighbors)
+    if index is not None:
+        return neighbors[index].tolist()
+    return neighbors.tolist()
+
+
+# attribute -> file relative to content_path, per-epoch files contain ${epoch}
+ATTRIBUTE_FILES = {
+    'label': os.path.join('dataset', 'labels.npy'),
+    'intra_similarity': os.path.join('epochs', 'epoch_${epoch}', 'intra_similarity.npy'),
+    'inter_similarity': os.path.join('epochs', 'epoch_${epoch}', 'inter_similarity.npy'),
+    'representation': os.path.join('epochs', 'epoch_${epoch}', 'embeddings.npy'),
+    'prediction': os.path.join('epochs', 'epoch_${epoch}', 'predictions.npy'),
+}
+
+# attributes served as class indices (uint16, int32 when there are too many classes) by load_attribute_columns
+CLASS_ATTRIBUTES = ('label', 'prediction')
+
+def attribute_file_path(content_path, epoch, attribute):
+    if attribute not in ATTRIBUTE_FILES:
+        raise NotImplementedError(f"Unknown attribute: {attribute}")
+    return os.path.join(content_path, ATTRIBUTE_FILES[attribute].replace('${epoch}', str(epoch)))
 
 # Func: Load a single attribute from a file based on the configuration and epoch
 def load_single_attribute(content_path, epoch, attribute):
-    if attribute == 'label':
-        file_path = os.path.join(content_path, 'dataset', 'labels.npy')
-        attr_data = read_label_file(file_path)
-    elif attribute == 'intra_similarity':
-        file_path = os.path.join(content_path, 'epochs', f'epoch_{epoch}', 'intra_similarity.npy')
-        attr_data = read_from_file(file_path)
-    elif attribute == 'inter_similarity':
-        file_path = os.path.join(content_path, 'epochs', f'epoch_{epoch}', 'inter_similarity.npy')
-        attr_data = read_from_file(file_path)
-    elif attribute == 'representation':
-        file_path = os.path.join(content_path, 'epochs', f'epoch_{epoch}', 'embeddings.npy')
-        attr_data = read_from_file(file_path)
-    elif attribute == 'prediction':
-        file_path = os.path.join(content_path, 'epochs', f'epoch_{epoch}', 'predictions.npy')
-        attr_data = read_from_file(file_path)
-    elif attribute == 'index':
-        attr_data = load_or_create_index(content_path)
-    else:
-        raise NotImplementedError(f"Unknown attribute: {attribute}")
-    
-    index_dict = load_or_create_index(content_path)
-    all_indices = index_dict['train'] + index_dict['test']
-    if attribute != 'index':
-        attr_data = [attr_data[i] for i in all_indices]
-    
-    return attr_data
+    if attribute == 'index':
+        return load_or_create_index(content_path)
+
+    file_path = attribute_file_path(content_path, epoch, attribute)
+    return load_npy(file_path)[ordered_sample_indices(content_path)].tolist()
+
+# Func: epochs with a directory under content_path/epochs, sorted
+def available_content_epochs(content_path):
+    epochs_dir = os.path.join(content_path, 'epochs')
+    if not os.path.isdir(epochs_dir):
+        return []
+    return sorted(int(name[len('epoch_'):]) for name in os.listdir(epochs_dir)
+                  if name.startswith('epoch_') and name[len('epoch_'):].isdigit())
+
+# Func: several attributes of several epochs as typed columns in display order
+def load_attribute_columns(content_path, epochs, attributes, float_dtype=np.float16):
+    """
+    Returns:
+        dict: attribute -> numpy.ndarray, [N, ...] for epoch independent attributes (label),
+            [T, N, ...] for per-epoch attributes. Label and prediction are class indices (predictions are
+            reduced by argmax), other attributes are converted to float_dtype.
+    """
+    order = ordered_sample_indices(content_path)
+    columns = {}
+    for attribute in attributes:
+        per_epoch = '${epoch}' in ATTRIBUTE_FILES.get(attribute, '')
+        file_paths = [attribute_file_path(content_path, epoch, attribute) for epoch in (epochs if per_epoch else [None])]
+        for file_path in file_paths:
+            if not npy_exists(file_path):
+                raise FileNotFoundError(file_path)
+
+        if attribute in CLASS_ATTRIBUTES:
+            sources = [load_class_column(file_path) for file_path in file_paths]
+            num_classes = max((int(source.max()) + 1 for source in sources if len(source) > 0), default=0)
+            dtype = np.uint16 if num_classes <= np.iinfo(np.uint16).max else np.int32
+        else:
+            sources = [load_npy(file_path) for file_path in file_paths]
+            dtype = float_dtype
+
+        # gather straight into the preallocated column, one vectorized take per epoch
+        trailing_shape = sources[0].shape[1:] if sources else ()
+        column = np.empty((len(sources), len(order)) + trailing_shape, dtype=dtype)
+        for t, source in enumerate(sources):
+            column[t] = source[order]
+        columns[attribute] = column if per_epoch else column[0]
+    return columns
 
 def read_from_file(file_path):
     _, file_extension = os.path.splitext(file_path)
 
     if file_extension == '.npy':
-        data = np.load(file_path)
+        data = load_npy(file_path)
         result = data.tolist()
     elif file_extension == '.pth':
+        import torch
         data = torch.load(file_path)
         if isinstance(data, torch.Tensor):
             result = data.tolist()
@@ -335,8 +553,7 @@ def read_from_file(file_path):
             raise ValueError(f"Unsupported data type in .pth file: {type(data)}")
     elif file_extension == '.json':
         try:
-            with open(file_path, 'r') as f:
-                result = json.load(f)
+            result = load_json(file_path)
         except Exception as e:
             raise ValueError(f"Error in reading json file from {file_path}: {e}")
     else:
@@ -348,15 +565,20 @@ def read_file_as_json(file_path: str):
     if not os.path.exists(file_path):
         return None
     
-    with open(file_path, "r") as f:
-        return json.load(f)
+    return load_json(file_path)
+
+# Func: sample indices in display order (train samples first, then test samples), see sample_index.py
+def ordered_sample_indices(content_path):
+    indices = sample_indices(content_path)
+    if indices is None:
+        load_or_create_index(content_path)
+        indices = sample_indices(content_path)
+    return indices
 
 def load_or_create_index(content_path):
     index_file_path = os.path.join(content_path, 'dataset', 'index.json')
     if os.path.exists(index_file_path):
-        with open(index_file_path, 'r') as f:
-            index_data = json.load(f)
-        return index_data
+        return load_json(index_file_path)
 
     # If index.json does not exist, create it
     file_path = os.path.join(content_path, 'dataset', 'labels.npy')
@@ -397,50 +619,115 @@ def generate_dimension_array(dimension):
     decoder_dims = encoder_dims[::-1]
     return encoder_dims, decoder_dims
 
-def calculate_visualize_metrics(content_path, vis_id, epoch):
-    high_dimensional_neighbors = calculate_high_dimensional_neighbors(content_path, epoch)
-    projection_neighbors = calculate_projection_neighbors(content_path, vis_id, epoch)
-
-    # Neighbor trustworthiness and continuity
-    K = min(len(high_dimensional_neighbors[0]), len(projection_neighbors[0]))
+# Func: exact ranks of candidate neighbors, 1 + the number of samples closer to the row than the candidate
+def _exact_neighbor_ranks(data, rows, candidates, mask):
+    ranks = np.zeros(candidates.shape, dtype=np.int64)
+    row_data = data[rows]
+    dists = (np.sum(row_data ** 2, axis=1)[:, None] - 2 * row_data @ data.T + np.sum(data ** 2, axis=1)[None, :])
+    dists[np.arange(len(rows)), rows] = np.inf  # exclude the sample itself
+    targets = np.take_along_axis(dists, candidates, axis=1)
+    for col in np.flatnonzero(mask.any(axis=0)):
+        ranks[:, col] = (dists < targets[:, col:col + 1]).sum(axis=1) + 1
+    return ranks[mask]
+
+# Func: per-row sum of (rank_b(i, j) - k) over neighbors j in the top-k of a that are missing from the top-k of b
+def neighbor_rank_penalties(neighbors_a, neighbors_b, ks, rows, data_b=None, block_size=4096):
+    """
+    neighbors_a, neighbors_b: [N, K] int neighbor indices sorted by distance, K >= max(ks) for neighbors_a
+    rows: indices of the rows to evaluate
+    data_b: optional [N, D] data of space b. Ranks deeper than neighbors_b are computed exactly from it,
+        otherwise they are counted as neighbors_b.shape[1] + 1 (a lower bound)
+    Returns:
+        dict: k -> [len(rows)] penalties
+    """
+    kmax = max(ks)
+    depth = neighbors_b.shape[1]
+    if data_b is not None:
+        block_size = max(1, min(block_size, 2 ** 26 // len(data_b)))
+    penalties = {k: np.zeros(len(rows), dtype=np.float64) for k in ks}
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        candidates = neighbors_a[block, :kmax]
+        match = candidates[:, :, None] == neighbors_b[block][:, None, :]
+        found = match.any(axis=2)
+        ranks = match.argmax(axis=2) + 1
+        if data_b is not None and not found.all():
+            ranks[~found] = _exact_neighbor_ranks(data_b, block, candidates, ~found)
+        else:
+            ranks[~found] = depth + 1
+        for k in ks:
+            top_ranks = ranks[:, :k]
+            penalties[k][start:start + len(block)] = np.where(top_ranks > k, top_ranks - k, 0).sum(axis=1)
+    return penalties
+
+def calculate_visualize_metrics(content_path, vis_id, epoch, ks=(10,), rank_depth=None, sample_size=None, exact=False, seed=0):
+    """
+    Neighbor trustworthiness and continuity of the projection of one epoch.
+
+    Args:
+        ks (list of int): neighborhood sizes, all evaluated in one pass
+        rank_depth (int): number of stored neighbors used to rank points, defaults to 4 * max(ks)
+        sample_size (int): evaluate a random subset of samples and report a 95% confidence interval
+        exact (bool): compute ranks deeper than rank_depth from pairwise distances instead of clamping them.
+            Clamped ranks are too small, so without exact the metrics are upper bounds (bound: 'upper')
+    """
+    ks = sorted(set(int(k) for k in ks))
+    rank_depth = max(rank_depth or 4 * ks[-1], ks[-1])
+    high_dimensional_neighbors = load_neighbor_index(content_path, epoch, 'representation', max_neighbors=rank_depth)
+    projection_neighbors = load_neighbor_index(content_path, epoch, 'projection', vis_id, rank_depth)
     N = len(high_dimensional_neighbors)
 
-    trust_sum = 0.0
-    cont_sum = 0.0
-
-    for i in range(N):
-        high = high_dimensional_neighbors[i][:K]
-        low = projection_neighbors[i][:K]
-
-        # 1. Trustworthiness
-        u_set = set(low) - set(high)
-        for j in u_set:
-            try:
-                rank = high_dimensional_neighbors[i].index(j) + 1  # 1-based
-                trust_sum += (rank - K)
-            except ValueError:
-                trust_sum += (len(high_dimensional_neighbors[i]) + 1 - K)
-
-        # 2. Continuity
-        v_set = set(high) - set(low)
-        for j in v_set:
-            try:
-                rank = projection_neighbors[i].index(j) + 1  # 1-based
-                cont_sum += (rank - K)
-            except ValueError:
-                cont_sum += (len(projection_neighbors[i]) + 1 - K)
-
-    normalizer = N * K * (2 * N - 3 * K - 1)
-
-    trustworthiness = 1.0 - (2.0 / normalizer) * trust_sum
-    continuity = 1.0 - (2.0 / normalizer) * cont_sum
+    if sample_size is not None and sample_size < N:
+        rows = np.sort(np.random.default_rng(seed).choice(N, size=sample_size, replace=False))
+    else:
+        rows = np.arange(N)
+
+    high_data, low_data = None, None
+    if exact:
+        high_data = load_npy(os.path.join(content_path, 'epochs', f'epoch_{epoch}', 'embeddings.npy'))[ordered_sample_indices(content_path)]
+        high_data = high_data.reshape(N, -1).astype(np.float32)
+        low_data = load_projection_array(content_path, vis_id, epoch, dtype=np.float32)
+
+    # 1. Trustworthiness: projection neighbors ranked in the high dimensional space
+    trust_penalties = neighbor_rank_penalties(projection_neighbors, high_dimensional_neighbors, ks, rows, high_data)
+    # 2. Continuity: high dimensional neighbors ranked in the projection
+    cont_penalties = neighbor_rank_penalties(high_dimensional_neighbors, projection_neighbors, ks, rows, low_data)
+
+    per_k = {}
+    for K in ks:
+        # 1 - 2 / (N K (2N - 3K - 1)) * sum, with the sum estimated as N * mean over the evaluated rows
+        scale = 2.0 / (K * (2 * N - 3 * K - 1))
+        metrics = {
+            "trustworthiness": 1.0 - scale * float(np.mean(trust_penalties[K])),
+            "continuity": 1.0 - scale * float(np.mean(cont_penalties[K])),
+        }
+        if len(rows) < N:
+            # 95% confidence interval with finite population correction
+            correction = float(np.sqrt((N - len(rows)) / max(N - 1, 1) / len(rows)))
+            for name, penalties in (("trustworthiness", trust_penalties[K]), ("continuity", cont_penalties[K])):
+                half_width = 1.96 * scale * float(np.std(penalties, ddof=1)) * correction
+                metrics[f"{name}_ci"] = [metrics[name] - half_width, metrics[name] + half_width]
+        per_k[str(K)] = metrics
 
     return {
-        "neighbor_trustworthiness": trustworthiness,
-        "neighbor_continuity": continuity
+        "neighbor_trustworthiness": per_k[str(ks[0])]["trustworthiness"],
+        "neighbor_continuity": per_k[str(ks[0])]["continuity"],
+        "per_k": per_k,
+        "rank_depth": rank_depth,
+        "bound": None if exact else "upper",
+        "num_evaluated": int(len(rows)),
     }
 
 
+# Func: device the influence sessions run on, TTV_INFLUENCE_DEVICE (e.g. "cuda:1", "cpu") or cuda when available
+def influence_device():
+    import torch
+    device = os.environ.get('TTV_INFLUENCE_DEVICE')
+    if device:
+        return torch.device(device)
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
 """
 Using influence functions to find the most influential training samples
 
@@ -450,7 +737,13 @@ TODO: these two functions have many temp solutions, generalize them according to
     - criterion / loss
     - layer to consider
 """
-def prediction_attribution(content_path, epoch, training_event, num_samples=10):
+# Func: build the influence session of an image classification checkpoint (model, CIFAR10 loader, influence function)
+def build_prediction_session(content_path, epoch):
+    import torch
+    import torchvision
+    import torchvision.transforms as transforms
+    from influence_function.IF import EmpiricalIF
+
     # define and load subject model
     sys.path.append(os.path.join(content_path, "scripts"))
     import model as subject_model
@@ -459,7 +752,7 @@ def prediction_attribution(content_path, epoch, training_event, num_samples=10):
     model = eval("subject_model.{}()".format(info['model']))
     classes = info['classes']
     subject_model_location = os.path.join(content_path, "epochs", f"epoch_{epoch}", "model.pth")
-    device = torch.device("cuda:3" if torch.cuda.is_available() else "cpu")
+    device = influence_device()
     model.load_state_dict(torch.load(subject_model_location, map_location=torch.device("cpu")))
     model.to(device)
     model.eval()
@@ -490,11 +783,21 @@ def prediction_attribution(content_path, epoch, training_event, num_samples=10):
                                param_filter_fn=lambda name, param: 'classifier' in name,
                                criterion=torch.nn.CrossEntropyLoss(reduction="none"))
 
-    test_sample = trainloader.dataset[training_event['index']]
-    test_input, _ = test_sample
-    test_input = test_input.unsqueeze(0)  # Add batch dimension
-    test_target = torch.tensor([classes.index(training_event['influenceTarget'])]).to(device)  # Add batch dimension
-    IF_scores = IF.query_influence(test_input, test_target)
+    return InfluenceSession(model=model, classes=classes, device=device, trainloader=trainloader, influence=IF)
+
+def prediction_attribution(content_path, epoch, training_event, num_samples=10):
+    import torch
+    subject_model_location = os.path.join(content_path, "epochs", f"epoch_{epoch}", "model.pth")
+    session = influence_sessions.get(('prediction', content_path, epoch), [subject_model_location],
+                                     lambda: build_prediction_session(content_path, epoch))
+    classes = session.classes
+
+    with session.lock:
+        test_sample = session.trainloader.dataset[training_event['index']]
+        test_input, _ = test_sample
+        test_input = test_input.unsqueeze(0)  # Add batch dimension
+        test_target = torch.tensor([classes.index(training_event['influenceTarget'])]).to(session.device)  # Add batch dimension
+        IF_scores = session.influence.query_influence(test_input, test_target)
     
     # Get the indices of the top num_samples maximum and minimum scores
     max_indices = np.argsort(IF_scores)[-num_samples:][::-1]
@@ -512,8 +815,9 @@ def prediction_attribution(content_path, epoch, training_event, num_samples=10):
    
     return influence_samples
 
-class CodeSearchNetDataset(Dataset):
+class CodeSearchNetDataset:
     def __init__(self, file_path, tokenizer, sample_limit=None):
+        from tqdm import tqdm
         self.samples = []
         count = 0
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -531,12 +835,32 @@ class CodeSearchNetDataset(Dataset):
 
     def __getitem__(self, idx):
         return self.samples[idx]
-        
 
-def movement_attribution(content_path, epoch, training_event, num_samples=10):
+# local directory or Hugging Face model id of the code search tokenizer, set with TTV_TOKENIZER_PATH
+TOKENIZER_PATH = os.environ.get('TTV_TOKENIZER_PATH', 'microsoft/codebert-base')
+
+# Func: tokenizer for code search datasets, loaded once per process
+def load_tokenizer():
+    from transformers import RobertaTokenizer
+    return artifact_cache.get(('tokenizer', TOKENIZER_PATH), [], lambda: RobertaTokenizer.from_pretrained(TOKENIZER_PATH), nbytes=lambda value: 0)
+
+# Func: tokenized train.jsonl, shared by the influence sessions of all epochs and rebuilt when the file changes
+def load_code_search_dataset(content_path):
+    file_path = os.path.join(content_path, "dataset", "train.jsonl")
+    return artifact_cache.get(('code_search_dataset', file_path), [file_path],
+                              lambda: CodeSearchNetDataset(file_path, tokenizer=load_tokenizer(), sample_limit=None),
+                              nbytes=lambda dataset: sum(a.element_size() * a.nelement() + b.element_size() * b.nelement() for a, b in dataset.samples))
+
+# Func: build the influence session of a code search checkpoint (model, tokenized dataset, pairwise influence function)
+def build_movement_session(content_path, epoch):
+    import torch
+    from torch.utils.data import DataLoader
+    from influence_function.IF import PairWiseEmpiricalIF
+    from influence_function.CustomEncoderModel import CustomEncoderModel
+
     # define and load subject model
-    device = torch.device("cuda:3" if torch.cuda.is_available() else "cpu")
-    tokenizer = RobertaTokenizer.from_pretrained('/home/kwy/models/codebert-base')  
+    device = influence_device()
+    tokenizer = load_tokenizer()
     subject_model_location = os.path.join(content_path, "epochs", f"epoch_{epoch}", "model.pth")
     
     model = CustomEncoderModel(
@@ -549,8 +873,19 @@ def movement_attribution(content_path, epoch, training_event, num_samples=10):
     model.eval()
     
     # construct dataloader
-    train_dataset = CodeSearchNetDataset(os.path.join(content_path, "dataset", "train.jsonl"), tokenizer=tokenizer, sample_limit=None)
+    train_dataset = load_code_search_dataset(content_path)
     trainloader = DataLoader(train_dataset, batch_size=128, shuffle=False)    
+    
+    # init IF
+    pairwise_if = PairWiseEmpiricalIF(dl_train=trainloader,model=model,param_filter_fn=lambda name, param: 'transformer_encoder' in name)
+    return InfluenceSession(model=model, device=device, train_dataset=train_dataset, trainloader=trainloader, influence=pairwise_if)
+
+def movement_attribution(content_path, epoch, training_event, num_samples=10):
+    subject_model_location = os.path.join(content_path, "epochs", f"epoch_{epoch}", "model.pth")
+    train_file_path = os.path.join(content_path, "dataset", "train.jsonl")
+    session = influence_sessions.get(('movement', content_path, epoch), [subject_model_location, train_file_path],
+                                     lambda: build_movement_session(content_path, epoch))
+    train_dataset = session.train_dataset
         
     # sub-sample (code or doc) index
     index = training_event['index']
@@ -570,9 +905,8 @@ def movement_attribution(content_path, epoch, training_event, num_samples=10):
     query_input_part1 = ori_sample[tp] # docstring_tensor
     query_input_part2 = ori_sample1[tp1] # code_tensor
     
-    # init IF
-    pairwise_if = PairWiseEmpiricalIF(dl_train=trainloader,model=model,param_filter_fn=lambda name, param: 'transformer_encoder' in name)
-    influences_case = pairwise_if.query_influence(query_input_part1, query_input_part2, query_is_positive=(ori_index == ori_index1))
+    with session.lock:
+        influences_case = session.influence.query_influence(query_input_part1, query_input_part2, query_is_positive=(ori_index == ori_index1))
     print("Influence case:", influences_case[:3])
     
     influence_samples = []
@@ -588,9 +922,14 @@ def movement_attribution(content_path, epoch, training_event, num_samples=10):
 
     return influence_samples
 
-def compute_training_events(content_path, epoch, event_types):
+def compute_training_events(content_path, epoch, event_types, params=None, use_cache=True,
+                            sort='default', offset=0, limit=None):
+    from visualize.data_provider import DataProvider
+    from visualize.training_event import TrainingEventDetector
+
     config = {"content_path": content_path}
     data_provider = DataProvider(config)
-    detector = TrainingEventDetector(content_path, epoch, data_provider)
-    events = detector.detect_events(event_types)
-    return events
\ No newline at end of file
+    detector = TrainingEventDetector(content_path, epoch, data_provider, params)
+    events, counts = detector.query_events(event_types, sort, offset, limit, use_cache)
+    totals = {'total': sum(counts.values()), 'by_type': counts}
+    return events, totals
\ No newline at end of file
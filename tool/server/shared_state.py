@@ -0,0 +1,91 @@
+"""State shared by the workers of a preforked server.
+
+Every forked worker has its own memory, so a job started through one worker could not be followed or
+cancelled through another, TTV_MAX_VIS_JOBS would apply per worker and /metrics would only describe the
+worker that answered. start_shared_state() starts one manager process before the workers are forked. It
+hosts the visualization job manager and a board where every worker publishes its request metrics; the
+workers use them through proxies that connect (again) in every forked process.
+"""
+import multiprocessing
+import os
+import threading
+from multiprocessing.managers import BaseManager
+
+
+class MetricsBoard:
+    """Latest metrics snapshot of every worker, kept after a worker exits so counters never go back."""
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def publish(self, worker_id, snapshot):
+        with self._lock:
+            self._snapshots[worker_id] = snapshot
+
+    def snapshots(self):
+        with self._lock:
+            return list(self._snapshots.values())
+
+
+_metrics_board = None
+
+def _job_manager():
+    # executed in the manager process, all workers share this instance
+    from job_manager import job_manager
+    return job_manager
+
+def _metrics():
+    global _metrics_board
+    if _metrics_board is None:
+        _metrics_board = MetricsBoard()
+    return _metrics_board
+
+
+class SharedStateManager(BaseManager):
+    pass
+
+SharedStateManager.register('job_manager', callable=_job_manager, exposed=('submit', 'get', 'list', 'cancel'))
+SharedStateManager.register('metrics', callable=_metrics, exposed=('publish', 'snapshots'))
+
+
+class RemoteObject:
+    """Proxy to an object of the manager process, connected on first use in every process."""
+    def __init__(self, address, authkey, typeid):
+        self._address = address
+        self._authkey = authkey
+        self._typeid = typeid
+        self._pid = None
+        self._proxy = None
+        self._lock = threading.Lock()
+
+    def _remote(self):
+        # a connection inherited through fork must not be used, every worker opens its own
+        with self._lock:
+            if self._pid != os.getpid():
+                manager = SharedStateManager(address=self._address, authkey=self._authkey)
+                manager.connect()
+                self._proxy = getattr(manager, self._typeid)()
+                self._pid = os.getpid()
+            return self._proxy
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._remote(), name)
+
+
+class SharedState:
+    def __init__(self, manager):
+        self.manager = manager
+        self.job_manager = RemoteObject(manager.address, bytes(manager._authkey), 'job_manager')
+        self.metrics = RemoteObject(manager.address, bytes(manager._authkey), 'metrics')
+
+    def shutdown(self):
+        self.manager.shutdown()
+
+
+def start_shared_state():
+    """Start the manager process, call it in the parent before forking the workers."""
+    manager = SharedStateManager(authkey=os.urandom(32), ctx=multiprocessing.get_context('fork'))
+    manager.start()
+    return SharedState(manager)
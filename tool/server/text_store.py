@@ -0,0 +1,115 @@
+r"""Random access to the lines of a text corpus (dataset/text.txt) without reading the whole file.
+
+A line-offset index is built once and saved next to the corpus as <name>_line_offsets.npy (int64, one entry
+per line start plus the file size). The corpus itself is memory-mapped, so reading one line is a slice of the
+mapping. The sidecar is rebuilt when it is older than the corpus or does not match its size.
+
+Lines are split like str.splitlines() on the decoded file (what /getText used to do), so sample indices stay
+aligned: \n, \r\n, \r, \x0b, \x0c, \x1c-\x1e, \x85, \u2028 and \u2029 all end a line.
+"""
+import mmap
+import os
+import re
+
+import numpy as np
+
+from artifact_cache import artifact_cache, write_atomic
+
+CHUNK_SIZE = 64 * 1024 * 1024
+# one byte line boundaries, a \r directly followed by \n is not a boundary itself (the \n ends the line)
+SINGLE_BYTE_BOUNDARIES = np.array([0x0a, 0x0b, 0x0c, 0x1c, 0x1d, 0x1e], dtype=np.uint8)
+# utf-8 encoded line boundaries: \x85 (c2 85), \u2028 (e2 80 a8), \u2029 (e2 80 a9)
+LOOKAHEAD = 2
+LINE_BOUNDARY = re.compile(r'(?:\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029])\Z')
+
+def offsets_path_for(file_path):
+    root, _ = os.path.splitext(file_path)
+    return root + '_line_offsets.npy'
+
+def _line_ends(buffer, final):
+    """
+    Offsets just past every line boundary that starts in buffer, and the number of bytes scanned.
+
+    Unless final, the last LOOKAHEAD bytes are not scanned, the caller passes them on with the next chunk.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    scanned = len(data) if final else max(len(data) - LOOKAHEAD, 0)
+    padded = np.concatenate([data, np.zeros(LOOKAHEAD, dtype=np.uint8)])
+    b0, b1, b2 = padded[:scanned], padded[1:scanned + 1], padded[2:scanned + 2]
+    single = np.isin(b0, SINGLE_BYTE_BOUNDARIES) | ((b0 == 0x0d) & (b1 != 0x0a))
+    next_line = (b0 == 0xc2) & (b1 == 0x85)
+    separator = (b0 == 0xe2) & (b1 == 0x80) & ((b2 == 0xa8) | (b2 == 0xa9))
+    ends = np.concatenate([np.flatnonzero(single) + 1, np.flatnonzero(next_line) + 2, np.flatnonzero(separator) + 3])
+    return np.sort(ends).astype(np.int64), scanned
+
+def build_line_offsets(file_path):
+    """Offsets of every line start in file_path, followed by the file size."""
+    starts = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    carry = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            buffer = carry + chunk
+            ends, scanned = _line_ends(buffer, final=not chunk)
+            starts.append(ends + position)
+            carry = buffer[scanned:]
+            position += scanned
+            if not chunk:
+                break
+    offsets = np.concatenate(starts)
+    if offsets[-1] != position:
+        # last line without trailing newline
+        offsets = np.append(offsets, position)
+    return offsets
+
+
+class TextStore:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.offsets = self._load_offsets()
+        self.offsets.setflags(write=False)
+        with open(file_path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b''
+
+    def _load_offsets(self):
+        sidecar_path = offsets_path_for(self.file_path)
+        size = os.path.getsize(self.file_path)
+        if os.path.exists(sidecar_path) and os.path.getmtime(sidecar_path) >= os.path.getmtime(self.file_path):
+            try:
+                offsets = np.load(sidecar_path)
+                if offsets.ndim == 1 and len(offsets) > 0 and offsets[-1] == size:
+                    return offsets
+            except Exception:
+                pass  # damaged sidecar, rebuilt below
+
+        offsets = build_line_offsets(self.file_path)
+        try:
+            write_atomic(sidecar_path, lambda f: np.save(f, offsets))
+        except OSError:
+            # read-only dataset directory, keep the index in memory only
+            pass
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, start, end):
+        return LINE_BOUNDARY.sub('', self._data[start:end].decode('utf-8', errors='replace'), count=1)
+
+    def get(self, index):
+        """Text of one line, an empty string if index is out of range."""
+        if index < 0 or index >= len(self):
+            return ''
+        return self._decode(self.offsets[index], self.offsets[index + 1])
+
+    def range(self, start, stop):
+        """Texts of lines [start, stop), clipped to the corpus."""
+        start, stop = max(start, 0), min(stop, len(self))
+        return [self._decode(self.offsets[i], self.offsets[i + 1]) for i in range(start, stop)]
+
+
+def load_text_store(file_path):
+    """TextStore of file_path, shared through the artifact cache and reopened when the file changes."""
+    return artifact_cache.get(('text_store', file_path), [file_path], lambda: TextStore(file_path),
+                              nbytes=lambda store: store.offsets.nbytes)
@@ -0,0 +1,146 @@
+"""Thumbnail sprite atlases for image datasets.
+
+build_thumbnail_atlases packs downsampled copies of dataset/image/<i>.png into fixed size atlas images
+(dataset/thumbnails/atlas_<k>.png). Every thumbnail keeps its aspect ratio inside a square cell of
+thumb_size pixels. dataset/thumbnails/index.npy maps sample i to [atlas, x, y, width, height] (int32,
+all -1 if the sample has no image), dataset/thumbnails/info.json records the parameters.
+
+Run offline after the dataset is exported:
+    python thumbnail_atlas.py <content_path> [--thumb-size 64] [--atlas-size 2048]
+"""
+import argparse
+import io
+import json
+import math
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'visualize'))
+from artifact_cache import artifact_cache, load_npy, load_json
+
+DEFAULT_THUMB_SIZE = 64
+DEFAULT_ATLAS_SIZE = 2048
+MAX_THUMBNAILS = 256
+
+def thumbnail_dir(content_path):
+    return os.path.join(content_path, 'dataset', 'thumbnails')
+
+def _count_images(image_dir):
+    indices = [int(name[:-4]) for name in os.listdir(image_dir) if name.endswith('.png') and name[:-4].isdigit()]
+    return max(indices) + 1 if indices else 0
+
+def make_thumbnail(image_path, thumb_size):
+    image = Image.open(image_path).convert('RGBA')
+    image.thumbnail((thumb_size, thumb_size))
+    return image
+
+def build_thumbnail_atlases(content_path, thumb_size=DEFAULT_THUMB_SIZE, atlas_size=DEFAULT_ATLAS_SIZE):
+    """
+    Build the thumbnail atlases and index of content_path.
+
+    Returns:
+        dict: the content of info.json
+    """
+    image_dir = os.path.join(content_path, 'dataset', 'image')
+    output_dir = thumbnail_dir(content_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_samples = _count_images(image_dir)
+    cells_per_row = atlas_size // thumb_size
+    cells_per_atlas = cells_per_row * cells_per_row
+    index = np.full((num_samples, 5), -1, dtype=np.int32)
+
+    atlas, atlas_id, cell = None, 0, 0
+    for i in range(num_samples):
+        image_path = os.path.join(image_dir, f'{i}.png')
+        if not os.path.exists(image_path):
+            continue
+        if atlas is None:
+            atlas = Image.new('RGBA', (atlas_size, atlas_size))
+        thumbnail = make_thumbnail(image_path, thumb_size)
+        x, y = (cell % cells_per_row) * thumb_size, (cell // cells_per_row) * thumb_size
+        atlas.paste(thumbnail, (x, y))
+        index[i] = [atlas_id, x, y, thumbnail.width, thumbnail.height]
+
+        cell += 1
+        if cell == cells_per_atlas:
+            atlas.save(os.path.join(output_dir, f'atlas_{atlas_id}.png'))
+            atlas, atlas_id, cell = None, atlas_id + 1, 0
+    if atlas is not None:
+        atlas.save(os.path.join(output_dir, f'atlas_{atlas_id}.png'))
+        atlas_id += 1
+
+    info = {
+        'thumb_size': thumb_size,
+        'atlas_size': atlas_size,
+        'num_atlases': atlas_id,
+        'num_samples': num_samples,
+    }
+    np.save(os.path.join(output_dir, 'index.npy'), index)
+    with open(os.path.join(output_dir, 'info.json'), 'w') as f:
+        json.dump(info, f)
+    return info
+
+def _load_atlas(path):
+    def loader():
+        array = np.asarray(Image.open(path).convert('RGBA'))
+        array.setflags(write=False)
+        return array
+    return artifact_cache.get(('thumbnail_atlas', path), [path], loader)
+
+def compose_thumbnails(content_path, indices, thumb_size=DEFAULT_THUMB_SIZE):
+    """
+    Pack the thumbnails of several samples into one png mosaic, one thumb_size cell per sample in a grid.
+
+    Uses the prebuilt atlases when they exist, otherwise thumbnails are made from the sample images.
+
+    Returns:
+        (bytes, dict): png data and its layout {thumb_size, columns, rects}, rects[k] is [x, y, width, height]
+            of indices[k] in the mosaic, or None if the sample has no image
+    """
+    output_dir = thumbnail_dir(content_path)
+    info_path = os.path.join(output_dir, 'info.json')
+    atlas_index = None
+    if os.path.exists(info_path):
+        thumb_size = load_json(info_path)['thumb_size']
+        atlas_index = load_npy(os.path.join(output_dir, 'index.npy'))
+
+    columns = max(1, math.ceil(math.sqrt(len(indices))))
+    rows = max(1, math.ceil(len(indices) / columns))
+    mosaic = np.zeros((rows * thumb_size, columns * thumb_size, 4), dtype=np.uint8)
+
+    rects = []
+    for k, sample in enumerate(indices):
+        x, y = (k % columns) * thumb_size, (k // columns) * thumb_size
+        if atlas_index is not None:
+            if sample < 0 or sample >= len(atlas_index) or atlas_index[sample, 0] < 0:
+                rects.append(None)
+                continue
+            atlas_id, ax, ay, width, height = (int(v) for v in atlas_index[sample])
+            atlas = _load_atlas(os.path.join(output_dir, f'atlas_{atlas_id}.png'))
+            thumbnail = atlas[ay:ay + height, ax:ax + width]
+        else:
+            image_path = os.path.join(content_path, 'dataset', 'image', f'{int(sample)}.png')
+            if sample < 0 or not os.path.exists(image_path):
+                rects.append(None)
+                continue
+            thumbnail = np.asarray(make_thumbnail(image_path, thumb_size))
+            height, width = thumbnail.shape[:2]
+        mosaic[y:y + height, x:x + width] = thumbnail
+        rects.append([x, y, width, height])
+
+    buffer = io.BytesIO()
+    Image.fromarray(mosaic).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue(), {'thumb_size': thumb_size, 'columns': columns, 'rects': rects}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build thumbnail sprite atlases of an image dataset')
+    parser.add_argument('content_path')
+    parser.add_argument('--thumb-size', type=int, default=DEFAULT_THUMB_SIZE)
+    parser.add_argument('--atlas-size', type=int, default=DEFAULT_ATLAS_SIZE)
+    args = parser.parse_args()
+    print(build_thumbnail_atlases(args.content_path, args.thumb_size, args.atlas_size))
@@ -0,0 +1,49 @@
+"""Import-time budget of the server.
+
+Importing server.py must not load the heavy packages (torch, umap, sklearn, transformers, ...), they are
+imported by the code paths that use them. Every import runs in a fresh interpreter so modules already loaded
+by the test run do not hide a regression.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+TOOL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(TOOL_DIR, 'server')
+VISUALIZE_DIR = os.path.join(TOOL_DIR, 'visualize')
+
+HEAVY_MODULES = ('torch', 'torchvision', 'umap', 'sklearn', 'transformers', 'matplotlib', 'tensorflow')
+# seconds, generous compared to the ~0.5 s cold import so slow machines do not fail the test
+IMPORT_TIME_BUDGET = 5.0
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    __import__(name)
+elapsed = time.perf_counter() - start
+heavy = [name for name in sys.argv[1].split(',') if name in sys.modules]
+print(json.dumps({'elapsed': elapsed, 'heavy': heavy}))
+"""
+
+def import_in_subprocess(cwd, modules):
+    output = subprocess.run([sys.executable, '-c', PROBE, ','.join(HEAVY_MODULES), *modules], cwd=cwd,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_server_import_loads_no_heavy_modules():
+    result = import_in_subprocess(SERVER_DIR, ['server', 'server_utils'])
+    assert result['heavy'] == []
+    assert result['elapsed'] < IMPORT_TIME_BUDGET
+
+
+def test_visualize_import_loads_no_tensorflow():
+    # visualize_model and the projectors need torch itself, only the tensorflow models are deferred
+    pytest.importorskip('torch')
+    result = import_in_subprocess(VISUALIZE_DIR, ['visualize_model', 'strategy.projector'])
+    assert 'tensorflow' not in result['heavy']
+    assert 'umap' not in result['heavy']
@@ -0,0 +1,334 @@
+"""Process-wide cache for artifacts loaded from content_path (npy arrays, json files, ...)
+
+Entries are keyed by the file path (plus a loader tag) and validated against the file's mtime and size,
+so a file rewritten by a new visualization run is reloaded on the next access. The total size of the
+cached values is bounded by a memory budget, least recently used entries are evicted first.
+
+The budget defaults to 2048 MB and can be changed with the TTV_ARTIFACT_CACHE_MB environment variable
+or configure_artifact_cache(max_bytes).
+
+Per-epoch .npy files (<root>/epochs/epoch_<k>/<name>.npy) that were packed into an epoch store and removed
+are read from the store, see epoch_store.py. Removed files that have a quantized version are decoded from
+it, see quantization.py.
+
+KeyedLRU is the same kind of cache for expensive objects built from files (subject models, influence
+sessions): its own budget, and a value is built only once when several threads ask for it at the same time.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from epoch_store import EpochStore, INFO_FILE as STORE_INFO_FILE, store_files, store_location
+from quantization import QuantizedArray, quantized_files, quantized_source
+
+DEFAULT_CACHE_MB = 2048
+
+def file_fingerprint(path):
+    """(mtime_ns, size) of path, None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def write_atomic(path, write):
+    """
+    Write path with write(binary file) through a uniquely named temporary file in the same directory, then
+    rename it into place. Concurrent writers (threads, preforked workers) never share a temporary file, and
+    readers see either the old or the new file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _estimate_nbytes(value, paths):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    # python objects parsed from files: use the file size as a rough estimate
+    return sum(fingerprint[1] for fingerprint in map(file_fingerprint, paths) if fingerprint is not None)
+
+
+class ArtifactCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (fingerprints, value, nbytes)
+        self._lock = threading.RLock()
+        self._observers = []
+
+    def get(self, key, paths, loader, nbytes=None):
+        """
+        Return the cached value for key, or call loader() and cache its result.
+
+        Args:
+            key (hashable): cache key
+            paths (list of str): files the value is derived from, used for invalidation
+            loader (callable): builds the value when it is missing or stale
+            nbytes (callable): optional, value -> estimated memory footprint in bytes
+        """
+        fingerprints = tuple(file_fingerprint(path) for path in paths)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprints:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._notify(key, True, 0.0)
+                return entry[1]
+            self.misses += 1
+
+        start = time.perf_counter()
+        value = loader()
+        self._notify(key, False, time.perf_counter() - start)
+        size = nbytes(value) if nbytes is not None else _estimate_nbytes(value, paths)
+
+        with self._lock:
+            self._discard(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (fingerprints, value, size)
+                self.current_bytes += size
+                self._evict()
+        return value
+
+    def add_observer(self, observer):
+        """Register observer(key, hit, load_seconds), called on every lookup (load_seconds is 0 for hits)."""
+        self._observers.append(observer)
+
+    def _notify(self, key, hit, seconds):
+        for observer in self._observers:
+            observer(key, hit, seconds)
+
+    def configure(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+
+artifact_cache = ArtifactCache(int(os.environ.get('TTV_ARTIFACT_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
+
+
+class KeyedLRU:
+    def __init__(self, max_size, sizeof=None, on_evict=None):
+        """
+        Args:
+            max_size (int): budget, in the unit of sizeof
+            sizeof (callable): optional, value -> size, every value counts 1 by default
+            on_evict (callable): optional, called (outside the lock) after values were dropped
+        """
+        self.max_size = max_size
+        self.current_size = 0
+        self.loads = 0
+        self._sizeof = sizeof or (lambda value: 1)
+        self._on_evict = on_evict
+        self._entries = OrderedDict()  # key -> (fingerprints, value, size)
+        self._building = {}            # key -> lock, so a value is only built once
+        self._lock = threading.Lock()
+
+    def get(self, key, paths, factory):
+        """
+        Return the value for key, or build it with factory() when it is missing or paths changed.
+
+        Args:
+            key (hashable): e.g. (content_path, epoch, device)
+            paths (list of str): files the value is built from, e.g. the checkpoint
+            factory (callable): returns the value
+        """
+        fingerprints = tuple(file_fingerprint(path) for path in paths)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprints:
+                self._entries.move_to_end(key)
+                return entry[1]
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == fingerprints:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                # drop a stale value before building its replacement
+                self._discard(key)
+            try:
+                value = factory()
+            except Exception:
+                with self._lock:
+                    self._building.pop(key, None)
+                raise
+            size = self._sizeof(value)
+            with self._lock:
+                self.loads += 1
+                if size <= self.max_size:
+                    self._entries[key] = (fingerprints, value, size)
+                    self.current_size += size
+                evicted = self._evict()
+                self._building.pop(key, None)
+        if evicted and self._on_evict is not None:
+            self._on_evict()
+        return value
+
+    def building(self, key):
+        """True if the value of key is cached or being built."""
+        with self._lock:
+            return key in self._entries or key in self._building
+
+    def newest_size(self):
+        """Size of the most recently used value, 0 when empty."""
+        with self._lock:
+            return next(reversed(self._entries.values()))[2] if self._entries else 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def clear(self):
+        with self._lock:
+            evicted = bool(self._entries)
+            self._entries.clear()
+            self.current_size = 0
+        if evicted and self._on_evict is not None:
+            self._on_evict()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_size -= entry[2]
+
+    def _evict(self):
+        evicted = False
+        while self.current_size > self.max_size and self._entries:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.current_size -= size
+            evicted = True
+        return evicted
+
+
+def configure_artifact_cache(max_bytes):
+    artifact_cache.configure(max_bytes)
+
+def open_epoch_store(store_dir):
+    store_info_path = os.path.join(store_dir, STORE_INFO_FILE)
+    return artifact_cache.get(('epoch_store', store_dir), [store_info_path], lambda: EpochStore(store_dir), nbytes=lambda store: 0)
+
+def _stored_epoch(path):
+    # (store_dir, name, epoch) of a missing per-epoch file that is held by an epoch store
+    if os.path.exists(path):
+        return None
+    location = store_location(path)
+    if location is None or not os.path.exists(os.path.join(location[0], STORE_INFO_FILE)):
+        return None
+    store_dir, name, epoch = location
+    return location if open_epoch_store(store_dir).has(name, epoch) else None
+
+def load_quantized(path):
+    """QuantizedArray of path (memory-mapped codes), see quantization.py."""
+    return artifact_cache.get(('quantized', path), quantized_files(path), lambda: QuantizedArray(path), nbytes=lambda array: 0)
+
+def _quantized(path):
+    # a missing file that has a quantized version
+    return not os.path.exists(path) and quantized_source(path) is not None
+
+def npy_exists(path):
+    """True if the .npy file exists, is held by an epoch store or has a quantized version."""
+    return os.path.exists(path) or _stored_epoch(path) is not None or _quantized(path)
+
+def npy_source_paths(path):
+    """Files the content of path is read from, for cache invalidation."""
+    location = _stored_epoch(path)
+    if location is not None:
+        return store_files(location[0], location[1])
+    return quantized_files(path) if _quantized(path) else [path]
+
+def load_npy(path, allow_pickle=False):
+    """Load a .npy file through the artifact cache. The returned array is shared, hence read-only."""
+    location = _stored_epoch(path)
+    if location is not None:
+        store_dir, name, epoch = location
+        def load_stored():
+            array = np.ascontiguousarray(open_epoch_store(store_dir).read_epoch(name, epoch))
+            array.setflags(write=False)
+            return array
+        return artifact_cache.get(('npy', path), store_files(store_dir, name), load_stored)
+    if _quantized(path):
+        def load_decoded():
+            quantized = load_quantized(path)
+            array = quantized.decode(quantized.codes)
+            array.setflags(write=False)
+            return array
+        return artifact_cache.get(('npy', path), quantized_files(path), load_decoded)
+
+    def loader():
+        array = np.load(path, allow_pickle=allow_pickle)
+        array.setflags(write=False)
+        return array
+    return artifact_cache.get(('npy', path), [path], loader)
+
+def load_npy_mmap(path, allow_pickle=False):
+    """
+    Memory-map a .npy file (read-only), pages are read from disk on access and stay in the page cache.
+
+    Object arrays cannot be mapped, files held by an epoch store or only available quantized are decoded,
+    these are loaded like load_npy.
+    """
+    if _stored_epoch(path) is not None or _quantized(path):
+        return load_npy(path, allow_pickle=allow_pickle)
+
+    def loader():
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            array = np.load(path, allow_pickle=allow_pickle)
+            array.setflags(write=False)
+            return array
+    # a mapping costs address space, not memory; only count arrays that were actually loaded
+    return artifact_cache.get(('npy_mmap', path), [path], loader,
+                              nbytes=lambda array: 0 if isinstance(array, np.memmap) else array.nbytes)
+
+def load_json(path):
+    """Load a json file through the artifact cache. The returned object is shared, do not modify it."""
+    def loader():
+        with open(path, 'r') as f:
+            return json.load(f)
+    return artifact_cache.get(('json', path), [path], loader)
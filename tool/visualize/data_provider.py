@@ -4,42 +4,106 @@ import sys
 import numpy as np
 import torch
 from utils import *
+from artifact_cache import load_npy, load_npy_mmap, load_json, load_quantized, open_epoch_store
+from quantization import quantized_source
+from epoch_store import STORE_DIR
+from model_cache import subject_models, model_nbytes
+from sample_index import sample_indices
+
+# rows gathered at once from a memory-mapped array, bounds the temporary memory of a gather
+GATHER_CHUNK_BYTES = 64 * 1024 * 1024
 
 def _softmax(x: np.ndarray) -> np.ndarray:
     e = np.exp(x - x.max(axis=-1, keepdims=True))
     return e / e.sum(axis=-1, keepdims=True)
 
+def _take_rows(array, index, copy=True):
+    """
+    array[index] along the first axis. Without copy, an identity or contiguous index returns a view of array,
+    any other index is gathered (chunk by chunk for memory maps) into one preallocated result.
+    """
+    if index is None or len(index) == 0:
+        rows = array if index is None else array[:0]
+        return rows.copy() if copy else rows
+    start, stop = int(index[0]), int(index[-1]) + 1
+    if stop - start == len(index) and (len(index) == 1 or np.all(np.diff(index) == 1)):
+        return array[start:stop].copy() if copy else array[start:stop]
+    if not isinstance(array, np.memmap):
+        return array[index]
+
+    result = np.empty((len(index),) + array.shape[1:], dtype=array.dtype)
+    row_bytes = max(array.itemsize * int(np.prod(array.shape[1:], dtype=np.int64)), 1)
+    chunk = max(GATHER_CHUNK_BYTES // row_bytes, 1)
+    for begin in range(0, len(index), chunk):
+        rows = index[begin:begin + chunk]
+        # read the rows of a chunk in file order
+        order = np.argsort(rows, kind='stable')
+        result[begin + order] = array[rows[order]]
+    return result
+
 class DataProvider():
     def __init__(self, config, device = None, selected_idxs=None):
         self.config = config
         self.selected_idxs = selected_idxs
+        # memory-map the npy artifacts instead of loading them, enabled by config["mmap"] or TTV_MMAP=1.
+        # In mmap mode the arrays returned by the get_* methods may be read-only views of the shared mapping,
+        # otherwise they are private writable copies
+        self.mmap = bool(config.get("mmap", os.environ.get("TTV_MMAP", "0") == "1"))
+        # read quantized embeddings (see quantization.py) even when the float files exist
+        self.quantized = bool(config.get("quantized", False))
         sys.path.append(self.config["content_path"]) # in order to locate model.py of subject model
         if device is not None:
             self.device = device
         else:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            
-        index_file_path = os.path.join(self.config["content_path"],"dataset","index.json")
-        if not os.path.exists(index_file_path):
-            self.index_dict = None
-        else:
-            with open(index_file_path, "r") as f:
-                self.index_dict = json.load(f)
+
+    def _sample_indices(self, type="all"):
+        # compiled int32 index of the split, None when the dataset has no index.json
+        return sample_indices(self.config["content_path"], type)
+
+    def _load_rows(self, path, type="all", allow_pickle=False):
+        # rows of the split in display order, views of a memory-mapped file in mmap mode when possible,
+        # a private copy otherwise (load_npy arrays are shared by the whole process through the artifact cache)
+        load = load_npy_mmap if self.mmap else load_npy
+        return _take_rows(load(path, allow_pickle=allow_pickle), self._sample_indices(type), copy=not self.mmap)
 
     ########################################################################################################################
     #                                                       MODEL                                                          #
     ########################################################################################################################
-    def load_subject_model(self, epoch):
+    def _subject_model_location(self, epoch):
+        return os.path.join(self.config["content_path"],"epochs", f"epoch_{epoch}", "model.pth")
+
+    def _build_subject_model(self, epoch):
         # definition of subject model, copied to content_path/scripts/model.py
         import scripts.model as subject_model
         model = eval("subject_model.{}()".format(self.config['model']))
         
         # state dict of subject model
-        subject_model_location = os.path.join(self.config["content_path"],"epochs", f"epoch_{epoch}", "model.pth")
+        subject_model_location = self._subject_model_location(epoch)
         model.load_state_dict(torch.load(subject_model_location, map_location=torch.device("cpu")))
         model.to(self.device)
         model.eval()
         return model
+
+    def _subject_model_key(self, epoch):
+        return (self.config["content_path"], self.config['model'], epoch, str(self.device))
+
+    def load_subject_model(self, epoch, prefetch_next=True):
+        """
+        Subject model of epoch in eval mode, loaded once and shared through the model cache (model_cache.py).
+        The model is shared, do not modify it. With prefetch_next, the checkpoint of the next available epoch
+        is loaded in the background.
+        """
+        model = subject_models.get(self._subject_model_key(epoch), [self._subject_model_location(epoch)],
+                                   lambda: self._build_subject_model(epoch))
+        if prefetch_next:
+            available_epochs = self.get_available_epochs()
+            later_epochs = [e for e in available_epochs if e > epoch]
+            if later_epochs and os.path.exists(self._subject_model_location(later_epochs[0])):
+                next_epoch = later_epochs[0]
+                subject_models.prefetch(self._subject_model_key(next_epoch), [self._subject_model_location(next_epoch)],
+                                        lambda: self._build_subject_model(next_epoch), nbytes=model_nbytes(model))
+        return model
     
     def load_subject_feat_func(self, epoch):
         subject_model = self.load_subject_model(epoch)
@@ -53,23 +117,13 @@ class DataProvider():
     def get_labels(self, type="all"):
         label_loc = os.path.join(self.config["content_path"], "dataset", "labels.npy")
         try:
-            all_labels = np.load(label_loc, allow_pickle=True)
-            if self.index_dict is None:
-                return all_labels
-            index = []
-            if type == "all":
-                for key in self.index_dict.keys():
-                    index.extend(self.index_dict[key])
-            else:
-                if type in self.index_dict.keys():
-                    index = self.index_dict[type]
-            return all_labels[index]
+            return self._load_rows(label_loc, type, allow_pickle=True)
         except Exception as e:
             print("no train labels saved !")
             return None
     
     def get_label_dict(self):
-        info_data = json.load(open(os.path.join(self.config["content_path"], "dataset", "info.json"), "r"))
+        info_data = load_json(os.path.join(self.config["content_path"], "dataset", "info.json"))
         class_list = info_data.get("classes", [])
         label_dict = {}
         for i, cls in enumerate(class_list):
@@ -83,24 +137,42 @@ class DataProvider():
     def get_representation(self, epoch, type="all"):
         representation_loc = os.path.join(self.config["content_path"],"epochs",f"epoch_{epoch}","embeddings.npy")
         try:
-            all_representation = np.load(representation_loc)
-            
-            if self.index_dict is None:
-                return all_representation
-            
-            index = []
-            if type == "all":
-                for key in self.index_dict.keys():
-                    index.extend(self.index_dict[key])
-            else:
-                if type in self.index_dict.keys():
-                    index = self.index_dict[type]
-                    
-            return all_representation[index]
+            if quantized_source(representation_loc) is not None and (self.quantized or not os.path.exists(representation_loc)):
+                # dequantize only the rows of the split
+                quantized = load_quantized(representation_loc)
+                return quantized.decode(_take_rows(quantized.codes, self._sample_indices(type), copy=False))
+            return self._load_rows(representation_loc, type)
         except Exception as e:
             print(e)
             return None
                 
+    def get_sample_history(self, indices, name="embeddings", epochs=None):
+        """
+        [K, T, ...] values of name (embeddings, predictions) of the samples indices (display order) over epochs
+        (default all available epochs). Reads only the rows of these samples when the run is packed into an
+        epoch store (see epoch_store.py), otherwise one row gather per epoch file.
+        """
+        epochs = self.get_available_epochs() if epochs is None else list(epochs)
+        rows = np.asarray(indices, dtype=np.int64)
+        order = self._sample_indices("all")
+        if order is not None:
+            rows = order[rows].astype(np.int64)
+
+        store_dir = os.path.join(self.config["content_path"], STORE_DIR)
+        if os.path.isdir(store_dir):
+            store = open_epoch_store(store_dir)
+            if store.has(name) and all(store.has(name, epoch) for epoch in epochs):
+                return store.read_samples(name, rows, epochs)
+
+        history = None
+        for t, epoch in enumerate(epochs):
+            path = os.path.join(self.config["content_path"], "epochs", f"epoch_{epoch}", f"{name}.npy")
+            array = (load_npy_mmap if self.mmap else load_npy)(path)
+            if history is None:
+                history = np.empty((len(rows), len(epochs)) + array.shape[1:], dtype=array.dtype)
+            history[:, t] = array[rows]
+        return history
+
     ########################################################################################################################
     #                                                       PREDICTION                                                     #
     ########################################################################################################################
@@ -112,27 +184,14 @@ class DataProvider():
         :return: pred, numpy.ndarray
         '''
         pred_func = self.load_subject_pred_func(epoch)
-        data = torch.from_numpy(data)
-        data = data.to(self.device)
-        pred = batch_run(pred_func, data, desc="getting prediction")
+        # batches are moved to the device one at a time
+        pred = batch_run(pred_func, data, desc="getting prediction", device=self.device)
         return pred
 
     def _get_prediction_scores(self, epoch, type="all"):
         pred_loc = os.path.join(self.config["content_path"],"epochs",f"epoch_{epoch}","predictions.npy")
         try:
-            all_pred = np.load(pred_loc)
-            
-            if self.index_dict is None:
-                return all_pred
-                
-            index = []
-            if type == "all":
-                for key in self.index_dict.keys():
-                    index.extend(self.index_dict[key])
-            else:
-                if type in self.index_dict.keys():
-                    index = self.index_dict[type]
-            return all_pred[index]
+            return self._load_rows(pred_loc, type)
         except Exception as e:
             print(e)
             return None
@@ -168,7 +227,7 @@ class DataProvider():
     def get_expected_alignment(self):
         alignment_path = os.path.join(self.config["content_path"], "dataset", "align.json")
         if os.path.exists(alignment_path):
-            json_data = json.load(open(alignment_path, "r"))
+            json_data = load_json(alignment_path)
             return json_data['ground_truth_pairs']
         else:
             return []
\ No newline at end of file
@@ -47,6 +47,17 @@ def load_epoch_stack_from_dir(root_epochs_dir: str):
     Returns:
         X: [T,N,D], t: [T]
     """
+    # run packed into an epoch store (tool/visualize/epoch_store.py) next to the epochs dir
+    store_dir = os.path.join(os.path.dirname(os.path.normpath(root_epochs_dir)), "epoch_store")
+    if os.path.isfile(os.path.join(store_dir, "info.json")):
+        import sys
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+        from epoch_store import EpochStore
+        store = EpochStore(store_dir)
+        if store.has("embeddings"):
+            X = store.read_stack("embeddings").astype(np.float32, copy=False)
+            return X, np.arange(len(store.epochs), dtype=np.float32), np.array(store.epochs, dtype=np.int64)
+
     if not os.path.isdir(root_epochs_dir):
         raise FileNotFoundError(f"Epochs dir not found: {root_epochs_dir}")
     entries: List[Tuple[int, str]] = []
@@ -0,0 +1,195 @@
+"""Consolidated, chunked storage of per-epoch arrays.
+
+A run keeps one array per epoch in <root>/epochs/epoch_<k>/<name>.npy (embeddings, predictions, or the
+projections of a visualization with root = visualize/<vis_id>). pack_epoch_store packs them into
+<root>/epoch_store/:
+    info.json   {epochs, arrays: {name: {shape: [T, N, ...], dtype, epoch_chunk, sample_chunk}}}
+    <name>.npy  the [T, N, ...] array in chunk-major order [T / epoch_chunk, N / sample_chunk,
+                sample_chunk, epoch_chunk, ...] (zero padded), read through a memory map
+
+Within a chunk the epochs of one sample are contiguous, so the history of a sample is T / epoch_chunk
+contiguous runs of epoch_chunk rows: reading it touches about T rows instead of T whole files.
+
+Reading is transparent: artifact_cache.load_npy falls back to the store when an epochs/epoch_<k>/<name>.npy
+file is missing, so packed runs can drop the per-epoch files (--remove-source). Packing again only replaces
+the arrays that are packed, the other arrays of an existing store are kept.
+
+Run after the run is exported:
+    python epoch_store.py <content_path> [--vis-id <vis_id>] [--names embeddings predictions]
+        [--epoch-chunk 8] [--sample-chunk 64] [--remove-source]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+STORE_DIR = 'epoch_store'
+INFO_FILE = 'info.json'
+DEFAULT_NAMES = ('embeddings', 'predictions')
+DEFAULT_EPOCH_CHUNK = 8
+DEFAULT_SAMPLE_CHUNK = 64
+
+def _epoch_dirs(epochs_dir):
+    epochs = []
+    if os.path.isdir(epochs_dir):
+        for name in os.listdir(epochs_dir):
+            if name.startswith('epoch_') and name[len('epoch_'):].isdigit():
+                epochs.append(int(name[len('epoch_'):]))
+    return sorted(epochs)
+
+def pack_epoch_store(root, names=DEFAULT_NAMES, epoch_chunk=DEFAULT_EPOCH_CHUNK, sample_chunk=DEFAULT_SAMPLE_CHUNK,
+                     remove_source=False):
+    """
+    Pack root/epochs/epoch_<k>/<name>.npy into root/epoch_store, one epoch in memory at a time.
+
+    Arrays already in the store and not packed again (not in names, or their per-epoch files were removed) are
+    kept, all arrays of a store must be saved for the same epochs.
+
+    Returns:
+        dict: the content of info.json
+    """
+    epochs_dir = os.path.join(root, 'epochs')
+    store_dir = os.path.join(root, STORE_DIR)
+    info_path = os.path.join(store_dir, INFO_FILE)
+    info = {'epochs': [], 'arrays': {}}
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as f:
+            info = json.load(f)
+
+    sources = {}
+    for name in names:
+        epochs = [epoch for epoch in _epoch_dirs(epochs_dir)
+                  if os.path.exists(os.path.join(epochs_dir, f'epoch_{epoch}', f'{name}.npy'))]
+        if epochs:
+            sources[name] = epochs
+    kept = [name for name in info['arrays'] if name not in sources]
+    for name, epochs in sources.items():
+        expected, other = (info['epochs'], kept) if kept else (next(iter(sources.values())), list(sources))
+        if epochs != expected:
+            raise ValueError(f"{name} is not saved for the same epochs as {other}")
+    if sources:
+        info['epochs'] = next(iter(sources.values()))
+
+    os.makedirs(store_dir, exist_ok=True)
+    packed_files = []
+    for name, epochs in sources.items():
+        first = np.load(os.path.join(epochs_dir, f'epoch_{epochs[0]}', f'{name}.npy'), mmap_mode='r')
+        num_samples, row_shape = first.shape[0], first.shape[1:]
+        num_epoch_chunks = -(-len(epochs) // epoch_chunk)
+        num_sample_chunks = -(-num_samples // sample_chunk)
+        tmp_path = os.path.join(store_dir, f'{name}.tmp.npy')
+        data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=first.dtype,
+                                         shape=(num_epoch_chunks, num_sample_chunks, sample_chunk, epoch_chunk) + row_shape)
+        padded = np.zeros((num_sample_chunks * sample_chunk,) + row_shape, dtype=first.dtype)
+        for t, epoch in enumerate(epochs):
+            file_path = os.path.join(epochs_dir, f'epoch_{epoch}', f'{name}.npy')
+            array = np.load(file_path, mmap_mode='r')
+            if array.shape != first.shape:
+                raise ValueError(f"Epoch {epoch} {name} shape mismatch {array.shape} != {first.shape}")
+            padded[:num_samples] = array
+            data[t // epoch_chunk, :, :, t % epoch_chunk] = padded.reshape((num_sample_chunks, sample_chunk) + row_shape)
+            packed_files.append(file_path)
+        data.flush()
+        del data
+        os.replace(tmp_path, os.path.join(store_dir, f'{name}.npy'))
+
+        info['arrays'][name] = {
+            'shape': [len(epochs), num_samples] + list(row_shape),
+            'dtype': first.dtype.str,
+            'epoch_chunk': epoch_chunk,
+            'sample_chunk': sample_chunk,
+        }
+
+    with open(info_path + '.tmp', 'w') as f:
+        json.dump(info, f)
+    os.replace(info_path + '.tmp', info_path)
+    if remove_source:
+        for file_path in packed_files:
+            os.remove(file_path)
+    return info
+
+
+class EpochStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INFO_FILE), 'r') as f:
+            info = json.load(f)
+        self.epochs = [int(epoch) for epoch in info['epochs']]
+        self.arrays = info['arrays']
+        self._positions = {epoch: t for t, epoch in enumerate(self.epochs)}
+        self._data = {}
+
+    def has(self, name, epoch=None):
+        return name in self.arrays and (epoch is None or int(epoch) in self._positions)
+
+    def _chunked(self, name):
+        if name not in self._data:
+            self._data[name] = np.load(os.path.join(self.store_dir, f'{name}.npy'), mmap_mode='r')
+        return self._data[name]
+
+    def _epoch_positions(self, epochs):
+        if epochs is None:
+            return list(range(len(self.epochs)))
+        return [self._positions[int(epoch)] for epoch in epochs]
+
+    def read_epoch(self, name, epoch):
+        """[N, ...] array of one epoch."""
+        info = self.arrays[name]
+        t = self._positions[int(epoch)]
+        block = self._chunked(name)[t // info['epoch_chunk'], :, :, t % info['epoch_chunk']]
+        return block.reshape((-1,) + block.shape[2:])[:info['shape'][1]]
+
+    def read_samples(self, name, indices, epochs=None):
+        """[K, T, ...] history of the samples indices (over all stored epochs, or the given ones)."""
+        info = self.arrays[name]
+        epoch_chunk, sample_chunk = info['epoch_chunk'], info['sample_chunk']
+        indices = np.asarray(indices, dtype=np.int64)
+        positions = np.asarray(self._epoch_positions(epochs), dtype=np.int64)
+        data = self._chunked(name)
+        # [K, T / epoch_chunk, epoch_chunk, ...], one contiguous run per sample and epoch chunk
+        history = np.stack([data[:, i // sample_chunk, i % sample_chunk] for i in indices]) if len(indices) > 0 else \
+            np.empty((0, data.shape[0], epoch_chunk) + data.shape[4:], dtype=data.dtype)
+        history = history.reshape((len(indices), -1) + data.shape[4:])
+        return history[:, positions]
+
+    def read_stack(self, name, epochs=None):
+        """[T, N, ...] array of all stored epochs (or the given ones)."""
+        info = self.arrays[name]
+        positions = self._epoch_positions(epochs)
+        stack = np.empty((len(positions),) + tuple(info['shape'][1:]), dtype=np.dtype(info['dtype']))
+        for k, t in enumerate(positions):
+            stack[k] = self.read_epoch(name, self.epochs[t])
+        return stack
+
+
+def store_location(path):
+    """(store_dir, name, epoch) when path is <root>/epochs/epoch_<k>/<name>.npy, otherwise None."""
+    epoch_dir, file_name = os.path.split(path)
+    epochs_dir, epoch_name = os.path.split(epoch_dir)
+    root, epochs_name = os.path.split(epochs_dir)
+    if epochs_name != 'epochs' or not epoch_name.startswith('epoch_') or not file_name.endswith('.npy'):
+        return None
+    epoch = epoch_name[len('epoch_'):]
+    if not epoch.isdigit():
+        return None
+    return os.path.join(root, STORE_DIR), file_name[:-len('.npy')], int(epoch)
+
+def store_files(store_dir, name):
+    return [os.path.join(store_dir, INFO_FILE), os.path.join(store_dir, f'{name}.npy')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack the per-epoch arrays of a run into a chunked epoch store')
+    parser.add_argument('content_path')
+    parser.add_argument('--vis-id', default=None, help='pack the projections of this visualization instead')
+    parser.add_argument('--names', nargs='+', default=None)
+    parser.add_argument('--epoch-chunk', type=int, default=DEFAULT_EPOCH_CHUNK)
+    parser.add_argument('--sample-chunk', type=int, default=DEFAULT_SAMPLE_CHUNK)
+    parser.add_argument('--remove-source', action='store_true', help='delete the packed per-epoch files')
+    args = parser.parse_args()
+    if args.vis_id is not None:
+        root, names = os.path.join(args.content_path, 'visualize', args.vis_id), args.names or ['projection']
+    else:
+        root, names = args.content_path, args.names or list(DEFAULT_NAMES)
+    print(pack_epoch_store(root, names, args.epoch_chunk, args.sample_chunk, args.remove_source))
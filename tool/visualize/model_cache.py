@@ -0,0 +1,53 @@
+"""Loaded subject models, shared by the DataProvider instances of a process.
+
+Loading a subject model (import scripts.model, build it, torch.load the checkpoint, move it to the device)
+is done once per (content_path, epoch, device) and reused until the checkpoint changes. The total size of
+the cached models (parameters and buffers) is bounded by a memory budget, the least recently used model is
+dropped first. prefetch() loads a model on a background thread, e.g. the checkpoint of the next epoch while
+the current one is in use; a get() for a model that is being prefetched waits for it instead of loading it
+a second time.
+
+The budget defaults to 1024 MB and can be changed with the TTV_MODEL_CACHE_MB environment variable.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from artifact_cache import KeyedLRU
+
+DEFAULT_CACHE_MB = 1024
+
+def model_nbytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class SubjectModelCache(KeyedLRU):
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes, sizeof=model_nbytes)
+        self._executor = None
+
+    def prefetch(self, key, paths, factory, nbytes=None):
+        """
+        Load the model for key in the background, unless it is cached or being loaded.
+
+        nbytes is the expected size, the prefetch is skipped when it cannot be cached without evicting the
+        most recently used model.
+        """
+        if self.building(key):
+            return
+        if nbytes is not None and self.keys() and nbytes + self.newest_size() > self.max_size:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-prefetch')
+        self._executor.submit(self._prefetch, key, paths, factory)
+
+    def _prefetch(self, key, paths, factory):
+        try:
+            self.get(key, paths, factory)
+        except Exception as e:
+            # the foreground get() will load it again and report the error
+            print(f"Prefetching subject model {key} failed: {e}")
+
+
+subject_models = SubjectModelCache(int(os.environ.get('TTV_MODEL_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
@@ -0,0 +1,146 @@
+"""Compact encoding for projection trajectories ([T, N, 2] float arrays).
+
+Projections are quantized to int16 against shared xy bounds, each epoch is stored as the (wrapping int16)
+difference to the previous epoch, the two bytes of every value are split into separate planes and the
+result is compressed with deflate (zlib) or zstd. Consecutive epochs are highly correlated, so the deltas
+are small and compress well.
+
+Layout:
+    magic (4 bytes, b'TTVQ') | header length (uint32, little-endian) | header (utf-8 json) | compressed payload
+
+Decoding: decompress, re-interleave the byte planes of every epoch into little-endian int16, cumulative sum
+along the epoch axis (wrapping int16), then x = x_min + (q + 32768) * (x_max - x_min) / 65535, same for y.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'TTVQ'
+FILE_NAME = 'projections.ttvq'
+LEVELS = 65535
+OFFSET = 32768
+
+def _decompress(data, compression):
+    if compression == 'deflate':
+        return zlib.decompress(data)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+class ProjectionStackEncoder:
+    """
+    Incremental encoder, epochs are added one at a time so the whole trajectory never has to be in memory.
+
+    Args:
+        bounds (list of float): [x_min, y_min, x_max, y_max] used for quantization, values outside are clipped
+        compression (str): "deflate" or "zstd"
+    """
+    def __init__(self, bounds, compression='deflate', level=6):
+        self.bounds = [float(v) for v in bounds]
+        self.compression = compression
+        self.lower = np.array(self.bounds[:2], dtype=np.float64)
+        self.extent = np.maximum(np.array(self.bounds[2:], dtype=np.float64) - self.lower, 1e-12)
+        if compression == 'deflate':
+            self._compressor = zlib.compressobj(level)
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError("zstd compression requires the zstandard package")
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unsupported compression: {compression}")
+        self._chunks = []
+        self._previous = None
+        self.epochs = []
+        self.num_samples = None
+
+    def add(self, projection, epoch=None):
+        projection = np.asarray(projection, dtype=np.float64)
+        if self.num_samples is None:
+            self.num_samples = len(projection)
+        elif projection.shape != (self.num_samples, 2):
+            raise ValueError(f"projection must have shape {(self.num_samples, 2)}, got {projection.shape}")
+
+        quantized = np.rint((np.clip(projection, self.lower, self.lower + self.extent) - self.lower) / self.extent * LEVELS) - OFFSET
+        quantized = quantized.astype(np.int16)
+        # the int16 difference wraps around, which is undone by the wrapping cumsum when decoding
+        delta = quantized if self._previous is None else quantized - self._previous
+        self._previous = quantized
+
+        planes = delta.astype('<i2').view(np.uint8).reshape(-1, 2).T  # low bytes, then high bytes
+        self._chunks.append(self._compressor.compress(np.ascontiguousarray(planes).tobytes()))
+        self.epochs.append(int(epoch) if epoch is not None else len(self.epochs))
+
+    def finish(self):
+        self._chunks.append(self._compressor.flush())
+        header = json.dumps({
+            'shape': [len(self.epochs), self.num_samples or 0, 2],
+            'bounds': self.bounds,
+            'max_error': (self.extent / LEVELS / 2).tolist(),
+            'compression': self.compression,
+            'epochs': self.epochs,
+        }).encode('utf-8')
+        return b''.join([MAGIC, struct.pack('<I', len(header)), header] + self._chunks)
+
+
+def encode_projection_stack(stack, bounds=None, epochs=None, compression='deflate', level=6):
+    """
+    Encode a projection trajectory.
+
+    Args:
+        stack (numpy.ndarray): [T, N, 2] projections
+        bounds (list of float): [x_min, y_min, x_max, y_max] used for quantization, defaults to the data range
+        epochs (list of int): optional epoch numbers stored in the header
+        compression (str): "deflate" or "zstd"
+
+    Returns:
+        bytes: the encoded trajectory
+    """
+    stack = np.asarray(stack)
+    if stack.ndim != 3 or stack.shape[2] != 2:
+        raise ValueError(f"projection stack must have shape [T, N, 2], got {stack.shape}")
+    if bounds is None:
+        bounds = [stack[..., 0].min(), stack[..., 1].min(), stack[..., 0].max(), stack[..., 1].max()]
+    encoder = ProjectionStackEncoder(bounds, compression, level)
+    for t in range(len(stack)):
+        encoder.add(stack[t], epochs[t] if epochs is not None else None)
+    return encoder.finish()
+
+def read_header(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an encoded projection stack")
+    header_len, = struct.unpack_from('<I', data, len(MAGIC))
+    start = len(MAGIC) + 4
+    return json.loads(data[start:start + header_len].decode('utf-8')), start + header_len
+
+def read_header_from_file(path):
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 4)
+        if prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not an encoded projection stack: {path}")
+        header_len, = struct.unpack_from('<I', prefix, len(MAGIC))
+        return json.loads(f.read(header_len).decode('utf-8'))
+
+def decode_projection_stack(data):
+    """
+    Decode bytes produced by encode_projection_stack.
+
+    Returns:
+        (numpy.ndarray, dict): float32 [T, N, 2] projections and the header
+    """
+    header, payload_start = read_header(data)
+    shape = header['shape']
+    planes = np.frombuffer(_decompress(data[payload_start:], header['compression']), dtype=np.uint8)
+    # per epoch: [2 byte planes, N * 2 values]
+    planes = planes.reshape(shape[0], 2, shape[1] * 2)
+    deltas = np.ascontiguousarray(planes.transpose(0, 2, 1)).view('<i2').reshape(shape)
+    quantized = np.cumsum(deltas, axis=0, dtype=np.int16)
+
+    lower = np.array(header['bounds'][:2], dtype=np.float64)
+    extent = np.maximum(np.array(header['bounds'][2:], dtype=np.float64) - lower, 1e-12)
+    stack = (quantized.astype(np.float64) + OFFSET) * (extent / LEVELS) + lower
+    return stack.astype(np.float32), header
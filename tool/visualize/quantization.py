@@ -0,0 +1,160 @@
+"""Reduced precision storage of per-epoch embeddings.
+
+quantize_file writes <name>.<dtype>.npy next to <name>.npy (e.g. epochs/epoch_3/embeddings.int8.npy) and a
+sidecar <name>.quant.json:
+    dtype               "int8" or "float16"
+    scale, offset       per dimension, x = code * scale + offset (int8 only)
+    max_abs_error       per dimension maximum of |x - decoded x| over the stored samples
+    error_bound         maximum of max_abs_error, a hard bound of the element error of this file
+    distance_error_bound  bound of the change of any euclidean distance between two samples,
+                        2 * ||max_abs_error||_2
+    rmse                root mean squared element error
+
+int8 maps [min, max] of every dimension to the 256 codes (error at most scale / 2), float16 keeps about
+3 significant digits (relative error at most 2^-11). Both are decoded to float32.
+
+Reading is transparent: DataProvider.get_representation and artifact_cache.load_npy decode the quantized
+file when <name>.npy is missing, DataProvider prefers it with config["quantized"].
+
+Convert a run (prints the error report of every epoch):
+    python quantization.py <content_path> [--dtype int8] [--names embeddings] [--remove-source]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+DTYPES = ('int8', 'float16')
+DEFAULT_NAMES = ('embeddings',)
+CHUNK_ROWS = 65536
+
+def quantized_paths(path, dtype):
+    root, _ = os.path.splitext(path)
+    return f'{root}.{dtype}.npy', f'{root}.quant.json'
+
+def sidecar_path(path):
+    return quantized_paths(path, DTYPES[0])[1]
+
+def quantize_file(path, dtype='int8', remove_source=False):
+    """
+    Quantize the [N, D] array at path, rows are processed in chunks of CHUNK_ROWS.
+
+    Returns:
+        dict: the content of the sidecar
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported quantization dtype: {dtype}")
+    source = np.load(path, mmap_mode='r')
+    rows = source.reshape(len(source), -1)
+    num_dims = rows.shape[1]
+    codes_path, info_path = quantized_paths(path, dtype)
+
+    if dtype == 'int8':
+        low = np.full(num_dims, np.inf)
+        high = np.full(num_dims, -np.inf)
+        for start in range(0, len(rows), CHUNK_ROWS):
+            chunk = np.asarray(rows[start:start + CHUNK_ROWS], dtype=np.float64)
+            low, high = np.minimum(low, chunk.min(axis=0)), np.maximum(high, chunk.max(axis=0))
+        if len(rows) == 0:
+            low, high = np.zeros(num_dims), np.zeros(num_dims)
+        # the reader decodes in float32, quantize against the same rounded parameters
+        scale = (np.maximum(high - low, 1e-12) / 255).astype(np.float32)
+        offset = (low + 128 * scale.astype(np.float64)).astype(np.float32)
+    else:
+        scale = offset = None
+
+    tmp_path = codes_path + '.tmp.npy'
+    codes = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.dtype(dtype), shape=source.shape)
+    code_rows = codes.reshape(len(codes), -1)
+    max_abs_error = np.zeros(num_dims)
+    squared_error = 0.0
+    for start in range(0, len(rows), CHUNK_ROWS):
+        chunk = np.asarray(rows[start:start + CHUNK_ROWS], dtype=np.float64)
+        if dtype == 'int8':
+            encoded = np.clip(np.rint((chunk - offset) / scale), -128, 127).astype(np.int8)
+            decoded = encoded.astype(np.float32) * scale + offset
+        else:
+            encoded = chunk.astype(np.float16)
+            decoded = encoded.astype(np.float32)
+        code_rows[start:start + CHUNK_ROWS] = encoded
+        # errors of the float32 values the reader returns
+        error = np.abs(decoded.astype(np.float64) - chunk)
+        max_abs_error = np.maximum(max_abs_error, error.max(axis=0))
+        squared_error += float(np.square(error).sum())
+    codes.flush()
+    del codes
+    os.replace(tmp_path, codes_path)
+
+    info = {
+        'dtype': dtype,
+        'shape': list(source.shape),
+        'scale': None if scale is None else scale.tolist(),
+        'offset': None if offset is None else offset.tolist(),
+        'max_abs_error': max_abs_error.tolist(),
+        'error_bound': float(max_abs_error.max()) if num_dims > 0 else 0.0,
+        'distance_error_bound': float(2 * np.linalg.norm(max_abs_error)),
+        'rmse': float(np.sqrt(squared_error / max(rows.size, 1))),
+    }
+    with open(info_path, 'w') as f:
+        json.dump(info, f)
+    if remove_source:
+        os.remove(path)
+    return info
+
+
+class QuantizedArray:
+    def __init__(self, path):
+        """Quantized version of the array at path (which may no longer exist)."""
+        with open(sidecar_path(path), 'r') as f:
+            self.info = json.load(f)
+        self.dtype = self.info['dtype']
+        self.codes = np.load(quantized_paths(path, self.dtype)[0], mmap_mode='r')
+        self.shape = tuple(self.info['shape'])
+        if self.dtype == 'int8':
+            self.scale = np.asarray(self.info['scale'], dtype=np.float32)
+            self.offset = np.asarray(self.info['offset'], dtype=np.float32)
+
+    def decode(self, codes):
+        """float32 values of the given rows of codes."""
+        flat = np.asarray(codes).reshape(len(codes), -1)
+        if self.dtype == 'int8':
+            values = flat.astype(np.float32)
+            values *= self.scale
+            values += self.offset
+        else:
+            values = flat.astype(np.float32)
+        return values.reshape((len(codes),) + self.codes.shape[1:])
+
+
+def quantized_source(path):
+    """Sidecar path if a quantized version of path exists, otherwise None."""
+    info_path = sidecar_path(path)
+    return info_path if os.path.exists(info_path) else None
+
+def quantized_files(path):
+    info_path = sidecar_path(path)
+    with open(info_path, 'r') as f:
+        dtype = json.load(f)['dtype']
+    return [info_path, quantized_paths(path, dtype)[0]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize the per-epoch embeddings of a run to int8 or float16')
+    parser.add_argument('content_path')
+    parser.add_argument('--dtype', choices=DTYPES, default='int8')
+    parser.add_argument('--names', nargs='+', default=list(DEFAULT_NAMES))
+    parser.add_argument('--remove-source', action='store_true', help='delete the float files after conversion')
+    args = parser.parse_args()
+    epochs_dir = os.path.join(args.content_path, 'epochs')
+    for folder_name in sorted(os.listdir(epochs_dir)):
+        for name in args.names:
+            file_path = os.path.join(epochs_dir, folder_name, f'{name}.npy')
+            if not os.path.exists(file_path):
+                continue
+            info = quantize_file(file_path, args.dtype, args.remove_source)
+            source_bytes = int(np.prod(info['shape'])) * 4
+            stored_bytes = os.path.getsize(quantized_paths(file_path, args.dtype)[0])
+            print(f"{folder_name}/{name}: {args.dtype}, {source_bytes / max(stored_bytes, 1):.1f}x smaller than float32, "
+                  f"max error {info['error_bound']:.3g}, rmse {info['rmse']:.3g}, "
+                  f"distance error <= {info['distance_error_bound']:.3g}")
@@ -8,6 +8,7 @@ import matplotlib as mpl
 import numpy as np
 import base64
 from utils import convert_to_base64
+from projection_codec import ProjectionStackEncoder, FILE_NAME as PROJECTION_FILE_NAME
 
 # ---------------------
 # ResultGenerator:
@@ -31,15 +32,20 @@ class ResultGeneratorAbstractClass(ABC):
         pass
 
 class ResultGenerator(ResultGeneratorAbstractClass):
-    def __init__(self, config, data_provider, projector, cmap='tab10'):
+    def __init__(self, config, data_provider, projector, cmap='tab10', progress=None):
         self.config = config
         self.data_provider = data_provider
         self.projector = projector
+        self.progress = progress
         self.cmap = plt.get_cmap(cmap)
         self.classes = config["classes"]
         self.class_num = len(self.classes)
         self.resolution = config['vis_config']['resolution']
 
+    def report_progress(self, stage, current=None, total=None):
+        if self.progress is not None:
+            self.progress(stage, current, total)
+
     def visualize_all_epochs(self):
         epochs = self.config['available_epochs']
         
@@ -56,6 +62,7 @@ class ResultGenerator(ResultGeneratorAbstractClass):
             if not os.path.exists(projection_path):
                 os.makedirs(projection_path)
             np.save(os.path.join(projection_path, "projection.npy"), projection)
+            self.report_progress("projection", i + 1, len(epochs))
             
             # update xy limit
             if i >= partial_epoch_num:
@@ -67,14 +74,45 @@ class ResultGenerator(ResultGeneratorAbstractClass):
                 y_max = max(y_max, ebd_max[1])
 
         xy_limit = [x_min, y_min, x_max, y_max]
+        self.save_encoded_projections(epochs)
         
         if self.config["task_type"] == 'Classification':
             # save background image for each epoch using the same xy limit
             for i in range(len(epochs)):
                 self.save_background(epochs[i], self.resolution, xy_limit)
+                self.report_progress("background", i + 1, len(epochs))
         
         return xy_limit
 
+    def save_encoded_projections(self, epochs):
+        """
+        Optionally save all projections as one delta/int16 encoded file (see projection_codec.py), enabled by
+        vis_config["projection_encoding"] = "deflate" or "zstd". With vis_config["keep_projection_npy"] = False
+        the per-epoch projection.npy files are removed afterwards, the server then decodes the encoded file.
+        """
+        compression = self.config['vis_config'].get('projection_encoding')
+        if not compression:
+            return
+        vis_path = os.path.join(self.config['content_path'], "visualize", self.config["vis_id"])
+        projection_paths = [os.path.join(vis_path, "epochs", f"epoch_{epoch}", "projection.npy") for epoch in epochs]
+
+        # quantize against the range of all epochs, the xy limit skips the first third of the epochs
+        x_min, y_min, x_max, y_max = np.inf, np.inf, -np.inf, -np.inf
+        for projection_path in projection_paths:
+            projection = np.load(projection_path)
+            x_min, y_min = min(x_min, projection[:, 0].min()), min(y_min, projection[:, 1].min())
+            x_max, y_max = max(x_max, projection[:, 0].max()), max(y_max, projection[:, 1].max())
+
+        encoder = ProjectionStackEncoder([x_min, y_min, x_max, y_max], compression)
+        for epoch, projection_path in zip(epochs, projection_paths):
+            encoder.add(np.load(projection_path), epoch)
+        with open(os.path.join(vis_path, PROJECTION_FILE_NAME), 'wb') as f:
+            f.write(encoder.finish())
+
+        if not self.config['vis_config'].get('keep_projection_npy', True):
+            for projection_path in projection_paths:
+                os.remove(projection_path)
+
     def save_background(self, epoch, resolution, xy_limit=None):
         pixel_color = self.get_epoch_decision_view(epoch, resolution, xy_limit)
         
@@ -155,10 +193,15 @@ class ResultGenerator(ResultGeneratorAbstractClass):
         return color_rgb
 
 class UmapResultGenerator():
-    def __init__(self, config, data_provider, projector):
+    def __init__(self, config, data_provider, projector, progress=None):
         self.config = config
         self.data_provider = data_provider
         self.projector = projector
+        self.progress = progress
+
+    def report_progress(self, stage, current=None, total=None):
+        if self.progress is not None:
+            self.progress(stage, current, total)
         
     def visualize_all_epochs(self):
         epochs = self.config['available_epochs']
@@ -174,6 +217,7 @@ class UmapResultGenerator():
             if not os.path.exists(projection_path):
                 os.makedirs(projection_path)
             np.save(os.path.join(projection_path, "projection.npy"), projection)
+            self.report_progress("projection", i + 1, len(epochs))
             # update xy limit
             if i >= partial_epoch_num:
                 ebd_min = np.min(projection, axis=0)
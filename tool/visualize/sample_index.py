@@ -0,0 +1,79 @@
+"""Compiled sample index of a content_path.
+
+dataset/index.json maps every split ("train", "test", ...) to a list of sample indices. Parsing it and
+concatenating python lists on every call is slow for large datasets, so the index is compiled once into
+read-only int32 arrays, one per split plus "all" (every split concatenated in file order), and kept in
+the artifact cache. The arrays are also written to a dataset/index.npz sidecar, which is loaded instead
+of index.json as long as it is not older than index.json.
+"""
+import json
+import os
+
+import numpy as np
+
+from artifact_cache import artifact_cache, write_atomic
+
+SIDECAR_NAME = 'index.npz'
+ALL = 'all'
+
+def _compile(index_dict):
+    arrays = {split: np.asarray(indices, dtype=np.int32).reshape(-1) for split, indices in index_dict.items()}
+    arrays[ALL] = np.concatenate(list(arrays.values())) if arrays else np.empty(0, dtype=np.int32)
+    return arrays
+
+def _write_sidecar(sidecar_path, arrays):
+    try:
+        # ALL is rebuilt on load, only store the splits (np.savez keeps their order)
+        write_atomic(sidecar_path, lambda f: np.savez(f, **{split: array for split, array in arrays.items() if split != ALL}))
+    except OSError:
+        # read-only dataset directory, the in-memory cache still applies
+        pass
+
+def _load_sidecar(sidecar_path, index_file_path):
+    if not os.path.exists(sidecar_path) or os.path.getmtime(sidecar_path) < os.path.getmtime(index_file_path):
+        return None
+    try:
+        with np.load(sidecar_path) as data:
+            return _compile({split: data[split] for split in data.files})
+    except Exception:
+        return None  # damaged sidecar, rebuilt from index.json
+
+def _load(index_file_path, write_sidecar):
+    sidecar_path = os.path.join(os.path.dirname(index_file_path), SIDECAR_NAME)
+    arrays = _load_sidecar(sidecar_path, index_file_path)
+    if arrays is None:
+        with open(index_file_path, 'r') as f:
+            arrays = _compile(json.load(f))
+        if write_sidecar:
+            _write_sidecar(sidecar_path, arrays)
+
+    for array in arrays.values():
+        array.setflags(write=False)
+    return arrays
+
+def load_sample_index(content_path, write_sidecar=True):
+    """
+    Load the compiled sample index of content_path.
+
+    Returns:
+        dict or None: split name -> read-only int32 array, including "all";
+            None if content_path has no dataset/index.json
+    """
+    index_file_path = os.path.join(content_path, 'dataset', 'index.json')
+    if not os.path.exists(index_file_path):
+        return None
+    return artifact_cache.get(('sample_index', index_file_path), [index_file_path],
+                              lambda: _load(index_file_path, write_sidecar),
+                              nbytes=lambda arrays: sum(array.nbytes for array in arrays.values()))
+
+def sample_indices(content_path, split=ALL):
+    """
+    Sample indices of one split, or of every split for "all". An unknown split yields an empty array.
+
+    Returns:
+        numpy.ndarray or None: read-only int32 array, None if content_path has no dataset/index.json
+    """
+    arrays = load_sample_index(content_path)
+    if arrays is None:
+        return None
+    return arrays.get(split, np.empty(0, dtype=np.int32))
@@ -0,0 +1,133 @@
+"""Spatial index of a 2D projection for viewport queries with a point budget.
+
+The projection bounds are divided into a 2^L x 2^L grid (the leaves of a quadtree, L is chosen so that a
+leaf holds about LEAF_SIZE points on average). Points are sorted by row-major leaf id, so the points of one
+grid row inside a viewport are one contiguous slice.
+
+Every quadtree level l <= L keeps one representative per (cell, class): a random member of the group and
+the number of points it stands for. Levels are built bottom-up from the next finer level and stored in
+row-major cell order as well. Levels (other than the root) with more than N * MAX_LEVEL_FRACTION groups are
+not stored, at that resolution the exact points are cheap enough.
+
+A query costs O(grid rows in the viewport + returned points), independent of the number of points:
+    - the visible points are returned exactly when there are at most budget of them
+    - otherwise the representatives of the finest level that fits in the budget
+"""
+import numpy as np
+
+LEAF_SIZE = 16
+MAX_LEVEL = 10
+MAX_LEVEL_FRACTION = 0.5
+
+
+class SpatialIndex:
+    def __init__(self, positions, labels, seed=0):
+        """
+        Args:
+            positions (numpy.ndarray): [N, 2] point positions
+            labels (numpy.ndarray): [N] non-negative class index of every point
+        """
+        positions = np.asarray(positions, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int64)
+        self.positions = positions
+        self.labels = labels
+        num_points = len(positions)
+
+        if num_points > 0:
+            low, high = positions.min(axis=0).astype(np.float64), positions.max(axis=0).astype(np.float64)
+        else:
+            low, high = np.zeros(2), np.ones(2)
+        self.low = low
+        self.extent = np.maximum(high - low, 1e-12)
+
+        self.max_level = int(np.clip(np.ceil(np.log(max(num_points / LEAF_SIZE, 1)) / np.log(4)), 0, MAX_LEVEL))
+        grid_size = 1 << self.max_level
+        cells = self._cell_coordinates(positions)
+        leaf = cells[:, 1] * grid_size + cells[:, 0]
+        self.order = np.argsort(leaf, kind='stable').astype(np.int64)
+        self.leaf_start = np.concatenate([[0], np.cumsum(np.bincount(leaf, minlength=grid_size * grid_size))])
+
+        # representatives, built bottom-up; level -> (cell_start, index, count, label)
+        self.levels = {}
+        num_classes = int(labels.max()) + 1 if num_points > 0 else 1
+        rank = np.random.default_rng(seed).permutation(num_points)
+        group_cell, group_label, group_index, group_count, group_rank = leaf, labels, np.arange(num_points), np.ones(num_points, dtype=np.int64), rank
+        for level in range(self.max_level, -1, -1):
+            size = 1 << level
+            if level == self.max_level:
+                parent = group_cell
+            else:
+                child_size = size << 1
+                parent = (group_cell // child_size >> 1) * size + (group_cell % child_size >> 1)
+            key = parent * num_classes + group_label
+            # smallest random rank first within every (cell, class) group
+            sort = np.lexsort((group_rank, key))
+            key = key[sort]
+            first = np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1]])) if len(key) > 0 else np.empty(0, dtype=np.int64)
+            group_count = np.add.reduceat(group_count[sort], first) if len(first) > 0 else np.empty(0, dtype=np.int64)
+            group_cell = key[first] // num_classes
+            group_label = key[first] % num_classes
+            group_index = group_index[sort][first]
+            group_rank = group_rank[sort][first]
+            if len(first) <= num_points * MAX_LEVEL_FRACTION or level == 0:
+                cell_start = np.searchsorted(group_cell, np.arange(size * size + 1))
+                self.levels[level] = (cell_start, group_index.astype(np.int64), group_count, group_label)
+
+    @property
+    def nbytes(self):
+        arrays = [self.positions, self.labels, self.order, self.leaf_start]
+        arrays += [array for level in self.levels.values() for array in level]
+        return sum(array.nbytes for array in arrays)
+
+    def _cell_coordinates(self, positions, level=None):
+        grid_size = 1 << (self.max_level if level is None else level)
+        cells = np.floor((np.asarray(positions, dtype=np.float64) - self.low) / self.extent * grid_size)
+        return np.clip(cells, 0, grid_size - 1).astype(np.int64)
+
+    def _row_ranges(self, cell_start, viewport, level):
+        """Start and end offsets into a row-major cell table for every grid row of the viewport."""
+        grid_size = 1 << level
+        (x0, y0), (x1, y1) = self._cell_coordinates([viewport[:2], viewport[2:]], level)
+        rows = np.arange(y0, y1 + 1)
+        return cell_start[rows * grid_size + x0], cell_start[rows * grid_size + x1 + 1]
+
+    def query(self, viewport, budget):
+        """
+        Points inside viewport, at most budget of them.
+
+        Args:
+            viewport (sequence of float): [x_min, y_min, x_max, y_max]
+            budget (int): maximum number of returned points
+
+        Returns:
+            dict: index [K] (point indices), count [K] (number of points each one represents),
+                level (None for exact points), visible (number of points in the grid cells of the viewport)
+            Inverted or non-finite viewports are empty.
+        """
+        x_min, y_min, x_max, y_max = (float(v) for v in viewport)
+        high = self.low + self.extent
+        empty = {'index': np.empty(0, dtype=np.int64), 'count': np.empty(0, dtype=np.int64), 'level': None, 'visible': 0}
+        if not np.all(np.isfinite([x_min, y_min, x_max, y_max])) or x_min > x_max or y_min > y_max:
+            return empty
+        if len(self.positions) == 0 or x_max < self.low[0] or y_max < self.low[1] or x_min > high[0] or y_min > high[1]:
+            return empty
+        viewport = np.array([x_min, y_min, x_max, y_max])
+
+        starts, ends = self._row_ranges(self.leaf_start, viewport, self.max_level)
+        visible = int((ends - starts).sum())
+        if visible <= budget:
+            index = np.concatenate([np.empty(0, dtype=np.int64)] + [self.order[start:end] for start, end in zip(starts, ends)])
+            position = self.positions[index]
+            inside = (position[:, 0] >= x_min) & (position[:, 0] <= x_max) & (position[:, 1] >= y_min) & (position[:, 1] <= y_max)
+            index = index[inside]
+            return {'index': index, 'count': np.ones(len(index), dtype=np.int64), 'level': None, 'visible': visible}
+
+        for level in sorted(self.levels, reverse=True):
+            cell_start, group_index, group_count, _ = self.levels[level]
+            starts, ends = self._row_ranges(cell_start, viewport, level)
+            if (ends - starts).sum() <= budget or level == 0:
+                groups = np.concatenate([np.empty(0, dtype=np.int64)] + [np.arange(start, end) for start, end in zip(starts, ends)])
+                if len(groups) > budget:
+                    # more classes than budget, keep the largest groups
+                    groups = groups[np.argsort(-group_count[groups], kind='stable')[:budget]]
+                return {'index': group_index[groups], 'count': group_count[groups], 'level': level, 'visible': visible}
@@ -16,8 +16,8 @@ from umap.umap_ import find_ab_params
 from utils import find_neighbor_preserving_rate
 
 class DeepVisualInsight(StrategyAbstractClass):
-    def __init__(self, config, data_provider):
-        super().__init__(config)
+    def __init__(self, config, data_provider, progress=None):
+        super().__init__(config, progress)
         self.initialize_model()
         self.data_provider = data_provider
 
@@ -74,8 +74,10 @@ class DeepVisualInsight(StrategyAbstractClass):
             optimizer = torch.optim.Adam(self.visualize_model.parameters(), lr=.01, weight_decay=1e-5)
             lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=4, gamma=.1)
             # Define Edge dataset
+            self.report_progress("edge_construction", i, len(available_epochs))
             spatial_cons = SingleEpochSpatialEdgeConstructor(self.data_provider, epoch, INIT_NUM, S_N_EPOCHS, B_N_EPOCHS, N_NEIGHBORS)
             edge_to, edge_from, probs, feature_vectors, attention = spatial_cons.construct()
+            self.report_progress("edge_construction", i + 1, len(available_epochs))
 
             probs = probs / (probs.max()+1e-3)
             eliminate_zeros = probs>1e-3
@@ -97,6 +99,7 @@ class DeepVisualInsight(StrategyAbstractClass):
             trainer.train(PATIENT, MAX_EPOCH)
             
             self.save_vis_model(self.visualize_model, epoch, trainer.loss, trainer.optimizer)
+            self.report_progress("training", i + 1, len(available_epochs))
 
             prev_model.load_state_dict(self.visualize_model.state_dict())
             for param in prev_model.parameters():
@@ -4,9 +4,9 @@ import os
 import json
 import numpy as np
 import torch
-import umap
 
 from tool.visualize.visualize_model import VisModel, SingleVisualizationModel
+from utils import batch_run
 
 # ------------------
 # Projector:
@@ -75,7 +75,7 @@ class Projector(ProjectorAbstractClass):
     
     def batch_inverse(self, iteration, embedding):
         self.load(iteration)
-        data = self.vis_model.decoder(torch.from_numpy(embedding).to(dtype=torch.float32, device=self.device)).cpu().detach().numpy()
+        data = batch_run(self.vis_model.decoder, embedding, desc="inverse projection", device=self.device)
         return data
     
     def individual_inverse(self, iteration, embedding):
@@ -281,6 +281,7 @@ class UmapProjector():
         min_dist = config['vis_config']['min_dist']
         metric = config['vis_config']['metric']
         
+        import umap
         self.reducer = umap.UMAP(n_neighbors=n_neighbors, min_dist=min_dist, metric=metric)
 
     def batch_project(self, embeddings):
@@ -366,7 +367,6 @@ class PROCESSProjector(Projector):
         print("Successfully load the DVI visualization model for iteration {}".format(iteration))
 
 
-import tensorflow as tf
 class tfDVIProjector(ProjectorAbstractClass):
     def __init__(self, content_path, flag, verbose=0):
         self.content_path = content_path
@@ -383,6 +383,7 @@ class tfDVIProjector(ProjectorAbstractClass):
             return
         encoder_location = os.path.join(self.model_path, "Epoch_{:d}".format(epoch),"encoder" + self.flag)
         decoder_location = os.path.join(self.model_path, "Epoch_{:d}".format(epoch),"decoder" + self.flag)
+        import tensorflow as tf
         try:
             self.encoder = tf.keras.models.load_model(encoder_location)
             self.decoder = tf.keras.models.load_model(decoder_location)
@@ -456,6 +457,7 @@ class tfDVIDenseALProjector(ProjectorAbstractClass):
             return
         encoder_location = os.path.join(self.model_path, "Iteration_{:d}".format(iteration), "Epoch_{:d}".format(epoch),"encoder" + self.flag)
         decoder_location = os.path.join(self.model_path, "Iteration_{:d}".format(iteration), "Epoch_{:d}".format(epoch),"decoder" + self.flag)
+        import tensorflow as tf
         try:
             self.encoder = tf.keras.models.load_model(encoder_location)
             self.decoder = tf.keras.models.load_model(decoder_location)
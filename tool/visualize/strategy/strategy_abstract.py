@@ -5,8 +5,14 @@ import os
 import torch
 
 class StrategyAbstractClass(ABC):
-    def __init__(self, config):
+    def __init__(self, config, progress=None):
         self.config = config
+        # optional callback progress(stage, current, total), used to report training progress to the caller
+        self.progress = progress
+
+    def report_progress(self, stage, current=None, total=None):
+        if self.progress is not None:
+            self.progress(stage, current, total)
 
     @abstractmethod
     def initialize_model(self):
@@ -17,8 +17,8 @@ from data_provider import DataProvider
 from umap.umap_ import find_ab_params
 
 class TimeVis(StrategyAbstractClass):
-    def __init__(self, config, data_provider):
-        super().__init__(config)
+    def __init__(self, config, data_provider, progress=None):
+        super().__init__(config, progress)
         self.initialize_model()
         self.data_provider = data_provider
         
@@ -49,10 +49,12 @@ class TimeVis(StrategyAbstractClass):
 
         INIT_NUM = 10
         ALPHA, BETA = 1, 1
+        self.report_progress("edge_construction", 0, 1)
         spatial_cons = kcSpatialEdgeConstructor(data_provider=self.data_provider, init_num=INIT_NUM, s_n_epochs=S_N_EPOCHS, b_n_epochs=B_N_EPOCHS, n_neighbors=N_NEIGHBORS, MAX_HAUSDORFF=None, ALPHA=ALPHA, BETA=BETA)
         s_edge_to, s_edge_from, s_probs, feature_vectors, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention = spatial_cons.construct()
         temporal_cons = GlobalTemporalEdgeConstructor(X=feature_vectors, time_step_nums=time_step_nums, sigmas=sigmas, rhos=rhos, n_neighbors=N_NEIGHBORS, n_epochs=T_N_EPOCHS)
         t_edge_to, t_edge_from, t_probs = temporal_cons.construct()
+        self.report_progress("edge_construction", 1, 1)
 
         edge_to = np.concatenate((s_edge_to, t_edge_to),axis=0)
         edge_from = np.concatenate((s_edge_from, t_edge_from), axis=0)
@@ -72,8 +74,10 @@ class TimeVis(StrategyAbstractClass):
             sampler = WeightedRandomSampler(probs, n_samples, replacement=True)
         edge_loader = DataLoader(dataset, batch_size=1000, sampler=sampler)
 
+        self.report_progress("training", 0, 1)
         trainer = SingleVisTrainer(self.visualize_model, self.criterion, optimizer, lr_scheduler, edge_loader=edge_loader, DEVICE=self.device)
         trainer.train(PATIENT, MAX_EPOCH)
+        self.report_progress("training", 1, 1)
 
         self.save_vis_model(self.visualize_model, trainer.loss, trainer.optimizer)
         
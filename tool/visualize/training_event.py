@@ -1,103 +1,303 @@
 from scipy.spatial.distance import pdist, squareform
+import hashlib
+import json
+import os
 import numpy as np
 from typing import List, Dict, Any
 
+from artifact_cache import artifact_cache, file_fingerprint, write_atomic
+
+EVENT_TYPES = ('PredictionFlip', 'ConfidenceChange', 'SignificantMovement', 'InconsistentMovement')
+
+DEFAULT_PARAMS = {
+    # ConfidenceChange: minimum change of the confidence in the true label
+    'confidence_threshold': 0.5,
+    # SignificantMovement: threshold is mean + multiplier * std of the distance changes, default if there are none
+    'movement_std_multiplier': 2.0,
+    'movement_default_threshold': 0.5,
+    # InconsistentMovement: compare with the epoch this many checkpoints earlier,
+    # negative pairs must move closer by more than multiplier * mean absolute change
+    'inconsistent_epoch_gap': 5,
+    'negative_pair_multiplier': 6.0,
+}
+
+# parameters each detector depends on, only these are part of its cache key
+EVENT_PARAMS = {
+    'PredictionFlip': (),
+    'ConfidenceChange': ('confidence_threshold',),
+    'SignificantMovement': ('movement_std_multiplier', 'movement_default_threshold'),
+    'InconsistentMovement': ('inconsistent_epoch_gap', 'negative_pair_multiplier'),
+}
+
+# detectors return events as columns (one numpy array per field, one row per event, in detector order)
+EVENT_COLUMNS = {
+    'PredictionFlip': {'index': np.int64, 'label': np.int64, 'prev_pred': np.int64, 'curr_pred': np.int64},
+    'ConfidenceChange': {'index': np.int64, 'label': np.int64, 'prev_conf': np.float64, 'curr_conf': np.float64, 'target': np.int64},
+    'SignificantMovement': {'index': np.int64, 'prev_dist': np.float64, 'curr_dist': np.float64},
+    'InconsistentMovement': {'index': np.int64, 'index1': np.int64, 'positive': np.bool_, 'distance_change': np.float64},
+}
+
+SORT_KEYS = ('default', 'magnitude', 'index')
+
+def _empty_columns(event_type):
+    return {name: np.empty(0, dtype=dtype) for name, dtype in EVENT_COLUMNS[event_type].items()}
+
+def event_magnitude(event_type, columns):
+    """Absolute change of every event, used for sorting. Prediction flips have no magnitude (nan)."""
+    if event_type == 'ConfidenceChange':
+        return np.abs(columns['curr_conf'] - columns['prev_conf'])
+    if event_type == 'SignificantMovement':
+        return np.abs(columns['curr_dist'] - columns['prev_dist'])
+    if event_type == 'InconsistentMovement':
+        return np.abs(columns['distance_change'])
+    return np.full(len(columns['index']), np.nan)
+
+def event_rows(event_type, columns, rows, label_dict):
+    """Build the event dicts of the given rows."""
+    label_name = lambda label: label_dict.get(label, str(label))
+    events = []
+    if event_type == 'PredictionFlip':
+        for idx, label, prev_pred, curr_pred in zip(*(columns[name][rows].tolist() for name in ('index', 'label', 'prev_pred', 'curr_pred'))):
+            events.append({
+                "index": idx,
+                "label": label_name(label),
+                "prevPred": label_name(prev_pred),
+                "currPred": label_name(curr_pred),
+                "prevCorrect": prev_pred == label,
+                "currCorrect": curr_pred == label,
+                "influenceTarget": label_name(curr_pred),
+                "type": "PredictionFlip"
+            })
+    elif event_type == 'ConfidenceChange':
+        for idx, label, prev_conf, curr_conf, target in zip(*(columns[name][rows].tolist() for name in ('index', 'label', 'prev_conf', 'curr_conf', 'target'))):
+            events.append({
+                "index": idx,
+                "label": label_name(label),
+                "prevConf": prev_conf,
+                "currConf": curr_conf,
+                "change": curr_conf - prev_conf,
+                "influenceTarget": label_name(target),
+                "type": "ConfidenceChange"
+            })
+    elif event_type == 'SignificantMovement':
+        for idx, prev_dist, curr_dist in zip(*(columns[name][rows].tolist() for name in ('index', 'prev_dist', 'curr_dist'))):
+            change = curr_dist - prev_dist
+            events.append({
+                "index": idx,
+                "prevDist": prev_dist,
+                "currDist": curr_dist,
+                "distanceChange": change,
+                "movementType": "closer" if change < 0 else "farther",
+                "type": "SignificantMovement"
+            })
+    elif event_type == 'InconsistentMovement':
+        for idx, idx1, positive, change in zip(*(columns[name][rows].tolist() for name in ('index', 'index1', 'positive', 'distance_change'))):
+            events.append(dict(
+                index=idx,
+                index1=idx1,
+                expectation="Aligned" if positive else "NotAligned",
+                behavior="NotAligned" if positive else "Aligned",
+                distanceChange=change,
+                type="InconsistentMovement"
+            ))
+    return events
+
 class TrainingEventDetector:
-    def __init__(self, content_path, epoch, data_provider):
+    def __init__(self, content_path, epoch, data_provider, params=None):
         self.epoch = epoch
         self.content_path = content_path
         self.data_provider = data_provider
         self.available_epochs = self.data_provider.get_available_epochs()
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
 
-    def detect_events(self, event_types):
-        events = []
-        if 'PredictionFlip' in event_types:
-            events.extend(self._detect_prediction_flip_events())
-        if 'ConfidenceChange' in event_types:
-            events.extend(self._detect_confidence_change_events())
-        if 'SignificantMovement' in event_types:
-            events.extend(self._detect_significant_movement_events())
-        if 'InconsistentMovement' in event_types:
-            events.extend(self._detect_inconsistent_movement_events())
+    def detect_events(self, event_types, use_cache=True):
+        """
+        Detect events of the given types at self.epoch, all events as dicts.
+
+        With use_cache, results are persisted under epochs/epoch_<epoch>/events/ per event type and
+        detector parameters, and reused as long as the input files are unchanged.
+        """
+        events, _ = self.query_events(event_types, use_cache=use_cache)
         return events
 
+    def detect_event_columns(self, event_type, use_cache=True):
+        detectors = {
+            'PredictionFlip': self._detect_prediction_flip_events,
+            'ConfidenceChange': self._detect_confidence_change_events,
+            'SignificantMovement': self._detect_significant_movement_events,
+            'InconsistentMovement': self._detect_inconsistent_movement_events,
+        }
+        if use_cache:
+            return self._load_or_detect(event_type, detectors[event_type])
+        return detectors[event_type]()
+
+    def query_events(self, event_types, sort='default', offset=0, limit=None, use_cache=True):
+        """
+        One page of events, sorted and sliced on the event columns before any dict is built.
+
+        Args:
+            event_types (list of str): event types to include
+            sort (str): "default" (by type, then detector order), "magnitude" (largest absolute change first,
+                prediction flips last) or "index" (sample index)
+            offset (int), limit (int): page to return, limit None returns all remaining events
 
-    def _detect_prediction_flip_events(self) -> List[Dict[str, Any]]:
+        Returns:
+            (list of dict, dict): events of the page, number of events per type
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        selected_types = [event_type for event_type in EVENT_TYPES if event_type in event_types]
+        columns = {event_type: self.detect_event_columns(event_type, use_cache) for event_type in selected_types}
+        counts = {event_type: len(columns[event_type]['index']) for event_type in selected_types}
+
+        total = sum(counts.values())
+        end = total if limit is None else min(offset + limit, total)
+        if offset >= end:
+            return [], counts
+
+        # position of every event in the default order: type, then row within the type
+        type_ids = np.repeat(np.arange(len(selected_types)), [counts[t] for t in selected_types])
+        rows = np.concatenate([np.arange(counts[t]) for t in selected_types])
+        if sort == 'default':
+            order = np.arange(offset, end)
+        else:
+            if sort == 'magnitude':
+                key = -np.concatenate([event_magnitude(t, columns[t]) for t in selected_types])
+                key = np.where(np.isnan(key), np.inf, key)
+            else:
+                key = np.concatenate([columns[t]['index'] for t in selected_types]).astype(np.float64)
+            # top `end` events without sorting everything (plus the ones tied with the last), then a stable sort of those
+            if end < total:
+                cutoff = key[np.argpartition(key, end - 1)[end - 1]]
+                candidates = np.flatnonzero(key <= cutoff)
+            else:
+                candidates = np.arange(total)
+            order = candidates[np.lexsort((candidates, key[candidates]))][offset:end]
+
+        label_dict = self.data_provider.get_label_dict()
         events = []
+        for type_id, event_type in enumerate(selected_types):
+            selected = order[type_ids[order] == type_id]
+            if len(selected) > 0:
+                events.append((selected, event_rows(event_type, columns[event_type], rows[selected], label_dict)))
+        # merge the per type rows back into page order
+        page = [None] * len(order)
+        position = {int(event_position): k for k, event_position in enumerate(order)}
+        for selected, type_events in events:
+            for event_position, event in zip(selected.tolist(), type_events):
+                page[position[event_position]] = event
+        return page, counts
+
+    ########################################################################################################################
+    #                                                       CACHE                                                          #
+    ########################################################################################################################
+    def _previous_epoch(self, gap=1):
         epoch_index = self.available_epochs.index(self.epoch)
-        prev_epoch = self.available_epochs[epoch_index - 1] if epoch_index > 0 else -1
+        return self.available_epochs[epoch_index - gap] if epoch_index >= gap else -1
+
+    def input_paths(self, event_type):
+        """Files the result of a detector is derived from, relative to content_path."""
+        epoch_file = lambda epoch, name: os.path.join('epochs', f'epoch_{epoch}', name)
+        paths = [os.path.join('dataset', 'index.json')]
+        if event_type in ('PredictionFlip', 'ConfidenceChange'):
+            paths += [os.path.join('dataset', 'labels.npy')]
+            epochs = [self._previous_epoch(), self.epoch]
+            paths += [epoch_file(epoch, 'predictions.npy') for epoch in epochs if epoch >= 0]
+        elif event_type == 'SignificantMovement':
+            epochs = [self._previous_epoch(), self.epoch, self.available_epochs[-1]]
+            paths += [epoch_file(epoch, 'embeddings.npy') for epoch in epochs if epoch >= 0]
+        elif event_type == 'InconsistentMovement':
+            epochs = [self._previous_epoch(self.params['inconsistent_epoch_gap']), self.epoch]
+            paths += [epoch_file(epoch, 'embeddings.npy') for epoch in epochs if epoch >= 0]
+        return paths
+
+    def cache_path(self, event_type):
+        params = {name: self.params[name] for name in EVENT_PARAMS[event_type]}
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        # not under visualize/, every directory there is listed as a visualization result
+        return os.path.join(self.content_path, 'epochs', f'epoch_{self.epoch}', 'events', f'{event_type}_{digest}.npz')
+
+    def _load_or_detect(self, event_type, detector):
+        inputs = json.dumps([[path, file_fingerprint(os.path.join(self.content_path, path))] for path in self.input_paths(event_type)])
+        cache_path = self.cache_path(event_type)
+
+        def load():
+            with np.load(cache_path) as data:
+                return {name: data[name] for name in data.files}
+
+        if os.path.exists(cache_path):
+            try:
+                cached = artifact_cache.get(('events', cache_path), [cache_path], load,
+                                            nbytes=lambda value: sum(array.nbytes for array in value.values()))
+                if str(cached['inputs']) == inputs:
+                    return {name: cached[name] for name in EVENT_COLUMNS[event_type]}
+            except Exception:
+                pass  # unreadable or damaged cache file (OSError, BadZipFile, missing column, ...), recompute
+
+        columns = detector()
+        try:
+            write_atomic(cache_path, lambda f: np.savez(f, inputs=np.array(inputs), **columns))
+        except OSError as e:
+            print(f"Could not persist {event_type} events: {e}")
+        return columns
+
+    ########################################################################################################################
+    #                                                       DETECTORS                                                      #
+    ########################################################################################################################
+    def _detect_prediction_flip_events(self) -> Dict[str, np.ndarray]:
+        prev_epoch = self._previous_epoch()
         if prev_epoch < 0:
-            return events
+            return _empty_columns('PredictionFlip')
 
         labels = self.data_provider.get_labels()
         prev_pred = self.data_provider.get_prediction(prev_epoch)
         curr_pred = self.data_provider.get_prediction(self.epoch)
-        label_dict = self.data_provider.get_label_dict()
-        
+
         if(prev_pred is None or curr_pred is None):
-            return events
+            return _empty_columns('PredictionFlip')
 
-        for idx, label in enumerate(labels):
-            if prev_pred[idx] == curr_pred[idx]:
-                continue
-            events.append({
-                "index": idx,
-                "label": label_dict.get(label, str(label)),
-                "prevPred": label_dict.get(prev_pred[idx], str(prev_pred[idx])),
-                "currPred": label_dict.get(curr_pred[idx], str(curr_pred[idx])),
-                "prevCorrect": bool(prev_pred[idx] == label),
-                "currCorrect": bool(curr_pred[idx] == label),
-                "influenceTarget": label_dict.get(curr_pred[idx], str(curr_pred[idx])),
-                "type": "PredictionFlip"
-            })
-        return events
+        flipped = np.flatnonzero(prev_pred != curr_pred)
+        return {
+            'index': flipped.astype(np.int64),
+            'label': np.asarray(labels)[flipped].astype(np.int64),
+            'prev_pred': prev_pred[flipped].astype(np.int64),
+            'curr_pred': curr_pred[flipped].astype(np.int64),
+        }
 
 
-    def _detect_confidence_change_events(self) -> List[Dict[str, Any]]:
-        events = []
-        epoch_index = self.available_epochs.index(self.epoch)
-        prev_epoch = self.available_epochs[epoch_index - 1] if epoch_index > 0 else -1
+    def _detect_confidence_change_events(self) -> Dict[str, np.ndarray]:
+        prev_epoch = self._previous_epoch()
         if prev_epoch < 0:
-            return events
+            return _empty_columns('ConfidenceChange')
 
-        labels = self.data_provider.get_labels()
+        labels = np.asarray(self.data_provider.get_labels()).astype(np.int64)
         prev_prob = self.data_provider.get_probability(prev_epoch)  # (N, C)
         curr_prob = self.data_provider.get_probability(self.epoch)
-        label_dict = self.data_provider.get_label_dict()
 
         if(prev_prob is None or curr_prob is None):
-            return events
-
-        for idx, label in enumerate(labels):
-            prev_conf = float(prev_prob[idx, label])
-            curr_conf = float(curr_prob[idx, label])
-
-            if abs(curr_conf - prev_conf) <= 0.5:
-                continue
-
-            delta = curr_prob[idx] - prev_prob[idx]
-            tgt = int(np.argmax(delta))
-            events.append({
-                "index": idx,
-                "label": label_dict.get(label, str(label)),
-                "prevConf": prev_conf,
-                "currConf": curr_conf,
-                "change": curr_conf - prev_conf,
-                "influenceTarget": label_dict.get(tgt, str(tgt)),
-                "type": "ConfidenceChange"
-            })
-
-        events.sort(key=lambda x: abs(x["change"]), reverse=True)
-        return events
-
-
-    def _detect_significant_movement_events(self) -> List[Dict[str, Any]]:
-        events = []
-        epoch_index = self.available_epochs.index(self.epoch)
-        prev_epoch = self.available_epochs[epoch_index - 1] if epoch_index > 0 else -1
+            return _empty_columns('ConfidenceChange')
+
+        rows = np.arange(len(labels))
+        prev_conf = prev_prob[rows, labels].astype(np.float64)
+        curr_conf = curr_prob[rows, labels].astype(np.float64)
+        changed = np.flatnonzero(np.abs(curr_conf - prev_conf) > self.params['confidence_threshold'])
+        # largest change first, ties keep sample order
+        changed = changed[np.argsort(-np.abs(curr_conf[changed] - prev_conf[changed]), kind='stable')]
+        target = np.argmax(curr_prob[changed] - prev_prob[changed], axis=1) if len(changed) else np.empty(0, dtype=np.int64)
+        return {
+            'index': changed.astype(np.int64),
+            'label': labels[changed],
+            'prev_conf': prev_conf[changed],
+            'curr_conf': curr_conf[changed],
+            'target': target.astype(np.int64),
+        }
+
+
+    def _detect_significant_movement_events(self) -> Dict[str, np.ndarray]:
+        prev_epoch = self._previous_epoch()
         last_epoch = self.available_epochs[-1] if len(self.available_epochs) > 0 else None
         if prev_epoch < 0 or last_epoch is None:
-            return events
+            return _empty_columns('SignificantMovement')
 
         prev_emb = self.data_provider.get_representation(prev_epoch)   # (N, d)
         curr_emb = self.data_provider.get_representation(self.epoch)
@@ -113,54 +313,40 @@ class TrainingEventDetector:
         closer_changes = np.abs(delta_dists[closer_mask])
         farther_changes = delta_dists[farther_mask]
 
-        closer_thresh = 0.5 if closer_changes.size == 0 else \
-            float(np.mean(closer_changes) + 2 * np.std(closer_changes))
-        farther_thresh = 0.5 if farther_changes.size == 0 else \
-            float(np.mean(farther_changes) + 2 * np.std(farther_changes))
-
-        for idx, dd in enumerate(delta_dists):
-            if dd < 0 and np.abs(dd) > closer_thresh:
-                events.append({
-                    "index": idx,
-                    "prevDist": float(prev_dists[idx]),
-                    "currDist": float(curr_dists[idx]),
-                    "distanceChange": float(dd),
-                    "movementType": "closer",
-                    "type": "SignificantMovement"
-                })
-            elif dd > 0 and dd > farther_thresh:
-                events.append({
-                    "index": idx,
-                    "prevDist": float(prev_dists[idx]),
-                    "currDist": float(curr_dists[idx]),
-                    "distanceChange": float(dd),
-                    "movementType": "farther",
-                    "type": "SignificantMovement"
-                })
-
-        events.sort(key=lambda x: abs(x["distanceChange"]), reverse=True)
-        return events
-
-    def _detect_inconsistent_movement_events(self) -> List[Dict[str, Any]]:
+        multiplier = self.params['movement_std_multiplier']
+        default_thresh = self.params['movement_default_threshold']
+        closer_thresh = default_thresh if closer_changes.size == 0 else \
+            float(np.mean(closer_changes) + multiplier * np.std(closer_changes))
+        farther_thresh = default_thresh if farther_changes.size == 0 else \
+            float(np.mean(farther_changes) + multiplier * np.std(farther_changes))
+
+        significant = np.flatnonzero((closer_mask & (np.abs(delta_dists) > closer_thresh)) |
+                                     (farther_mask & (delta_dists > farther_thresh)))
+        significant = significant[np.argsort(-np.abs(delta_dists[significant]), kind='stable')]
+        return {
+            'index': significant.astype(np.int64),
+            'prev_dist': prev_dists[significant].astype(np.float64),
+            'curr_dist': curr_dists[significant].astype(np.float64),
+        }
+
+    def _detect_inconsistent_movement_events(self) -> Dict[str, np.ndarray]:
         """
         Detects pairs of representations that move contrary to the contrastive learning objective.
         1. Positive pairs (doc-code from the same sample) that move farther apart.
         2. Negative pairs (doc-code from different samples) that move significantly closer.
         """
-        events = []
-        epoch_index = self.available_epochs.index(self.epoch)
-        prev_epoch = self.available_epochs[epoch_index - 5] if epoch_index > 4 else -1
-        
+        prev_epoch = self._previous_epoch(self.params['inconsistent_epoch_gap'])
+
         if prev_epoch < 0:
             # Cannot compare if there's no previous epoch
-            return events
+            return _empty_columns('InconsistentMovement')
 
         # 1. Load embeddings for the current and previous epochs
         curr_emb = self.data_provider.get_representation(self.epoch)
         prev_emb = self.data_provider.get_representation(prev_epoch)
         
         if curr_emb is None or prev_emb is None:
-            return events
+            return _empty_columns('InconsistentMovement')
 
         # 2. Separate doc and code embeddings and normalize them for cosine distance calculation
         # Embeddings are stored as [doc0, code0, doc1, code1, ...]
@@ -169,11 +355,11 @@ class TrainingEventDetector:
         prev_docs = prev_emb[0::2]
         prev_codes = prev_emb[1::2]
         
-        # L2 normalization
-        curr_docs /= np.linalg.norm(curr_docs, axis=1, keepdims=True)
-        curr_codes /= np.linalg.norm(curr_codes, axis=1, keepdims=True)
-        prev_docs /= np.linalg.norm(prev_docs, axis=1, keepdims=True)
-        prev_codes /= np.linalg.norm(prev_codes, axis=1, keepdims=True)
+        # L2 normalization (not in place, representations may be shared through the artifact cache)
+        curr_docs = curr_docs / np.linalg.norm(curr_docs, axis=1, keepdims=True)
+        curr_codes = curr_codes / np.linalg.norm(curr_codes, axis=1, keepdims=True)
+        prev_docs = prev_docs / np.linalg.norm(prev_docs, axis=1, keepdims=True)
+        prev_codes = prev_codes / np.linalg.norm(prev_codes, axis=1, keepdims=True)
 
         # 3. Calculate pairwise cosine distance matrices for both epochs
         # Cosine Distance = 1 - Cosine Similarity
@@ -191,43 +377,26 @@ class TrainingEventDetector:
         abs_deltas = np.abs(delta_matrix)
         # threshold = np.mean(abs_deltas) + 2 * np.std(abs_deltas)
         threshold = np.mean(abs_deltas)
-        
-        num_pairs = curr_docs.shape[0]
-
-        # 6. Iterate through all pairs to find inconsistent movements
-        for i in range(num_pairs):  # Index for docstrings
-            for j in range(num_pairs):  # Index for code
-                delta = delta_matrix[i, j]
-                
-                # Case 1: Positive Pair (doc_i and code_i)
-                if i == j:
-                    # Inconsistency: Positive pairs should get closer (delta < 0), but they moved farther (delta > 0)
-                    if delta > threshold:
-                        events.append(dict(
-                            index=2 * i,          # Original index of doc_i
-                            index1=2 * j + 1,     # Original index of code_j
-                            expectation="Aligned",
-                            behavior="NotAligned",
-                            distanceChange=float(delta),
-                            type="InconsistentMovement"
-                        ))
-                # Case 2: Negative Pair (doc_i and code_j)
-                else:
-                    # Inconsistency: Negative pairs should get farther (delta > 0), but they moved closer (delta < 0)
-                    if delta < 0 and abs(delta) > 6 * threshold:
-                        events.append(dict(
-                            index=2 * i,
-                            index1=2 * j + 1,
-                            expectation="NotAligned",
-                            behavior="Aligned",
-                            distanceChange=float(delta),
-                            type="InconsistentMovement"
-                        ))
-        
+
+        # 6. Find inconsistent movements
+        # Positive pairs (doc_i, code_i) should get closer, inconsistent if they moved farther (delta > threshold)
+        # Negative pairs (doc_i, code_j) should get farther, inconsistent if they moved significantly closer
+        positive = np.eye(delta_matrix.shape[0], delta_matrix.shape[1], dtype=bool)
+        inconsistent = np.where(positive, delta_matrix > threshold,
+                                (delta_matrix < 0) & (abs_deltas > self.params['negative_pair_multiplier'] * threshold))
+        doc_index, code_index = np.nonzero(inconsistent)
+        distance_change = delta_matrix[doc_index, code_index].astype(np.float64)
+
         # Sort events by the magnitude of the change, showing the most severe cases first
-        events.sort(key=lambda x: abs(x["distanceChange"]), reverse=True)
-        print(f"Detected {len(events)} inconsistent movement events at epoch {self.epoch}.")
-        return events
+        order = np.argsort(-np.abs(distance_change), kind='stable')
+        doc_index, code_index, distance_change = doc_index[order], code_index[order], distance_change[order]
+        print(f"Detected {len(order)} inconsistent movement events at epoch {self.epoch}.")
+        return {
+            'index': 2 * doc_index.astype(np.int64),          # original index of doc_i
+            'index1': 2 * code_index.astype(np.int64) + 1,    # original index of code_j
+            'positive': doc_index == code_index,
+            'distance_change': distance_change,
+        }
 
     def _detect_inconsistent_movement_events_token(self, std_dev_multiplier=2.5):
         events = []
@@ -307,4 +476,4 @@ class TrainingEventDetector:
                             type="InconsistentMovement"
                         ))
 
-        return events
\ No newline at end of file
+        return events
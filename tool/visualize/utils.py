@@ -12,23 +12,80 @@ def get_feature_num(data):
     else:
         return data.shape[1]
 
-def batch_run(model, data, desc = "batch_run", batch_size=200):
-    """batch run, in case memory error"""
-    data = data.to(dtype=torch.float)
-    output = None
-    n_batches = max(math.ceil(len(data) / batch_size), 1)
-    for b in tqdm.tqdm(range(n_batches)):
-        r1, r2 = b * batch_size, (b + 1) * batch_size
-        inputs = data[r1:r2]
-        with torch.no_grad():
-            pred = model(inputs).cpu().numpy()
-            if output is None:
-                output = pred
+# memory (activations, inputs and outputs) a batch may use when the batch size is picked automatically
+DEFAULT_BATCH_MEMORY_MB = 256
+PROBE_BATCH_SIZE = 16
+MAX_BATCH_SIZE = 65536
+# off cuda only inputs and outputs are measured, not activations, so the automatic batch size stays small
+MAX_CPU_BATCH_SIZE = 256
+
+def _output_to_numpy(output):
+    if isinstance(output, tuple):
+        #(code_feature, nl_feature)
+        return np.stack([feat.cpu().numpy() for feat in output], axis=1)
+    return output.cpu().numpy()
+
+def _sample_nbytes(array):
+    return array[0].nelement() * array.element_size() if isinstance(array, torch.Tensor) else array[0].nbytes
+
+def batch_inference(func, data, device=None, batch_size=None, memory_budget=None, dtype=None, split_inputs=False, desc="batch_inference"):
+    """
+    Func: run func over data in batches, without gradients
+
+    Input batches are moved to device (and converted to dtype) one at a time, the output is preallocated from the
+    result of a small probe batch and filled in place. Without batch_size, it is picked from memory_budget (bytes,
+    default DEFAULT_BATCH_MEMORY_MB) and the per-sample memory of the probe batch: peak device memory on cuda,
+    input plus output size otherwise (at most MAX_CPU_BATCH_SIZE, activations are not measured).
+
+    Args:
+        func: model or function, returns a tensor or a tuple of tensors (stacked along axis 1)
+        data: torch.Tensor or np.ndarray, [N, ...]
+        split_inputs: call func(data[:, 0], data[:, 1], ...) instead of func(data)
+
+    Returns:
+        np.ndarray: [N, ...] outputs
+    """
+    num_samples = len(data)
+    memory_budget = memory_budget or DEFAULT_BATCH_MEMORY_MB * 1024 * 1024
+    use_cuda = device is not None and torch.device(device).type == 'cuda'
+
+    def run(r1, r2):
+        inputs = torch.as_tensor(data[r1:r2])
+        inputs = inputs.to(device=device if device is not None else inputs.device, dtype=dtype or inputs.dtype, non_blocking=True)
+        if split_inputs:
+            return _output_to_numpy(func(*[inputs[:, j] for j in range(inputs.shape[1])]))
+        return _output_to_numpy(func(inputs))
+
+    with torch.inference_mode():
+        probe_size = min(num_samples, batch_size or PROBE_BATCH_SIZE)
+        if use_cuda:
+            torch.cuda.reset_peak_memory_stats(device)
+            start_memory = torch.cuda.memory_allocated(device)
+        probe = run(0, probe_size)
+        output = np.empty((num_samples,) + probe.shape[1:], dtype=probe.dtype)
+        output[:probe_size] = probe
+
+        if batch_size is None:
+            if use_cuda:
+                per_sample = (torch.cuda.max_memory_allocated(device) - start_memory) / max(probe_size, 1)
+            elif num_samples > 0:
+                per_sample = _sample_nbytes(data) + probe[0].nbytes
             else:
-                output = np.concatenate((output, pred), axis=0)
+                per_sample = 1
+            batch_size = int(np.clip(memory_budget // max(per_sample, 1), 1, MAX_BATCH_SIZE if use_cuda else MAX_CPU_BATCH_SIZE))
+
+        starts = range(probe_size, num_samples, batch_size)
+        for r1 in tqdm.tqdm(starts, desc=desc, leave=True):
+            r2 = min(r1 + batch_size, num_samples)
+            output[r1:r2] = run(r1, r2)
     return output
 
-def batch_run_feature_extract(feat_func, data, device = None, batch_size=64, desc="feature_extraction"):
+def batch_run(model, data, desc = "batch_run", batch_size=None, device=None, memory_budget=None):
+    """batch run, in case memory error; data stays where it is, batches are moved to device"""
+    return batch_inference(model, data, device=device, batch_size=batch_size, memory_budget=memory_budget,
+                           dtype=torch.float, desc=desc)
+
+def batch_run_feature_extract(feat_func, data, device = None, batch_size=None, desc="feature_extraction", memory_budget=None):
     """
     Func: batch run for feature extraction, using feature function, get high dimension features
 
@@ -44,40 +101,14 @@ def batch_run_feature_extract(feat_func, data, device = None, batch_size=64, des
         np.ndarray: high dimension features
     """
     if len(data.shape) == 2:
-        data.unsqueeze_(1)
+        data = data[:, None]
         
     num_inputs = data.shape[1]
 
     print("data shape:",data.shape)
 
-    if device!=None:
-        data = data.to(device)
-    output = None
-    n_batches = max(math.ceil(len(data) / batch_size), 1)
-
-    for b in tqdm.tqdm(range(n_batches),desc=desc, leave=True):
-        r1, r2 = b * batch_size, (b + 1) * batch_size
-        batch_data = data[r1:r2]
-
-        with torch.no_grad():
-            if num_inputs == 1:
-                pred = feat_func(batch_data)
-            else:
-                batch_inputs = [batch_data[:,j,:] for j in range(num_inputs)]
-                pred = feat_func(*batch_inputs)
-            
-            if isinstance(pred, tuple):
-                #(code_feature, nl_feature)
-                pred = np.stack([feat.cpu().numpy() for feat in pred], axis = 1)
-            else:
-                #(feature)
-                pred = pred.cpu().numpy()
-
-        if output is None:
-            output = pred
-        else:
-            output = np.concatenate((output, pred), axis=0)
-    return output
+    return batch_inference(feat_func, data, device=device, batch_size=batch_size, memory_budget=memory_budget,
+                           split_inputs=num_inputs > 1, desc=desc)
 
 
 def find_neighbor_preserving_rate(prev_data, train_data, n_neighbors):
@@ -102,96 +102,105 @@ class SingleVisualizationModel(nn.Module):
 '''
 The visualization model definition class
 '''
-import tensorflow as tf
-from tensorflow import keras
-class tfModel(keras.Model):
-    def __init__(self, optimizer, loss, loss_weights, encoder_dims, decoder_dims, batch_size, withoutB=True, attention=True, prev_trainable_variables=None):
-
-        super(tfModel, self).__init__()
-        self._init_autoencoder(encoder_dims, decoder_dims)
-        self.optimizer = optimizer  # optimizer
-        self.withoutB = withoutB
-        self.attention = attention
-
-        self.loss = loss  # dict of 3 losses {"total", "umap", "reconstrunction", "regularization"}
-        self.loss_weights = loss_weights  # weights for each loss (in total 3 losses)
-
-        self.prev_trainable_variables = prev_trainable_variables  # weights for previous iteration
-        self.batch_size = batch_size
-    
-    def _init_autoencoder(self, encoder_dims, decoder_dims):
-        self.encoder = tf.keras.Sequential([
-            tf.keras.layers.InputLayer(input_shape=(encoder_dims[0],)),
-            tf.keras.layers.Flatten(),
-        ])
-        for i in range(1, len(encoder_dims)-1, 1):
-            self.encoder.add(tf.keras.layers.Dense(units=encoder_dims[i], activation="relu"))
-        self.encoder.add(tf.keras.layers.Dense(units=encoder_dims[-1]),)
-
-        self.decoder = tf.keras.Sequential([
-            tf.keras.layers.InputLayer(input_shape=(decoder_dims[0],)),
-        ])
-        for i in range(1, len(decoder_dims)-1, 1):
-            self.decoder.add(tf.keras.layers.Dense(units=decoder_dims[i], activation="relu"))
-        self.decoder.add(tf.keras.layers.Dense(units=decoder_dims[-1]))
-        print(self.encoder.summary())
-        print(self.decoder.summary())
-
-    def train_step(self, x):
-
-        to_x, from_x, to_alpha, from_alpha, n_rate, weight = x[0]
-        to_x = tf.cast(to_x, dtype=tf.float32)
-        from_x = tf.cast(from_x, dtype=tf.float32)
-        to_alpha = tf.cast(to_alpha, dtype=tf.float32)
-        from_alpha = tf.cast(from_alpha, dtype=tf.float32)
-        n_rate = tf.cast(n_rate, dtype=tf.float32)
-        weight = tf.cast(weight, dtype=tf.float32)
-
-        # Forward pass
-        with tf.GradientTape(persistent=True) as tape:
-
-            # parametric embedding
-            embedding_to = self.encoder(to_x)  # embedding for instance 1
-            embedding_from = self.encoder(from_x)  # embedding for instance 1
-            embedding_to_recon = self.decoder(embedding_to)  # reconstruct instance 1
-            embedding_from_recon = self.decoder(embedding_from)  # reconstruct instance 1
-
-            # concatenate embedding1 and embedding2 to prepare for umap loss
-            embedding_to_from = tf.concat((embedding_to, embedding_from, weight),
-                                          axis=1)
-            # reconstruction loss
-            if self.attention:
-                reconstruct_loss = self.loss["reconstruction"](to_x, from_x, embedding_to_recon, embedding_from_recon,to_alpha, from_alpha)
-            else:
-                self.loss["reconstruction"] = tf.keras.losses.MeanSquaredError()
-                reconstruct_loss = self.loss["reconstruction"](y_true=to_x, y_pred=embedding_to_recon)/2 + self.loss["reconstruction"](y_true=from_x, y_pred=embedding_from_recon)/2
-
-            # umap loss
-            umap_loss = self.loss["umap"](None, embed_to_from=embedding_to_from)  # w_(t-1), no gradient
-
-            # compute alpha bar
-            alpha_mean = tf.cast(tf.reduce_mean(tf.stop_gradient(n_rate)), dtype=tf.float32)
-            # L2 norm of w current - w for last epoch (subject model's epoch)
-            # dummy zeros-loss if no previous epoch
-            if self.prev_trainable_variables is None:
-                prev_trainable_variables = [tf.stop_gradient(x) for x in self.trainable_variables]
-            else:
-                prev_trainable_variables = self.prev_trainable_variables
-            regularization_loss = self.loss["regularization"](w_prev=prev_trainable_variables,w_current=self.trainable_variables, to_alpha=alpha_mean)
-
-                # aggregate loss, weighted average
-            loss = tf.add(tf.add(tf.math.multiply(tf.constant(self.loss_weights["reconstruction"]), reconstruct_loss),
-                                    tf.math.multiply(tf.constant(self.loss_weights["umap"]), umap_loss)),
-                            tf.math.multiply(tf.constant(self.loss_weights["regularization"]), regularization_loss))
-
-        # Compute gradients
-        trainable_vars = self.trainable_variables
-        grads = tape.gradient(loss, trainable_vars)
-
-        # Update weights
-        self.optimizer.apply_gradients(zip(grads, trainable_vars))
-
-        return {"loss": loss, "umap": umap_loss, "reconstruction": reconstruct_loss,
-                "regularization": regularization_loss}
+# tensorflow is imported on first use of tfModel (module __getattr__), importing this module stays cheap
+def _define_tf_model():
+    import tensorflow as tf
+    from tensorflow import keras
+
+    class tfModel(keras.Model):
+        def __init__(self, optimizer, loss, loss_weights, encoder_dims, decoder_dims, batch_size, withoutB=True, attention=True, prev_trainable_variables=None):
 
+            super(tfModel, self).__init__()
+            self._init_autoencoder(encoder_dims, decoder_dims)
+            self.optimizer = optimizer  # optimizer
+            self.withoutB = withoutB
+            self.attention = attention
 
+            self.loss = loss  # dict of 3 losses {"total", "umap", "reconstrunction", "regularization"}
+            self.loss_weights = loss_weights  # weights for each loss (in total 3 losses)
+
+            self.prev_trainable_variables = prev_trainable_variables  # weights for previous iteration
+            self.batch_size = batch_size
+    
+        def _init_autoencoder(self, encoder_dims, decoder_dims):
+            self.encoder = tf.keras.Sequential([
+                tf.keras.layers.InputLayer(input_shape=(encoder_dims[0],)),
+                tf.keras.layers.Flatten(),
+            ])
+            for i in range(1, len(encoder_dims)-1, 1):
+                self.encoder.add(tf.keras.layers.Dense(units=encoder_dims[i], activation="relu"))
+            self.encoder.add(tf.keras.layers.Dense(units=encoder_dims[-1]),)
+
+            self.decoder = tf.keras.Sequential([
+                tf.keras.layers.InputLayer(input_shape=(decoder_dims[0],)),
+            ])
+            for i in range(1, len(decoder_dims)-1, 1):
+                self.decoder.add(tf.keras.layers.Dense(units=decoder_dims[i], activation="relu"))
+            self.decoder.add(tf.keras.layers.Dense(units=decoder_dims[-1]))
+            print(self.encoder.summary())
+            print(self.decoder.summary())
+
+        def train_step(self, x):
+
+            to_x, from_x, to_alpha, from_alpha, n_rate, weight = x[0]
+            to_x = tf.cast(to_x, dtype=tf.float32)
+            from_x = tf.cast(from_x, dtype=tf.float32)
+            to_alpha = tf.cast(to_alpha, dtype=tf.float32)
+            from_alpha = tf.cast(from_alpha, dtype=tf.float32)
+            n_rate = tf.cast(n_rate, dtype=tf.float32)
+            weight = tf.cast(weight, dtype=tf.float32)
+
+            # Forward pass
+            with tf.GradientTape(persistent=True) as tape:
+
+                # parametric embedding
+                embedding_to = self.encoder(to_x)  # embedding for instance 1
+                embedding_from = self.encoder(from_x)  # embedding for instance 1
+                embedding_to_recon = self.decoder(embedding_to)  # reconstruct instance 1
+                embedding_from_recon = self.decoder(embedding_from)  # reconstruct instance 1
+
+                # concatenate embedding1 and embedding2 to prepare for umap loss
+                embedding_to_from = tf.concat((embedding_to, embedding_from, weight),
+                                              axis=1)
+                # reconstruction loss
+                if self.attention:
+                    reconstruct_loss = self.loss["reconstruction"](to_x, from_x, embedding_to_recon, embedding_from_recon,to_alpha, from_alpha)
+                else:
+                    self.loss["reconstruction"] = tf.keras.losses.MeanSquaredError()
+                    reconstruct_loss = self.loss["reconstruction"](y_true=to_x, y_pred=embedding_to_recon)/2 + self.loss["reconstruction"](y_true=from_x, y_pred=embedding_from_recon)/2
+
+                # umap loss
+                umap_loss = self.loss["umap"](None, embed_to_from=embedding_to_from)  # w_(t-1), no gradient
+
+                # compute alpha bar
+                alpha_mean = tf.cast(tf.reduce_mean(tf.stop_gradient(n_rate)), dtype=tf.float32)
+                # L2 norm of w current - w for last epoch (subject model's epoch)
+                # dummy zeros-loss if no previous epoch
+                if self.prev_trainable_variables is None:
+                    prev_trainable_variables = [tf.stop_gradient(x) for x in self.trainable_variables]
+                else:
+                    prev_trainable_variables = self.prev_trainable_variables
+                regularization_loss = self.loss["regularization"](w_prev=prev_trainable_variables,w_current=self.trainable_variables, to_alpha=alpha_mean)
+
+                    # aggregate loss, weighted average
+                loss = tf.add(tf.add(tf.math.multiply(tf.constant(self.loss_weights["reconstruction"]), reconstruct_loss),
+                                        tf.math.multiply(tf.constant(self.loss_weights["umap"]), umap_loss)),
+                                tf.math.multiply(tf.constant(self.loss_weights["regularization"]), regularization_loss))
+
+            # Compute gradients
+            trainable_vars = self.trainable_variables
+            grads = tape.gradient(loss, trainable_vars)
+
+            # Update weights
+            self.optimizer.apply_gradients(zip(grads, trainable_vars))
+
+            return {"loss": loss, "umap": umap_loss, "reconstruction": reconstruct_loss,
+                    "regularization": regularization_loss}
+
+    return tfModel
+
+def __getattr__(name):
+    if name == 'tfModel':
+        globals()['tfModel'] = _define_tf_model()
+        return globals()['tfModel']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
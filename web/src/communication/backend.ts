@@ -47,6 +47,92 @@ async function basicPostWithJsonResponse(path: string, data: any, options?: Netw
     }
 }
 
+async function basicPostWithBinaryResponse(path: string, data: any, options?: NetworkOptions): Promise<ArrayBuffer> {
+    try {
+        const response: AxiosResponse<ArrayBuffer> = await axios.post(getFullUrl(path, options), data, {
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'application/octet-stream'
+            },
+            responseType: 'arraybuffer'
+        });
+        return response.data;
+    } catch (error) {
+        throw new Error(`POST ${getFullUrl(path, options)} failed: ${error}`);
+    }
+}
+
+/**
+ * Binary array bundles, see tool/server/binary_transport.py
+ */
+export type TypedArray = Float32Array | Int32Array | Uint32Array | Int16Array | Uint16Array | Int8Array | Uint8Array;
+
+export interface DecodedArray {
+    dtype: string;
+    shape: number[];
+    data: TypedArray;
+}
+
+export interface ArrayBundle {
+    arrays: Record<string, DecodedArray>;
+    meta: any;
+}
+
+const TYPED_ARRAY_CONSTRUCTORS: Record<string, any> = {
+    float32: Float32Array,
+    // float16 is transported as raw half-precision bits, use halfToFloat to decode
+    float16: Uint16Array,
+    int32: Int32Array,
+    uint32: Uint32Array,
+    int16: Int16Array,
+    uint16: Uint16Array,
+    int8: Int8Array,
+    uint8: Uint8Array,
+};
+
+export function decodeArrayBundle(buffer: ArrayBuffer): ArrayBundle {
+    const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+    if (magic !== 'TTVB') {
+        throw new Error('Invalid binary array bundle');
+    }
+    const headerLength = new DataView(buffer).getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    const dataStart = 8 + headerLength;
+
+    const arrays: Record<string, DecodedArray> = {};
+    for (const entry of header.arrays) {
+        const ctor = TYPED_ARRAY_CONSTRUCTORS[entry.dtype];
+        arrays[entry.name] = {
+            dtype: entry.dtype,
+            shape: entry.shape,
+            data: new ctor(buffer, dataStart + entry.offset, entry.nbytes / ctor.BYTES_PER_ELEMENT),
+        };
+    }
+    return { arrays, meta: header.meta };
+}
+
+export function halfToFloat(bits: number): number {
+    const sign = bits & 0x8000 ? -1 : 1;
+    const exponent = (bits >> 10) & 0x1f;
+    const fraction = bits & 0x3ff;
+    if (exponent === 0) {
+        return sign * Math.pow(2, -14) * (fraction / 1024);
+    }
+    if (exponent === 0x1f) {
+        return fraction ? NaN : sign * Infinity;
+    }
+    return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+export function toNestedArray(array: DecodedArray): number[][] {
+    const [rows, cols] = array.shape;
+    const result: number[][] = new Array(rows);
+    for (let i = 0; i < rows; i++) {
+        result[i] = Array.from(array.data.subarray(i * cols, (i + 1) * cols));
+    }
+    return result;
+}
+
 /**
  * Backend API functions
  */
@@ -67,7 +153,27 @@ export function triggerStartVisualizing(
         "task_type": taskType,
         "vis_config": visConfig
     };
-    return basicPostWithJsonResponse('/startVisualizing', data, options);
+    return basicPostWithJsonResponse('/startVisualizing', data, options) as Promise<{ job_id: string }>;
+}
+
+export interface VisualizingJob {
+    job_id: string;
+    status: 'pending' | 'running' | 'finished' | 'failed' | 'cancelled';
+    vis_id: string;
+    stage: string | null;
+    progress: Record<string, { current: number | null; total: number | null }>;
+    error: string | null;
+}
+
+export function getVisualizingJob(jobID: string, options?: NetworkOptions) {
+    return basicGetWithJsonResponse(`/getVisualizingJob?job_id=${jobID}`, options) as Promise<{ job: VisualizingJob }>;
+}
+
+export function cancelVisualizingJob(jobID: string, options?: NetworkOptions) {
+    const data = {
+        "job_id": jobID
+    };
+    return basicPostWithJsonResponse('/cancelVisualizingJob', data, options) as Promise<{ job: VisualizingJob }>;
 }
 
 export function fetchTrainingProcessInfo(contentPath: string, options?: NetworkOptions) {
@@ -84,8 +190,160 @@ export async function fetchEpochProjection(
         "content_path": contentPath,
         "vis_id": visID,
         "epoch": `${epoch}`,
+        "format": "binary",
+    };
+    const buffer = await basicPostWithBinaryResponse('/updateProjection', data, options);
+    const { arrays } = decodeArrayBundle(buffer);
+    return { projection: toNestedArray(arrays['projection']) };
+}
+
+/**
+ * Points of one epoch inside a viewport, exact when zoomed in, class-stratified representatives (with the
+ * number of points they stand for in "count") when more than budget points are visible
+ */
+export async function fetchViewportPoints(
+    contentPath: string,
+    visID: string,
+    epoch: number,
+    viewport: [number, number, number, number],
+    budget?: number,
+    options?: NetworkOptions
+) {
+    const data = {
+        "content_path": contentPath,
+        "vis_id": visID,
+        "epoch": epoch,
+        "viewport": viewport,
+        "budget": budget,
+    };
+    const buffer = await basicPostWithBinaryResponse('/getViewportPoints', data, options);
+    return decodeArrayBundle(buffer);
+}
+
+export async function fetchProjectionBundle(
+    contentPath: string,
+    visID: string,
+    epochs?: number[],
+    dtype: 'float32' | 'float16' = 'float32',
+    options?: NetworkOptions
+) {
+    const data = {
+        "content_path": contentPath,
+        "vis_id": visID,
+        "epochs": epochs,
+        "dtype": dtype,
+    };
+    const buffer = await basicPostWithBinaryResponse('/getProjectionBundle', data, options);
+    return decodeArrayBundle(buffer);
+}
+
+/**
+ * Delta/int16 encoded projection stream, see tool/visualize/projection_codec.py
+ */
+export interface ProjectionStream {
+    shape: number[];
+    epochs: number[];
+    bounds: number[];
+    // [T * N * 2] positions, epoch-major
+    data: Float32Array;
+}
+
+export async function decodeProjectionStream(buffer: ArrayBuffer): Promise<ProjectionStream> {
+    const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+    if (magic !== 'TTVQ') {
+        throw new Error('Invalid projection stream');
+    }
+    const headerLength = new DataView(buffer).getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    if (header.compression !== 'deflate') {
+        throw new Error(`Unsupported projection stream compression: ${header.compression}`);
+    }
+    const compressed = new Blob([new Uint8Array(buffer, 8 + headerLength)]);
+    const planes = new Uint8Array(await new Response(compressed.stream().pipeThrough(new DecompressionStream('deflate'))).arrayBuffer());
+
+    const [epochCount, sampleCount] = header.shape;
+    const valuesPerEpoch = sampleCount * 2;
+    const [xMin, yMin, xMax, yMax] = header.bounds;
+    const step = [(xMax - xMin) / 65535, (yMax - yMin) / 65535];
+    const lower = [xMin, yMin];
+
+    const data = new Float32Array(epochCount * valuesPerEpoch);
+    const quantized = new Int16Array(valuesPerEpoch);
+    for (let t = 0; t < epochCount; t++) {
+        const low = t * 2 * valuesPerEpoch;
+        const high = low + valuesPerEpoch;
+        for (let i = 0; i < valuesPerEpoch; i++) {
+            // Int16Array wraps around like the int16 cumsum of the encoder
+            quantized[i] += planes[low + i] | (planes[high + i] << 8);
+            data[t * valuesPerEpoch + i] = lower[i & 1] + (quantized[i] + 32768) * step[i & 1];
+        }
+    }
+    return { shape: header.shape, epochs: header.epochs, bounds: header.bounds, data };
+}
+
+export async function fetchEncodedProjectionBundle(
+    contentPath: string,
+    visID: string,
+    epochs?: number[],
+    options?: NetworkOptions
+) {
+    const data = {
+        "content_path": contentPath,
+        "vis_id": visID,
+        "epochs": epochs,
+        "encoding": "deflate",
     };
-    return basicPostWithJsonResponse('/updateProjection', data, options);
+    const buffer = await basicPostWithBinaryResponse('/getProjectionBundle', data, options);
+    return decodeProjectionStream(buffer);
+}
+
+/**
+ * Projections of several epochs in one request, keyed by epoch: the encoded stream when the runtime can
+ * inflate it, the float32 bundle otherwise
+ */
+export async function fetchProjectionTrajectory(
+    contentPath: string,
+    visID: string,
+    epochs: number[],
+    options?: NetworkOptions
+): Promise<Record<number, number[][]>> {
+    const result: Record<number, number[][]> = {};
+    if (typeof DecompressionStream !== 'undefined') {
+        const stream = await fetchEncodedProjectionBundle(contentPath, visID, epochs, options);
+        const valuesPerEpoch = stream.shape[1] * 2;
+        stream.epochs.forEach((epoch, t) => {
+            const data = stream.data.subarray(t * valuesPerEpoch, (t + 1) * valuesPerEpoch);
+            result[epoch] = toNestedArray({ dtype: 'float32', shape: [stream.shape[1], 2], data });
+        });
+        return result;
+    }
+    const { arrays } = await fetchProjectionBundle(contentPath, visID, epochs, 'float32', options);
+    const [, sampleCount] = arrays['projection'].shape;
+    Array.from(arrays['epochs'].data).forEach((epoch, t) => {
+        const data = arrays['projection'].data.subarray(t * sampleCount * 2, (t + 1) * sampleCount * 2);
+        result[epoch] = toNestedArray({ dtype: 'float32', shape: [sampleCount, 2], data });
+    });
+    return result;
+}
+
+/**
+ * Attributes of several epochs as typed columns: "epochs" [T], label [N], per-epoch attributes [T, N, ...]
+ */
+export async function fetchAttributeColumns(
+    contentPath: string,
+    attributes: string[],
+    epochs?: number[],
+    floatDtype: 'float32' | 'float16' = 'float16',
+    options?: NetworkOptions
+) {
+    const data = {
+        "content_path": contentPath,
+        "attributes": attributes,
+        "epochs": epochs,
+        "float_dtype": floatDtype,
+    };
+    const buffer = await basicPostWithBinaryResponse('/getAttributeColumns', data, options);
+    return decodeArrayBundle(buffer);
 }
 
 export function getText(contentPath: string, options?: NetworkOptions) {
@@ -95,6 +353,15 @@ export function getText(contentPath: string, options?: NetworkOptions) {
     return basicPostWithJsonResponse('/getAllText', data, options);
 }
 
+export function getTextRange(contentPath: string, start: number, count: number, options?: NetworkOptions) {
+    const data = {
+        "content_path": contentPath,
+        "start": start,
+        "count": count
+    };
+    return basicPostWithJsonResponse('/getTextRange', data, options) as Promise<{ text_list: string[]; start: number; total: number }>;
+}
+
 export function getAlignment(contentPath: string, options?: NetworkOptions) {
     const data = {
         "content_path": contentPath
@@ -138,32 +405,80 @@ export function getProjectionNeighbors(
     return basicPostWithJsonResponse('/getProjectionNeighbors', data, options);
 }
 
+function getFileUrl(path: string, params: Record<string, string | number>, options?: NetworkOptions): string {
+    const query = new URLSearchParams();
+    Object.entries(params).forEach(([key, value]) => query.append(key, `${value}`));
+    return getFullUrl(`${path}?${query.toString()}`, options);
+}
+
+/**
+ * File urls, served with ETag / Last-Modified so the browser cache only revalidates (304) on repeat views
+ */
+export function getBackgroundUrl(contentPath: string, visID: string, epoch: number, options?: NetworkOptions) {
+    return getFileUrl('/files/background', { content_path: contentPath, vis_id: visID, epoch: epoch }, options);
+}
+
+export function getImageUrl(contentPath: string, index: number, options?: NetworkOptions) {
+    return getFileUrl('/files/image', { content_path: contentPath, index: index }, options);
+}
+
+export function getEpochArtifactUrl(
+    contentPath: string,
+    epoch: number,
+    name: string,
+    visID?: string,
+    options?: NetworkOptions
+) {
+    const params: Record<string, string | number> = { content_path: contentPath, epoch: epoch, name: name };
+    if (visID !== undefined) {
+        params['vis_id'] = visID;
+    }
+    return getFileUrl('/files/epochArtifact', params, options);
+}
+
 export function getBackground(
     contentPath: string, 
     visID: string, 
     epoch: number | undefined, 
     options?: NetworkOptions
 ) {
-    const data = {
-        "content_path": contentPath,
-        "vis_id": visID,
-        "epoch": `${epoch}`
-    };
-    return basicPostWithJsonResponse('/getBackground', data, options).then((response) => {
-        const { background_image_base64 } = response as { background_image_base64: string };
-        return `data:image/png;base64,${background_image_base64}`;
-    });
+    if (epoch === undefined) {
+        return Promise.resolve('');
+    }
+    return Promise.resolve(getBackgroundUrl(contentPath, visID, epoch, options));
 }
 
 export function getImageData(contentPath: string, index: number, options?: NetworkOptions) {
+    return Promise.resolve(getImageUrl(contentPath, index, options));
+}
+
+export interface ThumbnailLayout {
+    thumb_size: number;
+    columns: number;
+    rects: ([number, number, number, number] | null)[];
+}
+
+/**
+ * Thumbnails of several samples in one png mosaic, rects[k] locates indices[k] in the mosaic (null if it has no image)
+ */
+export async function fetchThumbnails(contentPath: string, indices: number[], options?: NetworkOptions) {
     const data = {
         "content_path": contentPath,
-        "index": index
+        "indices": indices
     };
-    return basicPostWithJsonResponse('/getImageData', data, options).then((response) => {
-        const { image_base64 } = response as { image_base64: string };
-        return `data:image/png;base64,${image_base64}`;
-    });
+    try {
+        const response: AxiosResponse<Blob> = await axios.post(getFullUrl('/getThumbnails', options), data, {
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'image/png'
+            },
+            responseType: 'blob'
+        });
+        const layout = JSON.parse(response.headers['x-thumbnail-layout']) as ThumbnailLayout;
+        return { mosaicUrl: URL.createObjectURL(response.data), layout };
+    } catch (error) {
+        throw new Error(`POST ${getFullUrl('/getThumbnails', options)} failed: ${error}`);
+    }
 }
 
 export function getTextData(contentPath: string, index: number, options?: NetworkOptions) {
@@ -177,20 +492,37 @@ export function getTextData(contentPath: string, index: number, options?: Networ
     });
 }
 
+export interface VisualizeMetrics {
+    neighbor_trustworthiness: number;
+    neighbor_continuity: number;
+    per_k: Record<string, Record<string, number | number[]>>;
+    rank_depth: number;
+    // 'upper' when ranks deeper than rank_depth were clamped: the metrics are upper bounds, not exact values
+    bound: 'upper' | null;
+    num_evaluated: number;
+}
+
 export function getVisualizeMetrics(
     contentPath: string, 
     visID: string, 
     epoch: number, 
-    options?: NetworkOptions
-) {
+    options?: NetworkOptions,
+    exact: boolean = false
+): Promise<VisualizeMetrics> {
     const data = {
         "content_path": contentPath,
         "vis_id": visID,
-        "epoch": `${epoch}`
+        "epoch": `${epoch}`,
+        "exact": exact
     };
     return basicPostWithJsonResponse('/getVisualizeMetrics', data, options);
 }
 
+// Metric value for display, upper bounds are marked with "≤"
+export function formatVisualizeMetric(metrics: VisualizeMetrics, value: number): string {
+    return `${metrics.bound === 'upper' ? '≤ ' : ''}${value.toFixed(4)}`;
+}
+
 export function getInfluenceSamples(
     contentPath: string,  
     epoch: number, 
@@ -206,16 +538,24 @@ export function getInfluenceSamples(
     return basicPostWithJsonResponse('/getInfluenceSamples', data, options);
 }
 
+export interface TrainingEventPage {
+    sort?: 'default' | 'magnitude' | 'index';
+    offset?: number;
+    limit?: number;
+}
+
 export function calculateTrainingEvents(
     contentPath: string, 
     epoch: number, 
     eventTypes: string[], 
-    options?: NetworkOptions
+    options?: NetworkOptions,
+    page?: TrainingEventPage
 ) {
     const data = {
         "content_path": contentPath,
         "epoch": `${epoch}`,
-        "event_types": eventTypes
+        "event_types": eventTypes,
+        ...page
     };
     return basicPostWithJsonResponse('/calculateTrainingEvents', data, options);
 }
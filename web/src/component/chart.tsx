@@ -3,6 +3,11 @@ import { memo, useEffect, useMemo, useRef, useState } from 'react';
 import { EmbeddingView, type EmbeddingViewProps, type DataPoint, type ViewportState } from 'embedding-atlas/react';
 import { useDefaultStore } from "../state/state.unified";
 import { transferArray2Color } from './utils';
+import { fetchViewportPoints } from '../communication/backend';
+
+// above this many points the plot only draws what /getViewportPoints returns for the visible area
+const VIEWPORT_POINT_BUDGET = 50000;
+const VIEWPORT_QUERY_DELAY_MS = 150;
 
 type EmbeddingData = NonNullable<EmbeddingViewProps['data']>;
 
@@ -29,6 +34,7 @@ export const ChartComponent = memo(() => {
     const { availableEpochs } = useDefaultStore(["availableEpochs"]);
     const { showTrail } = useDefaultStore(["showTrail"]);
     const { setSelectedIndices } = useDefaultStore(["setSelectedIndices"]);
+    const { contentPath, visualizationID } = useDefaultStore(["contentPath", "visualizationID"]);
 
     const epochData = allEpochData[epoch];
 
@@ -36,6 +42,8 @@ export const ChartComponent = memo(() => {
     let [tooltip, setTooltip] = useState<DataPoint | null>(null);
     // selection can be added later when needed
     let [viewportState, setViewportState] = useState<ViewportState | null>(null);
+    // points of the current viewport (exact or level-of-detail representatives), null when all points are drawn
+    const [viewportPoints, setViewportPoints] = useState<{ epoch: number; indices: number[] } | null>(null);
 
     // observe container size change
     useEffect(() => {
@@ -94,12 +102,46 @@ export const ChartComponent = memo(() => {
     }, [globalBounds]);
 
 
+    // query the points of the visible area after zooming or panning, for projections larger than the budget
+    const largeProjection = !!epochData && epochData.projection.length > VIEWPORT_POINT_BUDGET;
+    useEffect(() => {
+        if (!largeProjection || !viewportState || !visualizationID || isFocusMode) {
+            setViewportPoints(null);
+            return;
+        }
+        // the shorter side of the view spans 2 / scale in projection coordinates
+        const { width, height } = dimensions;
+        const shortSide = Math.max(Math.min(width, height), 1);
+        const halfX = (Math.max(width, 1) / shortSide) / viewportState.scale;
+        const halfY = (Math.max(height, 1) / shortSide) / viewportState.scale;
+        const viewport: [number, number, number, number] = [
+            viewportState.x - halfX, viewportState.y - halfY, viewportState.x + halfX, viewportState.y + halfY,
+        ];
+
+        let cancelled = false;
+        const timer = setTimeout(() => {
+            fetchViewportPoints(contentPath, visualizationID, epoch, viewport, VIEWPORT_POINT_BUDGET).then(({ arrays }) => {
+                if (!cancelled) {
+                    setViewportPoints({ epoch, indices: Array.from(arrays['index'].data) });
+                }
+            }).catch((error) => {
+                console.error('Error loading viewport points:', error);
+            });
+        }, VIEWPORT_QUERY_DELAY_MS);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [largeProjection, viewportState, dimensions, contentPath, visualizationID, epoch, isFocusMode]);
+
     // filter dataIndices
     const filteredIndices = useMemo(() => {
         if (!epochData) {
             return [] as number[];
         }
-        const totalIndices = epochData.projection.map((_, idx) => idx);
+        const totalIndices = largeProjection && viewportPoints?.epoch === epoch
+            ? viewportPoints.indices
+            : epochData.projection.map((_, idx) => idx);
         let current = totalIndices;
 
         if (shownData.length > 0) {
@@ -121,7 +163,7 @@ export const ChartComponent = memo(() => {
         }
 
         return current;
-    }, [epochData, focusIndices, index, isFocusMode, shownData]);
+    }, [epochData, focusIndices, index, isFocusMode, shownData, largeProjection, viewportPoints, epoch]);
 
     // convert data for embedding view
     const prepared = useMemo<PreparedEmbedding | null>(() => {
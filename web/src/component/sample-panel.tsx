@@ -3,14 +3,47 @@ import styled from 'styled-components';
 import { softmax } from './utils';
 import { useDefaultStore } from '../state/state.unified';
 import { FunctionalBlock } from './custom/basic-components';
+import { fetchThumbnails } from '../communication/backend';
+
+const NEIGHBOR_THUMB_SIZE = 24;
+const MAX_THUMBNAILS = 256;
+
+// Thumbnails of the hovered sample and its neighbors, all cut from one /getThumbnails mosaic
+interface ThumbnailAtlas {
+    mosaicUrl: string;
+    thumbSize: number;
+    columns: number;
+    rects: Map<number, [number, number, number, number] | null>;
+}
+
+function AtlasThumbnail({ atlas, index, size }: { atlas: ThumbnailAtlas | null, index: number, size: number }) {
+    const rect = atlas?.rects.get(index);
+    if (!atlas || !rect) {
+        return null;
+    }
+    const [x, y, width, height] = rect;
+    const scale = size / atlas.thumbSize;
+    return (
+        <ThumbnailSprite
+            style={{
+                width: width * scale,
+                height: height * scale,
+                backgroundImage: `url(${atlas.mosaicUrl})`,
+                backgroundPosition: `-${x * scale}px -${y * scale}px`,
+                backgroundSize: `${atlas.columns * atlas.thumbSize * scale}px auto`,
+            }}
+        />
+    );
+}
 
 export function SamplePanel() {
-    const { availableEpochs, hoveredIndex, inherentLabelData, epoch, allEpochData, labelDict, dataType, rawData, tokenList } =
-        useDefaultStore(['availableEpochs', 'hoveredIndex', 'inherentLabelData', 'epoch', 'allEpochData', 'labelDict', 'dataType', 'rawData', 'tokenList']);
+    const { availableEpochs, hoveredIndex, inherentLabelData, epoch, allEpochData, labelDict, dataType, rawData, tokenList, contentPath } =
+        useDefaultStore(['availableEpochs', 'hoveredIndex', 'inherentLabelData', 'epoch', 'allEpochData', 'labelDict', 'dataType', 'rawData', 'tokenList', 'contentPath']);
 
     const [data, setData] = useState<string>('');
     const [predictions, setPredictions] = useState<{ value: number, confidence: number, correct: boolean }[]>([]);
     const [historyPrediction, setHistoryPrediction] = useState<{ epoch: number, prediction: number, confidence: number, correct: boolean }[]>([]);
+    const [atlas, setAtlas] = useState<ThumbnailAtlas | null>(null);
 
     const getDisplayLabel = (index: number) =>
     tokenList ? tokenList[index] : labelDict.get(inherentLabelData[index]) || 'Unknown';
@@ -61,6 +94,43 @@ export function SamplePanel() {
 
     }, [hoveredIndex, rawData, epoch, allEpochData, availableEpochs]);
 
+    // one atlas request for the hovered image and the thumbnails of both neighbor lists
+    useEffect(() => {
+        if (dataType === 'Text' || hoveredIndex === undefined || !allEpochData[epoch]) {
+            setAtlas(null);
+            return;
+        }
+        const indices = Array.from(new Set([
+            hoveredIndex,
+            ...(allEpochData[epoch].originalNeighbors[hoveredIndex] || []),
+            ...(allEpochData[epoch].projectionNeighbors[hoveredIndex] || []),
+        ])).slice(0, MAX_THUMBNAILS);
+
+        let cancelled = false;
+        fetchThumbnails(contentPath, indices).then(({ mosaicUrl, layout }) => {
+            if (cancelled) {
+                URL.revokeObjectURL(mosaicUrl);
+                return;
+            }
+            const rects = new Map(indices.map((index, k) => [index, layout.rects[k]] as const));
+            setAtlas({ mosaicUrl, thumbSize: layout.thumb_size, columns: layout.columns, rects });
+        }).catch((error) => {
+            console.error('Error loading thumbnails:', error);
+        });
+        return () => {
+            cancelled = true;
+        };
+    }, [hoveredIndex, epoch, allEpochData, dataType, contentPath]);
+
+    // release the previous mosaic once it is replaced
+    useEffect(() => {
+        return () => {
+            if (atlas) {
+                URL.revokeObjectURL(atlas.mosaicUrl);
+            }
+        };
+    }, [atlas]);
+
     return (
         <CompactInfoColumn>
             <FunctionalBlock label="Basic Information">
@@ -79,6 +149,8 @@ export function SamplePanel() {
                                 <EmptyImage>No image</EmptyImage>
                             ) : data ? (
                                 <CompactImage src={data} alt="Sample" />
+                            ) : atlas?.rects.get(hoveredIndex) ? (
+                                <AtlasThumbnail atlas={atlas} index={hoveredIndex} size={80} />
                             ) : (
                                 <EmptyImage>No image</EmptyImage>
                             )}
@@ -131,6 +203,7 @@ export function SamplePanel() {
                     <CompactNeighborList>
                         {hoveredIndex !== undefined && allEpochData[epoch]?.originalNeighbors[hoveredIndex]?.map((neighbor, index) => (
                             <HighDimNeighborItem key={index}>
+                                <AtlasThumbnail atlas={atlas} index={neighbor} size={NEIGHBOR_THUMB_SIZE} />
                                 {neighbor}.{getDisplayLabel(neighbor)}
                             </HighDimNeighborItem>
                         ))}
@@ -144,6 +217,7 @@ export function SamplePanel() {
                             const isCorrect = allEpochData[epoch].originalNeighbors[hoveredIndex]?.includes(neighbor);
                             return (
                                 <ProjectionNeighborItem key={index} $correct={isCorrect}>
+                                    <AtlasThumbnail atlas={atlas} index={neighbor} size={NEIGHBOR_THUMB_SIZE} />
                                     {neighbor}.{getDisplayLabel(neighbor)}
                                 </ProjectionNeighborItem>
                             );
@@ -190,6 +264,14 @@ const CompactImage = styled.img`
     object-fit: cover;
 `;
 
+const ThumbnailSprite = styled.div`
+    display: inline-block;
+    vertical-align: middle;
+    margin-right: 4px;
+    background-repeat: no-repeat;
+    image-rendering: pixelated;
+`;
+
 const EmptyImage = styled.div`
     color: #bfbfbf;
     font-size: 11px;
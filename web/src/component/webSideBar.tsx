@@ -33,6 +33,10 @@ export default function WebSideBar() {
     );
   };
 
+  const cancelVisualizing = () => {
+    window.postMessage({ command: 'cancelVisualizing' }, '*');
+  };
+
   const loadVisualization = () => {
     window.postMessage(
       {
@@ -88,6 +92,7 @@ export default function WebSideBar() {
         <Button type="primary" onClick={startVisualizing} style={{ flex: 1 }}>Start Visualizing</Button>
         <Button onClick={loadVisualization} style={{ flex: 1 }}>Load Visualization</Button>
       </div>
+      <Button danger onClick={cancelVisualizing}>Cancel Visualizing</Button>
     </div>
   );
 }
@@ -21,6 +21,7 @@ export type EpochData = {
 export type BaseMutableGlobalStore = {
     // Basic configuration
     contentPath: string;
+    visualizationID: string;
     dataType: 'Image' | 'Text';
     taskType: string;
     
@@ -83,6 +84,7 @@ export type BaseMutableGlobalStore = {
 export let initMutableGlobalStore: BaseMutableGlobalStore = {
     // Basic configuration
     contentPath: '',
+    visualizationID: '',
     dataType: 'Image',
     taskType: '',
     
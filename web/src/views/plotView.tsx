@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { message, Tabs } from 'antd';
 import { MainBlock } from '../component/main-block';
 import { FunctionPanel } from '../component/function-panel';
@@ -14,11 +14,22 @@ import "../index.css";
 import { Panel, PanelGroup, PanelResizeHandle } from 'react-resizable-panels';
 
 const LOG_PREFIX = '[TTVisualizer]';
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_MESSAGE_KEY = 'visualizing-job';
 
 function logWithTimestamp(message: string): void {
     console.log(`${LOG_PREFIX}[${new Date().toISOString()}] ${message}`);
 }
 
+function describeJobProgress(job: BackendAPI.VisualizingJob): string {
+    if (job.status === 'pending' || !job.stage) {
+        return 'Visualization queued...';
+    }
+    const { current, total } = job.progress[job.stage] || {};
+    const counter = current != null && total ? ` ${current}/${total}` : '';
+    return `Visualizing: ${job.stage}${counter}`;
+}
+
 createRoot(document.getElementById("root")!).render(
     <StrictMode>
         <AppCombinedView />
@@ -29,16 +40,19 @@ createRoot(document.getElementById("root")!).render(
 function MessageHandler() {
     // State from unified store
     const { 
-        setContentPath, setAvailableEpochs, setDataType, setTaskType,
+        setContentPath, setVisualizationID, setAvailableEpochs, setDataType, setTaskType,
         setTextData, setTokenList, setInherentLabelData,
         setColorDict, setLabelDict, setProgress, setValue
     } = useDefaultStore([
-        'setContentPath', 'setAvailableEpochs', 'setDataType', 'setTaskType',
+        'setContentPath', 'setVisualizationID', 'setAvailableEpochs', 'setDataType', 'setTaskType',
         'setTextData', 'setTokenList', 'setInherentLabelData',
         'setColorDict', 'setLabelDict', 'setProgress', 'setValue'
     ]);
 
-    // Start visualizing process
+    // Id of the visualization job started from this view, the one a cancel request applies to
+    const activeJobID = useRef<string | null>(null);
+
+    // Start visualizing process, follow the job until it ends and load the visualization once it is finished
     const handleStartVisualizing = async (
         contentPath: string,
         visualizationMethod: string,
@@ -47,13 +61,63 @@ function MessageHandler() {
         taskType: string,
         visConfig: any
     ) => {
+        let jobID: string;
         try {
             let startTime = Date.now();
-            await BackendAPI.triggerStartVisualizing(contentPath, visualizationMethod, visualizationID, dataType, taskType, visConfig);
-            logWithTimestamp(`Visualization process started in backend. timeCost=${Date.now() - startTime}ms`);
+            const response = await BackendAPI.triggerStartVisualizing(contentPath, visualizationMethod, visualizationID, dataType, taskType, visConfig);
+            jobID = response.job_id;
+            logWithTimestamp(`Visualization job submitted. job_id=${jobID} timeCost=${Date.now() - startTime}ms`);
         } catch (error) {
             console.error('Error starting visualization process:', error);
             message.error('Failed to start visualization process');
+            return;
+        }
+
+        activeJobID.current = jobID;
+        try {
+            while (true) {
+                const { job } = await BackendAPI.getVisualizingJob(jobID);
+                if (job.status === 'finished') {
+                    message.success({ content: 'Visualization finished', key: JOB_MESSAGE_KEY });
+                    logWithTimestamp(`Visualization job finished. job_id=${jobID}`);
+                    await handleLoadVisualization({ contentPath, visualizationMethod, dataType, taskType }, visualizationID);
+                    break;
+                }
+                if (job.status === 'failed') {
+                    console.error(`Visualization job ${jobID} failed:`, job.error);
+                    message.error({ content: `Visualization failed${job.error ? `: ${job.error.trim().split('\n').pop()}` : ''}`, key: JOB_MESSAGE_KEY });
+                    break;
+                }
+                if (job.status === 'cancelled') {
+                    message.warning({ content: 'Visualization cancelled', key: JOB_MESSAGE_KEY });
+                    break;
+                }
+                message.loading({ content: describeJobProgress(job), key: JOB_MESSAGE_KEY, duration: 0 });
+                await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+            }
+        } catch (error) {
+            console.error('Error following visualization job:', error);
+            message.error({ content: 'Lost track of the visualization job', key: JOB_MESSAGE_KEY });
+        } finally {
+            if (activeJobID.current === jobID) {
+                activeJobID.current = null;
+            }
+        }
+    }
+
+    // Cancel the visualization job started from this view, the polling loop reports the cancellation
+    const handleCancelVisualizing = async () => {
+        const jobID = activeJobID.current;
+        if (!jobID) {
+            message.info('No visualization job is running');
+            return;
+        }
+        try {
+            await BackendAPI.cancelVisualizingJob(jobID);
+            logWithTimestamp(`Visualization job cancel requested. job_id=${jobID}`);
+        } catch (error) {
+            console.error('Error cancelling visualization job:', error);
+            message.error('Failed to cancel the visualization job');
         }
     }
 
@@ -66,6 +130,7 @@ function MessageHandler() {
             
             // Set basic configuration
             setContentPath(contentPath);
+            setVisualizationID(visualizationID);
             setDataType(dataType);
             setTaskType(taskType);
             
@@ -87,8 +152,23 @@ function MessageHandler() {
             setColorDict(colorMap);
             setLabelDict(labelMap);
 
-            const labelsResponse = await BackendAPI.getAttributeResource(contentPath, epochs[0], 'label');
-            setInherentLabelData(labelsResponse.label || []);
+            // Labels and the predicted classes of all epochs as typed columns in one request, per-epoch json otherwise
+            const isClassification = taskType === 'Classification';
+            const predictedClasses: Record<number, number[]> = {};
+            try {
+                const { arrays } = await BackendAPI.fetchAttributeColumns(contentPath, isClassification ? ['label', 'prediction'] : ['label'], epochs);
+                setInherentLabelData(Array.from(arrays['label'].data));
+                if (arrays['prediction']) {
+                    const sampleCount = arrays['prediction'].shape[1];
+                    Array.from(arrays['epochs'].data).forEach((epoch, t) => {
+                        predictedClasses[epoch] = Array.from(arrays['prediction'].data.subarray(t * sampleCount, (t + 1) * sampleCount));
+                    });
+                }
+            } catch (error) {
+                console.warn('Attribute columns request failed, loading labels as json:', error);
+                const labelsResponse = await BackendAPI.getAttributeResource(contentPath, epochs[0], 'label');
+                setInherentLabelData(labelsResponse.label || []);
+            }
             
             // Load text data if text type
             if (dataType === 'Text') {
@@ -106,6 +186,16 @@ function MessageHandler() {
             let globalMinX = Infinity, globalMaxX = -Infinity;
             let globalMinY = Infinity, globalMaxY = -Infinity;
 
+            // Prefetch the projections of all epochs in one request, fall back to per-epoch requests
+            let trajectory: Record<number, number[][]> = {};
+            try {
+                const trajectoryStart = Date.now();
+                trajectory = await BackendAPI.fetchProjectionTrajectory(contentPath, visualizationID, epochs);
+                logWithTimestamp(`Projection trajectory received. epochs=${epochs.length} timeCost=${Date.now() - trajectoryStart}ms`);
+            } catch (error) {
+                console.warn('Projection trajectory request failed, loading epochs one by one:', error);
+            }
+
             for (const epochNum of epochs) {
                 const epochRequestStart = new Date();
                 if (!firstEpochRequestTimestamp) {
@@ -117,28 +207,32 @@ function MessageHandler() {
 
                 allEpochDataTemp = { ...allEpochDataTemp, [epochNum]: {} };
 
-                // Load main plot data
-                const projection = await BackendAPI.fetchEpochProjection(contentPath, visualizationID, epochNum);
+                // Load plot, neighbors, prediction and background data, the requests of one epoch run concurrently
+                const [projection, originalNeighbors, projectionNeighbors, predictionResponse, background] = await Promise.all([
+                    epochNum in trajectory
+                        ? Promise.resolve({ projection: trajectory[epochNum] })
+                        : BackendAPI.fetchEpochProjection(contentPath, visualizationID, epochNum),
+                    BackendAPI.getOriginalNeighbors(contentPath, epochNum),
+                    BackendAPI.getProjectionNeighbors(contentPath, visualizationID, epochNum),
+                    isClassification ? BackendAPI.getAttributeResource(contentPath, epochNum, 'prediction') : Promise.resolve(undefined),
+                    isClassification ? BackendAPI.getBackground(contentPath, visualizationID, epochNum) : Promise.resolve(undefined),
+                ]);
                 allEpochDataTemp[epochNum]['projection'] = projection.projection || [];
-
-                // Load neighbors data
-                const originalNeighbors = await BackendAPI.getOriginalNeighbors(contentPath, epochNum);
-                const projectionNeighbors = await BackendAPI.getProjectionNeighbors(contentPath, visualizationID, epochNum);
                 allEpochDataTemp[epochNum]['originalNeighbors'] = originalNeighbors.neighbors || [];
                 allEpochDataTemp[epochNum]['projectionNeighbors'] = projectionNeighbors.neighbors || [];
 
-                if (taskType === 'Classification') {
-                    const predictionResponse = await BackendAPI.getAttributeResource(contentPath, epochNum, 'prediction');
+                if (isClassification) {
                     allEpochDataTemp[epochNum]['predProbability'] = predictionResponse.prediction || [];
 
-                    let predictions: number[] = [];
-                    for (const prob of allEpochDataTemp[epochNum]['predProbability']) {
-                        const predClass = prob.indexOf(Math.max(...prob));
-                        predictions.push(predClass);
+                    // predicted classes come with the attribute columns, argmax the probabilities without them
+                    let predictions: number[] = predictedClasses[epochNum] || [];
+                    if (!(epochNum in predictedClasses)) {
+                        for (const prob of allEpochDataTemp[epochNum]['predProbability']) {
+                            const predClass = prob.indexOf(Math.max(...prob));
+                            predictions.push(predClass);
+                        }
                     }
                     allEpochDataTemp[epochNum]['prediction'] = predictions;
-
-                    const background = await BackendAPI.getBackground(contentPath, visualizationID, epochNum);
                     allEpochDataTemp[epochNum]['background'] = background || '';
                 }
 
@@ -195,6 +289,9 @@ function MessageHandler() {
             case 'startVisualizing':
                 await handleStartVisualizing(data.contentPath, data.visualizationMethod, data.visualizationID, data.dataType, data.taskType, data.visConfig);
                 break;
+            case 'cancelVisualizing':
+                await handleCancelVisualizing();
+                break;
             case 'loadVisualization':
                 await handleLoadVisualization(data.config, data.visualizationID);
                 break;